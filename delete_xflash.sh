@@ -3,9 +3,6 @@
 # Erase your CORE module with this nice script #
 ################################################
 
-TARGET_PATH="targets"
-
-
 if [ $# -eq 0 ]
 then
     echo "No target supplied"
@@ -15,25 +12,19 @@ fi
 
 TARGET=$1
 
+SCRIPT=$(readlink -f "$0")
+SCRIPTPATH=$(dirname "$SCRIPT")
 
-if [ $TARGET == "c22" ] 
-then
-    TARGET_FILE="SOMANET-C22.xn"
-elif [ $TARGET == "c2x" ] 
+# Resolve alias (c22, c2x, ...) to .xn file, see "target_registry.py list"
+TARGET_FILE=$(python3 "$SCRIPTPATH/target_registry.py" path "$TARGET")
+if [ $? -ne 0 ]
 then
-    TARGET_FILE="SOMANET-CoreC2X.xn"
-else
     echo "Wrong target"
-    echo "Use 'c22' or 'c2x'"
     exit 1
 fi
 
-
-SCRIPT=$(readlink -f "$0")
-SCRIPTPATH=$(dirname "$SCRIPT")
-
 echo "Delete target: " $TARGET
 
 # Erase chip
-xflash --erase-all --target-file $SCRIPTPATH/$TARGET_PATH/$TARGET_FILE
+xflash --erase-all --target-file "$TARGET_FILE"
 echo "done...exit"
@@ -5,6 +5,16 @@ MASTERINDEX=0
 NODEINDEX=""
 OPTSTRING="hn:a"
 
+# State polling: first interval, upper bound of the doubled interval and
+# deadlines of both boot stages (all in milliseconds)
+POLL_START_MS=50
+POLL_MAX_MS=500
+STAGE1_TIMEOUT_MS=10000
+STAGE2_TIMEOUT_MS=20000
+
+# Duration of every stage per node in milliseconds, key is "<index>,<stage>"
+declare -A STAGE_TIME
+
 #
 # Helper Functions
 #
@@ -20,73 +30,146 @@ printusage ()
     echo "<filename>  full path of the firmware to write to the node(s)"
 }
 
+# Current time in milliseconds
+now_ms ()
+{
+    echo $(( $( date +%s%N ) / 1000000 ))
+}
+
+# Format milliseconds as seconds with three decimals
+ms_to_sec ()
+{
+    printf "%d.%03d" $(( $1 / 1000 )) $(( $1 % 1000 ))
+}
+
+# Read the current state of node <index>
+node_state ()
+{
+    ${ECAT} -m ${MASTERINDEX} slaves -p $1 | cut -d ' ' -f 5
+}
+
+# Wait until a node reaches one of the given states
+#
+# Usage: wait_node_state <index> <deadline_ms> <marker> <resend> <state> [<state> ...]
+#
+# The state is polled with a short initial interval which is doubled after every
+# miss up to POLL_MAX_MS, so fast nodes are detected within a few ten milliseconds
+# while slow ones do not flood the master with requests. If <resend> is not empty,
+# this state is requested again before every poll. <marker> is printed for every
+# miss. The last read state is stored in NODESTATE. Returns 1 if the deadline is
+# exceeded.
+wait_node_state ()
+{
+    local index=$1
+    local deadline=$(( $( now_ms ) + $2 ))
+    local marker=$3
+    local resend=$4
+    shift 4
+
+    local interval=${POLL_START_MS}
+    local remaining
+    local s
+
+    while true
+    do
+        if [ -n "${resend}" ]
+        then
+            ${ECAT} states -p ${index} ${resend}
+        fi
+
+        NODESTATE=$( node_state ${index} )
+        for s in "$@"
+        do
+            if [ x"${NODESTATE}" == x"${s}" ]
+            then
+                return 0
+            fi
+        done
+
+        remaining=$(( deadline - $( now_ms ) ))
+        if (( remaining <= 0 ))
+        then
+            return 1
+        fi
+        if (( interval > remaining ))
+        then
+            interval=${remaining}
+        fi
+
+        echo -n "${marker}"
+        sleep $( ms_to_sec ${interval} )
+
+        interval=$(( interval * 2 ))
+        if (( interval > POLL_MAX_MS ))
+        then
+            interval=${POLL_MAX_MS}
+        fi
+    done
+}
+
+# Print the recorded stage durations of a node
+print_node_timing ()
+{
+    local index=$1
+    echo "Node ${index}: first stage $( ms_to_sec ${STAGE_TIME[${index},1]:-0} ) s," \
+         "second stage $( ms_to_sec ${STAGE_TIME[${index},2]:-0} ) s," \
+         "transfer $( ms_to_sec ${STAGE_TIME[${index},foe]:-0} ) s"
+}
+
 # Update a single node
 #
 # Put node into boot mode and check if the boot stete is reached
 # Setting the boot mode has to be done two times to confirm the BOOT state
 # after the bootmanager is loaded.
+# The duration of each stage is recorded in STAGE_TIME[<index>,<stage>].
 update_node ()
 {
     INDEX=$@
     shift $@
 
+    local t0
+
     # The first time the slaves receives the BOOT state command it will reboot und result in
     # INIT + E state because no valid firmware is present.
 
+    t0=$( now_ms )
     ${ECAT} states -p ${INDEX} BOOT
-    #NODESTATE=$( ${ECAT} slaves -p ${INDEX} | cut -d ' ' -f 5 )
     NODESTATE=""
 
-    timeoutcounter=10
-
-    while [ -z "${NODESTATE}" ]
-    do
-        (( timeoutcounter-- ))
-        if (( timeoutcounter <= 0 ))
+    wait_node_state ${INDEX} ${STAGE1_TIMEOUT_MS} ":" "" INIT BOOT
+    if [ $? -ne 0 ]
+    then
+        STAGE_TIME[${INDEX},1]=$(( $( now_ms ) - t0 ))
+        if [ -n "${NODESTATE}" ]
         then
+            echo -e "\n[ERROR] failed to get pre-boot mode!"
+        else
             echo -e "\nError: timeout waiting for node to reach first stage"
-            return 1
         fi
-
-        echo -n ":"
-        sleep 1
-        NODESTATE=$( ${ECAT} -m ${MASTERINDEX} slaves -p ${INDEX} | cut -d ' ' -f 5 )
-    done
-
-    if [ x"${NODESTATE}" != x"INIT" -a x"${NODESTATE}" != x"BOOT" ]
-    then
-        echo "[ERROR] failed to get pre-boot mode!"
         return 1
     fi
+    STAGE_TIME[${INDEX},1]=$(( $( now_ms ) - t0 ))
 
     # We have to wait for a while to let the EtherCAT master realize what happend
     # on the bus before we can finally switch to the BOOT state to prepare the file
     # transfer.
 
-    timeoutcounter=20
-
     # second time of BOOT set.
-    #NODESTATE=$( ${ECAT} slaves -p ${INDEX} | grep -e "^${INDEX}" | cut -d ' ' -f 5 )
-    NODESTATE=""
-
-    while [ x"${NODESTATE}" != x"BOOT" ]
-    do
-        (( timeoutcounter-- ))
-        if (( timeoutcounter <= 0 ))
-        then
-            echo -e "\nError: timeout waiting for node to reach second stage"
-            return 1
-        fi
-
-        echo -n "."
-        ${ECAT} states -p ${INDEX} BOOT
-        sleep 1
-        NODESTATE=$( ${ECAT} -m ${MASTERINDEX} slaves -p ${INDEX} | cut -d ' ' -f 5 )
-    done
+    t0=$( now_ms )
+    wait_node_state ${INDEX} ${STAGE2_TIMEOUT_MS} "." BOOT BOOT
+    if [ $? -ne 0 ]
+    then
+        STAGE_TIME[${INDEX},2]=$(( $( now_ms ) - t0 ))
+        echo -e "\nError: timeout waiting for node to reach second stage"
+        return 1
+    fi
+    STAGE_TIME[${INDEX},2]=$(( $( now_ms ) - t0 ))
 
     # transfer the binary
+    t0=$( now_ms )
     ${ECAT} -m ${MASTERINDEX} foe_write -p ${INDEX} ${FILENAME}
     ecaterr=$?
+    STAGE_TIME[${INDEX},foe]=$(( $( now_ms ) - t0 ))
     if [ ${ecaterr} -ne 0 ]
     then
         echo "Error transfer new firmware!"
@@ -94,6 +177,7 @@ update_node ()
     fi
 
     echo "Firmware transfer complete"
+    print_node_timing ${INDEX}
 
     return 0
 }
@@ -104,7 +188,7 @@ update_cia_slaves()
     ret=0
     ALL_IDX=$( ${ECAT} -m ${MASTERINDEX} slaves | awk '/CiA402 Drive/ { printf "%d ", $1 ; }' )
 
-    if [ -z ${ALL_IDX} ]
+    if [ -z "${ALL_IDX}" ]
     then
         echo "Warning no CiA402 slave found, please check your network"
         return 1
@@ -120,10 +204,16 @@ update_cia_slaves()
         fi
     done
 
+    echo
+    echo "Timing summary:"
+    for idx in ${ALL_IDX}
+    do
+        print_node_timing ${idx}
+    done
+
     return ${ret}
 }
 
-
 #
 # Main
 #
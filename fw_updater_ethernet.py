@@ -0,0 +1,329 @@
+#!/usr/bin/python3
+
+"""
+    SOMANET Ethernet Firmware Uploader (TFTP)
+
+    Pure Python TFTP client (RFC 1350) with option negotiation for block size,
+    transfer size and window size (RFC 2347, 2348, 2349, 7440). Nodes which reject
+    the options are served with plain 512 byte lockstep transfers.
+"""
+
+import os
+import sys
+import time
+import socket
+import struct
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+logger = logging.getLogger(__name__)
+
+NODE_IP = '192.168.0.11'
+TFTP_PORT = 69
+
+# TFTP opcodes
+OP_RRQ = 1
+OP_WRQ = 2
+OP_DATA = 3
+OP_ACK = 4
+OP_ERROR = 5
+OP_OACK = 6
+
+# TFTP error codes
+ERR_UNKNOWN_TID = 5
+ERR_OPTION = 8
+
+DEFAULT_BLKSIZE = 512
+# Largest block which fits into a standard Ethernet frame without IP fragmentation
+ETH_BLKSIZE = 1428
+DEFAULT_WINDOWSIZE = 8
+
+
+class ExceptionTFTP(Exception):
+    pass
+
+
+class ExceptionTFTPTimeout(ExceptionTFTP):
+    pass
+
+
+class ExceptionTFTPOptions(ExceptionTFTP):
+    pass
+
+
+class TFTPUploader:
+
+    def __init__(self, host, port=TFTP_PORT, blksize=ETH_BLKSIZE, windowsize=DEFAULT_WINDOWSIZE,
+                 timeout=1.0, retries=5, bind=''):
+        """
+        TFTP client to push a file to a single node.
+        :param host: IP address or host name of node
+        :type host: str
+        :param port: TFTP server port of node
+        :type port: int
+        :param blksize: Requested block size. 512 disables the option.
+        :type blksize: int
+        :param windowsize: Requested window size. 1 disables the option.
+        :type windowsize: int
+        :param timeout: Timeout in seconds, until a packet is resent
+        :type timeout: float
+        :param retries: Max resend tries per packet
+        :type retries: int
+        :param bind: Local address to send from (e.g. master IP of the interface)
+        :type bind: str
+        """
+        self.__host = socket.gethostbyname(host)
+        self.__port = port
+        self.__blksize = blksize
+        self.__windowsize = windowsize
+        self.__timeout = timeout
+        self.__retries = retries
+        self.__bind = bind
+
+    @property
+    def host(self):
+        return self.__host
+
+    @staticmethod
+    def _make_request(opcode, file_name, options):
+        pkt = struct.pack('!H', opcode) + file_name.encode() + b'\x00' + b'octet\x00'
+        for key, value in options.items():
+            pkt += key.encode() + b'\x00' + str(value).encode() + b'\x00'
+        return pkt
+
+    @staticmethod
+    def _parse_options(payload):
+        """
+        Parse the options of an OACK. Raises ExceptionTFTPOptions, if a value is not a valid number.
+        :rtype: dict
+        """
+        fields = payload.split(b'\x00')
+        options = {}
+        try:
+            for key, value in zip(fields[0::2], fields[1::2]):
+                if key:
+                    options[key.decode().lower()] = int(value)
+        except ValueError:
+            raise ExceptionTFTPOptions(f'Malformed option acknowledgement {payload!r}')
+        if not 8 <= options.get('blksize', DEFAULT_BLKSIZE) <= 65464 or options.get('windowsize', 1) < 1:
+            raise ExceptionTFTPOptions(f'Invalid option values {options}')
+        return options
+
+    @staticmethod
+    def _parse_error(pkt):
+        code = struct.unpack('!H', pkt[2:4])[0]
+        msg = pkt[4:].split(b'\x00')[0].decode(errors='backslashreplace')
+        return code, msg
+
+    def _recv(self, sock, tid=None):
+        """
+        Receive the next packet from the node. Packets from foreign ports are answered
+        with "Unknown transfer ID" and skipped.
+        :return: packet and address of sender
+        :rtype: tuple
+        """
+        while True:
+            pkt, addr = sock.recvfrom(65536)
+            if addr[0] != self.__host:
+                continue
+            if tid and addr != tid:
+                sock.sendto(struct.pack('!HH', OP_ERROR, ERR_UNKNOWN_TID) + b'Unknown transfer ID\x00', addr)
+                continue
+            return pkt, addr
+
+    def _write_request(self, sock, file_name, options):
+        """
+        Send WRQ and wait for the first reply.
+        :return: negotiated block size, window size and transfer ID (address of node)
+        :rtype: tuple
+        """
+        pkt = self._make_request(OP_WRQ, file_name, options)
+        for _ in range(self.__retries + 1):
+            sock.sendto(pkt, (self.__host, self.__port))
+            try:
+                res, tid = self._recv(sock)
+            except socket.timeout:
+                continue
+
+            opcode = struct.unpack('!H', res[:2])[0]
+            if opcode == OP_OACK:
+                try:
+                    accepted = self._parse_options(res[2:])
+                except ExceptionTFTPOptions as e:
+                    # Terminate the transfer, the node waits for the first data block
+                    sock.sendto(struct.pack('!HH', OP_ERROR, ERR_OPTION) + str(e).encode() + b'\x00', tid)
+                    raise
+                return accepted.get('blksize', DEFAULT_BLKSIZE), accepted.get('windowsize', 1), tid
+            if opcode == OP_ACK and struct.unpack('!H', res[2:4])[0] == 0:
+                # Node ignored all options
+                return DEFAULT_BLKSIZE, 1, tid
+            if opcode == OP_ERROR:
+                code, msg = self._parse_error(res)
+                if options and code in (0, ERR_OPTION):
+                    raise ExceptionTFTPOptions(msg)
+                raise ExceptionTFTP(f'{self.__host}: Error {code}: {msg}')
+            raise ExceptionTFTP(f'{self.__host}: Unexpected opcode {opcode}')
+
+        raise ExceptionTFTPTimeout(f'{self.__host}: No reply to write request')
+
+    def _send_data(self, sock, tid, data, blksize, windowsize):
+        """
+        Send data in windows of "windowsize" blocks. The node acknowledges the last block
+        of a window. An earlier block number means a loss, so the window restarts after it.
+        Nodes may acknowledge every block received after a loss, so the window is resent only
+        once per lost block. Further ACKs of that block are ignored until progress or a timeout.
+        """
+        view = memoryview(data)
+        # The last block is always shorter than blksize, even if it is empty
+        n_blocks = len(data) // blksize + 1
+        acked = 0
+        retries = 0
+        # Number of acknowledged blocks, when the window was restarted last because of a loss
+        resent = None
+
+        while acked < n_blocks:
+            end = min(acked + windowsize, n_blocks)
+            for i in range(acked, end):
+                header = struct.pack('!HH', OP_DATA, (i + 1) & 0xffff)
+                sock.sendto(header + view[i * blksize:(i + 1) * blksize], tid)
+
+            try:
+                while True:
+                    res, _ = self._recv(sock, tid)
+                    opcode = struct.unpack('!H', res[:2])[0]
+                    if opcode == OP_ERROR:
+                        code, msg = self._parse_error(res)
+                        raise ExceptionTFTP(f'{self.__host}: Error {code}: {msg}')
+                    if opcode != OP_ACK:
+                        continue
+                    block = struct.unpack('!H', res[2:4])[0]
+                    delta = (block - acked) & 0xffff
+                    if delta > end - acked:
+                        # Duplicate ACK of an older window
+                        continue
+                    if delta == 0 and resent == acked:
+                        # Same loss, the window was resent already
+                        continue
+                    break
+            except socket.timeout:
+                retries += 1
+                if retries > self.__retries:
+                    raise ExceptionTFTPTimeout(f'{self.__host}: Timeout at block {acked + 1}')
+                # Nothing is in flight anymore, the next ACK of this block is a new loss
+                resent = None
+                continue
+
+            if delta:
+                acked += delta
+                retries = 0
+            else:
+                retries += 1
+                if retries > self.__retries:
+                    raise ExceptionTFTP(f'{self.__host}: Too many retransmissions at block {acked + 1}')
+            if acked < end:
+                resent = acked
+
+    def put(self, data, file_name):
+        """
+        Upload data to the node.
+        :param data: File content
+        :type data: bytes
+        :param file_name: Remote file name
+        :type file_name: str
+        :return: Transfer statistics (host, size, duration, rate, blksize, windowsize)
+        :rtype: dict
+        """
+        options = {}
+        if self.__blksize != DEFAULT_BLKSIZE:
+            options['blksize'] = self.__blksize
+        options['tsize'] = len(data)
+        if self.__windowsize > 1:
+            options['windowsize'] = self.__windowsize
+
+        t0 = time.time()
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(self.__timeout)
+            sock.bind((self.__bind, 0))
+            try:
+                blksize, windowsize, tid = self._write_request(sock, file_name, options)
+            except ExceptionTFTPOptions as e:
+                logger.info(f'{self.__host}: Options rejected ({e}). Fall back to lockstep transfer')
+                blksize, windowsize, tid = self._write_request(sock, file_name, {})
+
+            self._send_data(sock, tid, data, blksize, windowsize)
+
+        duration = time.time() - t0
+        return {
+            'host': self.__host,
+            'size': len(data),
+            'duration': duration,
+            'rate': len(data) / duration if duration else 0,
+            'blksize': blksize,
+            'windowsize': windowsize,
+        }
+
+
+def upload(hosts, binary_path, file_name=None, jobs=None, **kwargs):
+    """
+    Upload a firmware to many nodes concurrently.
+    :param hosts: List of node IPs
+    :type hosts: list
+    :param binary_path: Path to firmware
+    :type binary_path: str
+    :param file_name: Remote file name. Default is the base name of the firmware.
+    :type file_name: str
+    :param jobs: Max number of concurrent transfers. Default is one per node.
+    :type jobs: int
+    :param kwargs: Arguments for TFTPUploader
+    :return: Statistics per node. Failed nodes have an "error" entry.
+    :rtype: list
+    """
+    with open(binary_path, 'rb') as f:
+        data = f.read()
+    if not file_name:
+        file_name = os.path.basename(binary_path)
+
+    def _put(host):
+        try:
+            return TFTPUploader(host, **kwargs).put(data, file_name)
+        except (ExceptionTFTP, OSError) as e:
+            return {'host': host, 'error': str(e)}
+
+    with ThreadPoolExecutor(max_workers=jobs or len(hosts)) as executor:
+        return list(executor.map(_put, hosts))
+
+
+def _print_result(res):
+    if 'error' in res:
+        logger.error(f"{res['host']}: FAILED! {res['error']}")
+        return
+    logger.info(f"{res['host']}: {res['size']} bytes in {res['duration']:.2f} s "
+                f"({res['rate'] / 1024:.1f} KiB/s, blksize {res['blksize']}, windowsize {res['windowsize']})")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Firmware update over ethernet (TFTP)')
+    parser.add_argument('binary', help='Path to binary')
+    parser.add_argument('-n', '--node', nargs='+', dest='nodes', metavar='IP', default=[NODE_IP], help='Node IP(s)')
+    parser.add_argument('-b', '--bind', dest='bind', default='', help='Local IP to send from (e.g. 192.168.0.2)')
+    parser.add_argument('-p', '--port', dest='port', type=int, default=TFTP_PORT, help='TFTP port of nodes')
+    parser.add_argument('-s', '--blksize', dest='blksize', type=int, default=ETH_BLKSIZE, help='Requested block size')
+    parser.add_argument('-w', '--windowsize', dest='windowsize', type=int, default=DEFAULT_WINDOWSIZE, help='Requested window size')
+    parser.add_argument('-t', '--timeout', dest='timeout', type=float, default=1.0, help='Retransmission timeout in seconds')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, help='Max number of concurrent transfers')
+
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.binary):
+        logger.error(f'Error: "{args.binary}" does not exist')
+        sys.exit(1)
+
+    results = upload(args.nodes, args.binary, jobs=args.jobs, port=args.port, blksize=args.blksize,
+                     windowsize=args.windowsize, timeout=args.timeout, bind=args.bind)
+    for r in results:
+        _print_result(r)
+
+    sys.exit(1 if any('error' in r for r in results) else 0)
@@ -14,10 +14,12 @@ import re
 import threading
 import errno
 import zipfile
-import tempfile
-import glob
 import logging
 import platform
+import atexit
+import json
+import zlib
+import codecs
 
 from ymodem.YModem import YModem
 
@@ -38,9 +40,64 @@ class ExceptionLRZSZMissing(ExceptionUART):
     pass
 
 
+class ExceptionVerify(ExceptionUART):
+    pass
+
+
+# Bootloader commands, which may report the CRC-32 of a file ("<cmd> <file>"). The first one, whose reply
+# has a CRC, is used.
+VERIFY_CMDS = ('crc', 'crc32', 'checksum')
+# Line of the reply with the CRC only: "CRC: 0x1a2b3c4d", "crc32 of app_x.bin = 1a2b3c4d" or "1a2b3c4d".
+# Hex numbers in an echoed command or in file names are not taken.
+re_crc = re.compile(r'^\s*(?:(?:crc-?(?:32)?|checksum)\b[^:=\n]*[:=]\s*)?(?:0x)?([0-9a-fA-F]{8})\s*$', re.I | re.M)
+
+# Size and CRC-32 of local images, keyed by path, size and mtime
+CHECKSUM_CACHE = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'fw_updater_uart.json')
+# Max. number of images in the cache. Entries of removed files are dropped.
+CHECKSUM_CACHE_SIZE = 64
+
+
+def image_checksum(path):
+    """
+    Size and CRC-32 of an image. The result is cached, so an image is read only once.
+    :param path: Path to image
+    :type path: str
+    :return: Size and CRC-32
+    :rtype: dict
+    """
+    st = os.stat(path)
+    key = '%s:%d:%d' % (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    try:
+        with open(CHECKSUM_CACHE) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    if key in cache:
+        return cache[key]
+
+    crc = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            crc = zlib.crc32(chunk, crc)
+
+    # Entries are in insertion order, keep the newest ones of existing files
+    cache = {k: v for k, v in cache.items() if os.path.exists(k.rsplit(':', 2)[0])}
+    cache = dict(list(cache.items())[-(CHECKSUM_CACHE_SIZE - 1):])
+    cache[key] = {'size': st.st_size, 'crc32': crc}
+
+    try:
+        os.makedirs(os.path.dirname(CHECKSUM_CACHE), exist_ok=True)
+        with open(CHECKSUM_CACHE + '.tmp', 'w') as f:
+            json.dump(cache, f)
+        os.replace(CHECKSUM_CACHE + '.tmp', CHECKSUM_CACHE)
+    except OSError:
+        pass
+    return cache[key]
+
+
 class UARTFWUploader:
 
-    def __init__(self, serial, binary_path=None, baudrate=115200):
+    def __init__(self, serial, binary_path=None, baudrate=115200, transport=None):
         """
         UART Firmware Uploader.
         :param serial: path to serial device (e.g. ttyUSB0 or /dev/ttyUSB0)
@@ -49,6 +106,8 @@ class UARTFWUploader:
         :type binary_path: str
         :param baudrate: Baud rate of serial device. Bootlaoder has 115200. So don't change it!
         :type baudrate: int
+        :param transport: Factory with the signature of serial.Serial, e.g. uart_trace.TracingTransport
+                          or uart_trace.ReplayTransport. Default is serial.Serial.
         """
         self.__binary_path = None
         if binary_path:
@@ -59,10 +118,14 @@ class UARTFWUploader:
         else:
             self.__port = serial
 
-        if not os.path.exists(self.__port) and platform.system() == "Linux":
+        if not transport and not os.path.exists(self.__port) and platform.system() == "Linux":
             raise ExceptionUART(f"Device \"{self.__port}\" does not exists")
 
         self.__baudrate = baudrate
+        self.__transport = transport
+        # Name, size and CRC of the image flashed by flash_fw()
+        self.__flashed = None
+        self.__verify_cmd = None
 
         self.modem = YModem(self.getc, self.putc)
 
@@ -102,6 +165,15 @@ class UARTFWUploader:
         except UnicodeDecodeError:
             logger.error(f'Error: {res}')
 
+    def _open(self, timeout):
+        """
+        Open the serial port through the transport.
+        :param timeout: Read timeout in seconds
+        :type timeout: float
+        """
+        transport = self.__transport or serial.Serial
+        return transport(self.__port, self.__baudrate, timeout=timeout)
+
     def getc(self, size):
         return self.uart.read(size) or None
 
@@ -118,7 +190,7 @@ class UARTFWUploader:
         :return: Received message
         :rtype: binary
         """
-        self.uart = serial.Serial(self.__port, self.__baudrate, timeout=timeout)
+        self.uart = self._open(timeout)
         self.uart.reset_input_buffer()
         _cmd = cmd
 
@@ -143,17 +215,19 @@ class UARTFWUploader:
         self.uart.close()
         return _input
 
-    def __write_file(self, cmd, file_path):
+    def __write_file(self, cmd, file_path, data=None):
         """
         Sends a file to bootloader.
         :param cmd: Command for bootloader. Either "flash" (app) or "write" (all other files).
         :type cmd: str
-        :param file_path: Path to file
+        :param file_path: Path to file. If "data" is given, only its base name is used as file name on the device.
         :type file_path: str
+        :param data: Content to send instead of the file
+        :type data: bytes
         :return: Received message
         :rtype: binary
         """
-        file_size = os.path.getsize(file_path)
+        file_size = len(data) if data is not None else os.path.getsize(file_path)
         # Speed: roughly 8000 bytes/seconds
         timeout = (file_size / 8000) + 1
 
@@ -171,21 +245,25 @@ class UARTFWUploader:
         self._print(res)
         logger.info("")
 
-        self.uart = serial.Serial(self.__port, self.__baudrate, timeout=timeout)
-        self.modem.send_file(file_path)
+        self.uart = self._open(timeout)
+        if data is not None:
+            self.modem.send(data, os.path.basename(file_path), file_size)
+        else:
+            self.modem.send_file(file_path)
         time.sleep(0.01)
 
         res = self.uart.read(self.uart.in_waiting)
         self.uart.close()
         return res
 
-    def __read_file(self, cmd, file_name):
+    def __read_file(self, cmd, file_name, sink=None):
         """
         Read file from flash storage.
         :param cmd: Command for reading (read)
         :type cmd: str
         :param file_name: File which is to be read.
         :type file_name: str
+        :param sink: Receive into this sink (see YModem.recv) instead of a file in the current directory
         """
 
         # Get file size and also check if file is existing on node
@@ -205,11 +283,14 @@ class UARTFWUploader:
         self._print(res)
 
         print()
-        self.uart = serial.Serial(self.__port, self.__baudrate, timeout=timeout)
+        self.uart = self._open(timeout)
         self.uart.reset_input_buffer()
         self.uart.reset_output_buffer()
 
-        self.modem.recv_file(".")
+        if sink is None:
+            self.modem.recv_file(".", write_behind=True)
+        else:
+            self.modem.recv(sink)
         time.sleep(0.01)
 
         if self.uart.in_waiting > 0:
@@ -258,6 +339,57 @@ class UARTFWUploader:
     def boot(self):
         return self._send_cmd('boot')
 
+    def iter_console(self, timeout=None):
+        """
+        Read lines from the opened port as they arrive. Bytes are decoded incrementally and
+        only complete lines are yielded.
+        :param timeout: Stop after this many seconds. None reads until the port is closed.
+        :type timeout: float
+        :return: Generator of (seconds since start, line)
+        :rtype: generator
+        """
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='backslashreplace')
+        t0 = time.monotonic()
+        pending = ''
+        while timeout is None or time.monotonic() - t0 < timeout:
+            data = self.uart.read(self.uart.in_waiting or 1)
+            if not data:
+                continue
+            pending += decoder.decode(data)
+            *lines, pending = pending.split('\n')
+            t = time.monotonic() - t0
+            for line in lines:
+                line = ''.join(c for c in line if c.isprintable())
+                if line:
+                    yield t, line
+
+    def boot_console(self, ready=None, timeout=30):
+        """
+        Boot the firmware and stream its console with timestamps, instead of closing the port.
+        :param ready: Regular expression. Return as soon as a line matches.
+        :type ready: str
+        :param timeout: Max time to stream in seconds
+        :type timeout: float
+        :return: Matching line or None, if "ready" did not match within timeout
+        :rtype: str
+        """
+        re_ready = re.compile(ready) if ready else None
+        self.uart = self._open(0.05)
+        try:
+            self.uart.reset_input_buffer()
+            for c in 'boot':
+                self.uart.write(c.encode())
+                time.sleep(0.002)
+            self.uart.write(b'\r\n')
+
+            for t, line in self.iter_console(timeout):
+                logger.info(f'[{t:8.3f}] {line}')
+                if re_ready and re_ready.search(line):
+                    return line
+        finally:
+            self.uart.close()
+        return None
+
     def remove(self, file_name):
         for f in file_name:
             logger.info(f"Remove: '{f}'")
@@ -278,6 +410,34 @@ class UARTFWUploader:
                 raise ExceptionUART(f'Could not read file {f}')
             self.modem.reset()
 
+    def write_data(self, file_name, data):
+        """
+        Write data from memory to a file on the device, without a temporary file.
+        :param file_name: File name on device
+        :type file_name: str
+        :param data: Content
+        :type data: bytes
+        """
+        logger.info(f"Write: '{file_name}'")
+        if not self.__write_file('write', file_name, bytes(data)):
+            raise ExceptionUART(f'Could not write file {file_name}')
+        self.modem.reset()
+
+    def read_data(self, file_name):
+        """
+        Read a file from the device into memory.
+        :param file_name: File name on device
+        :type file_name: str
+        :return: Content
+        :rtype: bytes
+        """
+        logger.info(f"Read: '{file_name}'")
+        buf = bytearray()
+        if not self.__read_file('read', file_name, buf):
+            raise ExceptionUART(f'Could not read file {file_name}')
+        self.modem.reset()
+        return bytes(buf)
+
     def get_list(self):
         _list = self.send_cmd("getlist")
         file_list = re.findall(r'(.+), size: (\d+)', _list.decode())
@@ -301,17 +461,87 @@ class UARTFWUploader:
 
         file_name = os.path.basename(binary_path)
         if re.match(r"^package.+\.zip$", file_name, re.M):
-            # Unzip package to a temporary directory.
-            dtemp = tempfile.mkdtemp(None, 'fw_updater_uart-')
+            # Send the binary of the package from memory, nothing is extracted
             with zipfile.ZipFile(binary_path) as zf:
-                zf.extractall(dtemp)
-            binary_path = glob.glob(os.path.join(dtemp, '*.bin'))[0]
+                names = sorted(n for n in zf.namelist() if '/' not in n and n.endswith('.bin'))
+                if not names:
+                    raise ExceptionNoBinary(f'No binary in package "{file_name}"')
+                data = zf.read(names[0])
+            self.__flashed = {'name': names[0], 'size': len(data), 'crc32': zlib.crc32(data)}
+            return self.__write_file('flash', names[0], data)
 
         elif not re.match(r'^app.+\.bin$', file_name, re.M):
             raise ExceptionNoBinary(f'Error! "{file_name}" is not a valid binary name. Needs to be "app_*.bin"')
 
+        self.__flashed = dict(image_checksum(binary_path), name=file_name)
         return self.__write_file('flash', binary_path)
 
+    def _remote_crc(self, file_name):
+        """
+        CRC-32 of a file on the device by the checksum command of the bootloader. On first use, the
+        commands of VERIFY_CMDS are tried until one replies with a CRC. This command is kept for this device.
+        :param file_name: File name on device
+        :type file_name: str
+        :return: CRC or None, if the bootloader has no checksum command or its reply has no CRC
+        :rtype: int
+        """
+        if self.__verify_cmd is None:
+            cmds = VERIFY_CMDS
+        else:
+            cmds = [self.__verify_cmd] if self.__verify_cmd else []
+
+        for cmd in cmds:
+            res = self.send_cmd(f'{cmd} {file_name}').decode(errors='backslashreplace')
+            found = re_crc.search(res)
+            if found:
+                self.__verify_cmd = cmd
+                return int(found.group(1), 16)
+        if self.__verify_cmd is None:
+            self.__verify_cmd = ''
+        return None
+
+    def verify(self, binary_path=None, full=False):
+        """
+        Verify a flashed image. Uses the checksum command of the bootloader if it has one,
+        else compares the size in the file list. With "full" or if the reply of the checksum command
+        has no CRC, the file is read back and its CRC is compared.
+        :param binary_path: Path to image. Default is the last image flashed by flash_fw().
+        :type binary_path: str
+        :param full: Read back the whole file
+        :type full: bool
+        :return: Method ("crc", "size" or "read") and remote value
+        :rtype: dict
+        """
+        if binary_path or not self.__flashed:
+            binary_path = binary_path or self.__binary_path
+            if not binary_path:
+                raise ExceptionVerify('No image to verify')
+            local = dict(image_checksum(binary_path), name=os.path.basename(binary_path))
+        else:
+            local = self.__flashed
+        file_name = local['name']
+
+        if not full:
+            remote = self._remote_crc(file_name)
+            if remote is not None:
+                if remote != local['crc32']:
+                    raise ExceptionVerify(f'CRC of "{file_name}" is {remote:08x}, expected {local["crc32"]:08x}')
+                return {'method': 'crc', 'crc32': remote}
+            if self.__verify_cmd:
+                logger.warning(f'No CRC in reply of "{self.__verify_cmd}", read back the file')
+                full = True
+
+        if full:
+            remote = zlib.crc32(self.read_data(file_name))
+            if remote != local['crc32']:
+                raise ExceptionVerify(f'CRC of "{file_name}" is {remote:08x}, expected {local["crc32"]:08x}')
+            return {'method': 'read', 'crc32': remote}
+
+        remote = self.read_file_size(file_name)
+        if remote != local['size']:
+            raise ExceptionVerify(f'Size of "{file_name}" is {remote}, expected {local["size"]}')
+        return {'method': 'size', 'size': remote}
+
     def remove_fw(self):
         """
         Remove firmware
@@ -342,7 +572,13 @@ if __name__ == '__main__':
     parser.add_argument('-w', '--write', nargs='+', dest='write', metavar='FILE', help='Write <FILE> to device', type=str)
     parser.add_argument('-r', '--read', nargs='+', dest='read', metavar='FILE', help='Read <FILE> on device', type=str)
     parser.add_argument('-a', '--app', dest='app', metavar='APP', help='Flash firmware <APP> to device. Can also be a SOMANET firmware package.', type=str)
+    parser.add_argument('-V', '--verify', dest='verify', nargs='?', const='auto', choices=('auto', 'full'),
+                        help='Verify flashed firmware. auto: bootloader CRC or size, full: read back the file')
     parser.add_argument('-b', '--boot', dest='boot', help='Boot firmware', action='store_true')
+    parser.add_argument('--console', dest='console', nargs='?', const=30, type=float, metavar='SECONDS',
+                        help='Stream console output after boot (default 30 s)')
+    parser.add_argument('--ready', dest='ready', metavar='REGEX',
+                        help='Stop streaming as soon as a console line matches <REGEX>. Exit code 1 if it does not')
     parser.add_argument('-l', '--list', dest='getlist', help='Get file list', action='store_true')
     parser.add_argument('-i', '--info', dest='info', help='Get flash storage info', action='store_true')
     parser.add_argument('-c', '--check', dest='check', help='Check the flash storage', action='store_true')
@@ -350,22 +586,40 @@ if __name__ == '__main__':
     parser.add_argument('-bh', '--bootloader-help', dest='help', help='Show bootloader help', action='store_true')
     parser.add_argument('-rm', '--remove', nargs='+', dest='remove', metavar='FILE', help='Remove <FILE> from device', type=str)
     parser.add_argument('-rma', '--remove-app', dest='remove_bin', help='Remove firmware from device', action='store_true')
+    parser.add_argument('--trace', dest='trace', metavar='TRACE', help='Record serial traffic into binary file <TRACE>', type=str)
+    parser.add_argument('--replay', dest='replay', metavar='TRACE', help='Replay recorded <TRACE> instead of using the serial device', type=str)
 
     args = parser.parse_args()
     dev = args.device
-    uart_fw = UARTFWUploader(dev)
+    transport = None
+    if args.replay:
+        from uart_trace import ReplayTransport
+        transport = ReplayTransport(args.replay)
+    elif args.trace:
+        from uart_trace import TracingTransport
+        transport = TracingTransport(args.trace)
+        atexit.register(transport.close)
+    uart_fw = UARTFWUploader(dev, transport=transport)
 
     # Just always send hold
     uart_fw.send_cmd("hold")
 
     for arg, value in vars(args).items():
-        if value is None or not value or arg == "device":
+        if value is None or not value or arg in ("device", "trace", "replay", "console", "ready"):
             continue
 
         if arg == "app":
             logger.info('Flash FW...')
             res = uart_fw.flash_fw(args.app)
             _check_result(res)
+        elif arg == "verify":
+            logger.info('Verify FW...')
+            try:
+                res = uart_fw.verify(full=args.verify == 'full')
+                logger.info(f"Verified by {res['method']}")
+            except ExceptionUART as e:
+                logger.error(f'{e} ...FAILED!')
+                sys.exit(1)
         elif arg == "write":
             uart_fw.write_file(args.write)
             logger.info(f'Done')
@@ -374,8 +628,13 @@ if __name__ == '__main__':
             logger.info(f'Done')
         elif arg == "boot":
             logger.info('Boot device...')
-            res = uart_fw.boot()
-            _check_result(res)
+            if args.console is not None or args.ready:
+                if uart_fw.boot_console(args.ready, args.console or 30) is None and args.ready:
+                    logger.error(f'"{args.ready}" not seen ...FAILED!')
+                    sys.exit(1)
+            else:
+                res = uart_fw.boot()
+                _check_result(res)
         elif arg in ("hold", "check", "info", "version", "help"):
             logger.info(f"{arg}...")
             res = uart_fw.send_cmd(arg)
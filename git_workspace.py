@@ -0,0 +1,281 @@
+#!/usr/bin/python3
+
+"""
+    SOMANET git workspace tool
+
+    status: Find all repositories of a workspace and collect HEAD, branch, dirty state and
+            "git describe" in parallel. HEAD and branch are read from .git directly.
+    clone:  Clone or fetch the SOMANET repositories concurrently, optionally shallow or
+            sharing objects with a local mirror (--reference).
+"""
+
+import os
+import sys
+import json
+import logging
+import subprocess as sp
+from concurrent.futures import ThreadPoolExecutor
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+logger = logging.getLogger(__name__)
+
+SYN_REPO_URL = 'https://github.com/synapticon/'
+SYN_REPOS = ('sc_sncn_motorcontrol', 'sc_sncn_ethercat', 'sc_sncn_ethercat_drive', 'sc_somanet-base')
+
+
+class ExceptionGit(Exception):
+    pass
+
+
+def _git(repo, *args):
+    """
+    Run git in "repo".
+    :return: stdout without trailing newline
+    :rtype: str
+    """
+    res = sp.run(['git', '-C', repo] + list(args), stdout=sp.PIPE, stderr=sp.PIPE, universal_newlines=True)
+    if res.returncode != 0:
+        raise ExceptionGit('git %s in "%s" failed: %s' % (args[0], repo, res.stderr.strip()))
+    return res.stdout.rstrip('\n')
+
+
+def git_dir(repo):
+    """
+    .git directory of a repository. Follows "gitdir:" files of worktrees and submodules.
+    :param repo: Path to work tree
+    :type repo: str
+    :return: Path to git directory or None
+    :rtype: str
+    """
+    dot_git = os.path.join(repo, '.git')
+    if os.path.isdir(dot_git):
+        return dot_git
+    if os.path.isfile(dot_git):
+        with open(dot_git) as f:
+            line = f.readline().strip()
+        if line.startswith('gitdir:'):
+            return os.path.normpath(os.path.join(repo, line[len('gitdir:'):].strip()))
+    return None
+
+
+def find_repos(path='.', depth=2):
+    """
+    Find repositories below "path", like "find -maxdepth 2 -name .git".
+    :param path: Workspace
+    :type path: str
+    :param depth: Max directory depth of the .git entry
+    :type depth: int
+    :return: Sorted list of work trees
+    :rtype: list
+    """
+    repos = []
+    base = path.rstrip(os.sep).count(os.sep)
+    for root, dirs, files in os.walk(path):
+        if '.git' in dirs or '.git' in files:
+            repos.append(root)
+        # Do not descend into .git and below max depth
+        dirs[:] = [] if root.count(os.sep) - base + 1 >= depth else [d for d in dirs if d != '.git']
+    return sorted(repos)
+
+
+def _common_dir(gdir):
+    # Worktrees keep their refs in the main git directory
+    path = os.path.join(gdir, 'commondir')
+    if os.path.isfile(path):
+        with open(path) as f:
+            return os.path.normpath(os.path.join(gdir, f.read().strip()))
+    return gdir
+
+
+def _resolve_ref(gdir, ref):
+    for d in (gdir, _common_dir(gdir)):
+        path = os.path.join(d, ref)
+        if os.path.isfile(path):
+            with open(path) as f:
+                value = f.read().strip()
+            if value.startswith('ref:'):
+                return _resolve_ref(gdir, value[4:].strip())
+            return value
+    packed = os.path.join(_common_dir(gdir), 'packed-refs')
+    if os.path.isfile(packed):
+        with open(packed) as f:
+            for line in f:
+                if line.startswith(('#', '^')):
+                    continue
+                parts = line.split()
+                if len(parts) == 2 and parts[1] == ref:
+                    return parts[0]
+    return None
+
+
+def read_head(repo):
+    """
+    Read HEAD of a repository from its .git directory, without running git.
+    Falls back to "git rev-parse", if the refs can't be read (e.g. reftable).
+    :param repo: Path to work tree
+    :type repo: str
+    :return: Commit hash (None for a repository without commits) and branch (None if detached)
+    :rtype: tuple
+    """
+    gdir = git_dir(repo)
+    if gdir is None:
+        raise ExceptionGit('"%s" is not a git repository' % repo)
+    with open(os.path.join(gdir, 'HEAD')) as f:
+        head = f.read().strip()
+    if not head.startswith('ref:'):
+        return head, None
+
+    ref = head[4:].strip()
+    branch = ref[len('refs/heads/'):] if ref.startswith('refs/heads/') else ref
+    commit = _resolve_ref(gdir, ref)
+    if commit is None:
+        try:
+            commit = _git(repo, 'rev-parse', '-q', '--verify', 'HEAD')
+        except ExceptionGit:
+            # Unborn branch
+            pass
+    return commit, branch
+
+
+def repo_status(repo, dirty=False, describe=False):
+    """
+    State of a repository.
+    :param dirty: Check for modified tracked files (runs git)
+    :type dirty: bool
+    :param describe: Add "git describe --tags --always --dirty" (runs git)
+    :type describe: bool
+    :return: Path, HEAD, branch and, if requested, dirty state and description
+    :rtype: dict
+    """
+    res = {'path': repo}
+    try:
+        res['head'], res['branch'] = read_head(repo)
+        if dirty:
+            res['dirty'] = bool(_git(repo, 'status', '--porcelain', '--untracked-files=no'))
+        if describe:
+            res['describe'] = _git(repo, 'describe', '--tags', '--always', '--dirty') if res['head'] else None
+    except (ExceptionGit, OSError) as e:
+        res['error'] = str(e)
+    return res
+
+
+def collect(repos, dirty=False, describe=False, jobs=None):
+    """
+    State of many repositories, collected in parallel.
+    :param repos: Work trees
+    :type repos: list
+    :param jobs: Number of threads
+    :type jobs: int
+    :return: repo_status() of every repository, in the order of "repos"
+    :rtype: list
+    """
+    if not repos:
+        return []
+    with ThreadPoolExecutor(max_workers=jobs or min(len(repos), 16)) as executor:
+        return list(executor.map(lambda r: repo_status(r, dirty, describe), repos))
+
+
+def clone(url, dest, depth=None, reference=None):
+    """
+    Clone a repository or fetch it, if it exists already.
+    :param url: Remote URL
+    :type url: str
+    :param dest: Work tree
+    :type dest: str
+    :param depth: Shallow clone/fetch with this depth
+    :type depth: int
+    :param reference: Local mirror (repository) to borrow objects from. Ignored if it does not exist.
+    :type reference: str
+    :return: Result with action ("clone" or "fetch") and error message
+    :rtype: dict
+    """
+    res = {'url': url, 'path': dest, 'error': None}
+    depth_args = ['--depth', str(depth)] if depth else []
+    if git_dir(dest):
+        res['action'] = 'fetch'
+        args = ['git', '-C', dest, 'fetch', '--quiet'] + depth_args
+    else:
+        res['action'] = 'clone'
+        args = ['git', 'clone', '--quiet'] + depth_args
+        if reference:
+            args += ['--reference-if-able', reference]
+        args += [url, dest]
+    out = sp.run(args, stdout=sp.PIPE, stderr=sp.STDOUT, universal_newlines=True)
+    if out.returncode != 0:
+        res['error'] = out.stdout.strip()
+    return res
+
+
+def clone_all(names, dest_dir='.', url=SYN_REPO_URL, depth=None, mirror=None, jobs=None):
+    """
+    Clone or fetch repositories concurrently.
+    :param names: Repository names, appended to "url"
+    :type names: list
+    :param mirror: Directory with local mirrors, named like the repositories (with or without .git)
+    :type mirror: str
+    :return: clone() result per repository
+    :rtype: list
+    """
+    def _clone(name):
+        reference = None
+        if mirror:
+            reference = next((p for p in (os.path.join(mirror, name), os.path.join(mirror, name + '.git'))
+                              if os.path.isdir(p)), None)
+        return clone(url + name, os.path.join(dest_dir, name), depth, reference)
+
+    with ThreadPoolExecutor(max_workers=jobs or len(names) or 1) as executor:
+        return list(executor.map(_clone, names))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='SOMANET git workspace tool')
+    sub = parser.add_subparsers(dest='command')
+
+    p_status = sub.add_parser('status', help='HEAD of all repositories of a workspace')
+    p_status.add_argument('path', nargs='?', default='.', help='Workspace')
+    p_status.add_argument('-d', '--dirty', dest='dirty', action='store_true', help='Check for modified files')
+    p_status.add_argument('-g', '--describe', dest='describe', action='store_true', help='Add git describe')
+    p_status.add_argument('--depth', dest='depth', type=int, default=2, help='Max depth of repositories')
+    p_status.add_argument('--json', dest='json', action='store_true', help='Print JSON')
+    p_status.add_argument('-j', '--jobs', dest='jobs', type=int, help='Number of threads')
+
+    p_clone = sub.add_parser('clone', help='Clone or fetch SOMANET repositories concurrently')
+    p_clone.add_argument('names', nargs='*', default=list(SYN_REPOS), help='Repositories (default: %s)' % ' '.join(SYN_REPOS))
+    p_clone.add_argument('-u', '--url', dest='url', default=SYN_REPO_URL, help='Base URL')
+    p_clone.add_argument('-o', '--output', dest='output', default='.', help='Workspace')
+    p_clone.add_argument('--depth', dest='depth', type=int, help='Shallow clone with this depth')
+    p_clone.add_argument('-m', '--mirror', dest='mirror', help='Directory of local mirrors to share objects with')
+    p_clone.add_argument('-j', '--jobs', dest='jobs', type=int, help='Number of parallel clones')
+
+    args = parser.parse_args()
+
+    if args.command == 'status':
+        results = collect(find_repos(args.path, args.depth), args.dirty, args.describe, args.jobs)
+        if args.json:
+            print(json.dumps(results, indent=4))
+        for res in results if not args.json else []:
+            if 'error' in res:
+                logger.error('%s: %s' % (res['path'], res['error']))
+                continue
+            extra = [res['branch'] or '(detached)']
+            if res.get('dirty'):
+                extra.append('dirty')
+            if res.get('describe'):
+                extra.append(res['describe'])
+            print('%-40s %s %s' % (res['path'], res['head'] or '-' * 40, ' '.join(extra)))
+        sys.exit(1 if any('error' in r for r in results) else 0)
+
+    elif args.command == 'clone':
+        results = clone_all(args.names, args.output, args.url, args.depth, args.mirror, args.jobs)
+        for res in results:
+            if res['error']:
+                logger.error('%s: %s failed: %s' % (res['path'], res['action'], res['error']))
+            else:
+                logger.info('%s: %s done' % (res['path'], res['action']))
+        sys.exit(1 if any(r['error'] for r in results) else 0)
+
+    else:
+        parser.print_help()
+        sys.exit(1)
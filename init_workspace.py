@@ -1,6 +1,6 @@
-#!/usr/bin/env python
+#!/usr/bin/python3
 #####################################################################
-# Init your fresh cloned workspace. This script will automatically  # 
+# Init your fresh cloned workspace. This script will automatically  #
 # write your bsp-file in all main.xc files and set the right target #
 # in Makefile.                                                      #
 #####################################################################
@@ -10,6 +10,11 @@ import os
 import sys
 import re
 import argparse
+import tempfile
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from target_registry import get_registry, ExceptionTarget
 
 com_dict = {
     'ecat': 'ComEtherCAT-rev-a.bsp',
@@ -26,7 +31,7 @@ core_dict = {
 
 
 drive_dict = {
-    
+
     'd100a': 'Drive100-rev-b.bsp',
 
     'd1000c': 'Drive1000-rev-c.bsp',
@@ -39,6 +44,9 @@ drive_dict = {
     'd5000': 'Drive5000-rev-a.bsp',
 }
 
+# Makefile targets of boards, whose BSP target name differs from the name of their .xn file.
+# All other CORE modules are resolved by the target registry (targets/*.xn). Their Makefile target
+# is the name of the .xn file, they have no BSP for main.xc.
 target_dict = {
     'c22': 'SOMANET-CoreC22',
     'c21': 'SOMANET-CoreC21',
@@ -46,107 +54,297 @@ target_dict = {
     'c2x':  'SOMANET-CoreC2X',
 }
 
+# Directories which never contain sources of an app
+SKIP_DIRS = ('bin', '.build')
+
+# Per file state of the last run, keyed by workspace path. Kept outside the workspace, so no
+# untracked file is left in the repositories.
+CACHE_FILE = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'init_workspace.json')
+
+
+def _re_bsp(placeholder, bsp_dict):
+    # Match the placeholder of a fresh workspace and BSPs applied by a previous run
+    bsps = '|'.join(re.escape(b) for b in bsp_dict.values())
+    return re.compile(r'\#include.+\<(?:%s|%s)\>' % (placeholder, bsps))
+
+
+re_com = _re_bsp(r'COM_.+', com_dict)
+re_core = _re_bsp(r'CORE_.+', core_dict)
+re_drive = re.compile(r'\#include.+(?:\<?DRIVE_.+\>?|\<(?:%s)\>)' % '|'.join(re.escape(b) for b in drive_dict.values()))
+
+
+def xn_target(target):
+    # Makefile target of a registry entry: the .xn file name without extension
+    return os.path.splitext(os.path.basename(target['file']))[0]
+
+
+re_target = re.compile(r'TARGET = ?(%s|)\n' % '|'.join(
+    re.escape(t) for t in sorted(set(target_dict.values()) | {xn_target(t) for t in get_registry().targets()})))
+
+
+def make_target(core_bsp):
+    """
+    Makefile target of a CORE module.
+    :param core_bsp: Alias of CORE module, e.g. c22, or anything else the target registry resolves
+    :type core_bsp: str
+    :return: Target name
+    :rtype: str
+    """
+    if core_bsp in target_dict:
+        return target_dict[core_bsp]
+    return xn_target(get_registry().get(core_bsp))
+
+
+def find_app_files(path):
+    """
+    Walk through the workspace and yield all main.xc and Makefiles inside of app_ directories.
+    Hidden and build directories are pruned and files outside of app_ directories are not looked at.
+    :param path: Path to repository
+    :type path: str
+    :return: Generator of file paths
+    :rtype: generator
+    """
+    for root, dirs, files in os.walk(path):
+        dirs[:] = [d for d in dirs if not d.startswith('.') and d not in SKIP_DIRS]
+        if 'app_' not in root:
+            continue
+        for name in files:
+            if name in ('main.xc', 'Makefile'):
+                yield os.path.join(root, name)
+
+
+def rewrite_main_xc(f_txt, com_bsp, core_bsp, drive_bsp):
+    """
+    Insert BSPs into content of a main.xc.
+    :return: New content and list of changes
+    :rtype: tuple
+    """
+    changes = []
+
+    if core_bsp in core_dict:
+        new_txt = re_core.sub('#include <'+core_dict[core_bsp]+'>', f_txt)
+        if new_txt != f_txt:
+            f_txt = new_txt
+            changes.append('Core %s' % core_bsp)
+
+    if drive_bsp:
+        new_txt = re_drive.sub('#include <'+drive_dict[drive_bsp]+'>', f_txt)
+        if new_txt != f_txt:
+            f_txt = new_txt
+            changes.append('Drive %s' % drive_bsp)
+
+    if com_bsp:
+        com_found = re_com.search(f_txt)
+        if com_found:
+            new_txt = re_com.sub('#include <'+com_dict[com_bsp]+'>', f_txt)
+            if new_txt != f_txt:
+                f_txt = new_txt
+                changes.append('Replace Com %s' % com_bsp)
+        else:
+            # Insert COM bsp above found CORE bsp
+            lines = f_txt.splitlines(True)
+            for i in range(len(lines)):
+                if re_core.search(lines[i]):
+                    lines.insert(i, '#include <'+com_dict[com_bsp]+'>\n')
+                    changes.append('Insert Com %s' % com_bsp)
+                    break
+            f_txt = ''.join(lines)
+
+    return f_txt, changes
+
+
+def rewrite_makefile(f_txt, core_bsp):
+    """
+    Set target in content of a Makefile.
+    :return: New content and list of changes
+    :rtype: tuple
+    """
+    target = make_target(core_bsp)
+    new_txt = re_target.sub('TARGET = %s\n' % target, f_txt)
+    if new_txt == f_txt:
+        return f_txt, []
+    return new_txt, ['Insert Target %s' % target]
+
+
+def write_atomic(file_name, f_txt):
+    """
+    Write content to a temporary file in the same directory and replace the original file with it.
+    """
+    fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(file_name) or '.', prefix='.init_workspace-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(f_txt)
+        if os.path.exists(file_name):
+            os.chmod(tmp_name, os.stat(file_name).st_mode & 0o7777)
+        os.replace(tmp_name, file_name)
+    except BaseException:
+        os.remove(tmp_name)
+        raise
+
+
+def process_file(file_name, com_bsp, core_bsp, drive_bsp, state=None, selection=None):
+    """
+    Rewrite a single main.xc or Makefile. The file is only written, if its content changes.
+    If the file and the selection did not change since the last run (according to "state"),
+    it is not even read.
+    :param state: State of the file from the last run
+    :type state: dict
+    :param selection: BSPs and target of this run
+    :type selection: dict
+    :return: List of applied changes (empty if file is untouched) and new state of the file
+    :rtype: tuple
+    """
+    st = os.stat(file_name)
+    if state and state['selection'] == selection and \
+            state['mtime'] == st.st_mtime_ns and state['size'] == st.st_size:
+        return [], state
+
+    with open(file_name, 'rb') as f:
+        raw = f.read()
+    digest = hashlib.sha1(raw).hexdigest()
+
+    if state and state['selection'] == selection and state['hash'] == digest:
+        # Only touched, content is still the one of the last run
+        changes = []
+    else:
+        old_txt = raw.decode()
+        if os.path.basename(file_name) == 'main.xc':
+            f_txt, changes = rewrite_main_xc(old_txt, com_bsp, core_bsp, drive_bsp)
+        else:
+            f_txt, changes = rewrite_makefile(old_txt, core_bsp)
+
+        if f_txt != old_txt:
+            write_atomic(file_name, f_txt)
+            st = os.stat(file_name)
+            digest = hashlib.sha1(f_txt.encode()).hexdigest()
+        else:
+            changes = []
+
+    return changes, {'mtime': st.st_mtime_ns, 'size': st.st_size, 'hash': digest, 'selection': selection}
+
+
+def _load_cache():
+    try:
+        with open(CACHE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def load_state(path):
+    """
+    State of the last run in a workspace.
+    :rtype: dict
+    """
+    return _load_cache().get(os.path.abspath(path), {})
+
+
+def save_state(path, state):
+    """
+    Store the state of a workspace. The states of other workspaces are kept.
+    """
+    cache = _load_cache()
+    cache[os.path.abspath(path)] = state
+    try:
+        os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+        write_atomic(CACHE_FILE, json.dumps(cache, sort_keys=True))
+    except OSError:
+        # The state is only an optimization
+        pass
+
+
+def init_workspace(path, com_bsp, core_bsp, drive_bsp, jobs=None, force=False):
+    """
+    Rewrite all main.xc and Makefiles of the apps in a workspace.
+    Files which did not change since the last run with the same selection are skipped.
+    :param path: Path to repository
+    :type path: str
+    :param force: Ignore the state of the last run
+    :type force: bool
+    :raises ExceptionTarget: Unknown CORE module. Raised before any file is processed.
+    :return: Number of checked files, dictionary with changes per changed file and dictionary
+             with the reason per skipped file
+    :rtype: tuple
+    """
+    selection = {
+        'com': com_dict.get(com_bsp, ''),
+        'core': core_dict.get(core_bsp, ''),
+        'drive': drive_dict.get(drive_bsp, ''),
+        'target': make_target(core_bsp),
+    }
+    state = {} if force else load_state(path)
+
+    files = list(find_app_files(path))
+    rel_names = [os.path.relpath(f, path) for f in files]
+
+    def _process(file_name, rel_name):
+        # A file, which can't be decoded, must not stop all other files
+        try:
+            return process_file(file_name, com_bsp, core_bsp, drive_bsp, state.get(rel_name), selection) + (None,)
+        except UnicodeDecodeError as e:
+            return [], None, 'Not UTF-8 (byte %d: %s)' % (e.start, e.reason)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(_process, files, rel_names))
+
+    changed = {f: changes for f, (changes, _, _) in zip(files, results) if changes}
+    skipped = {f: error for f, (_, _, error) in zip(files, results) if error}
+    # Skipped files have no state, so they are checked again by the next run
+    new_state = {r: file_state for r, (_, file_state, _) in zip(rel_names, results) if file_state}
+    if new_state != state:
+        save_state(path, new_state)
+    return len(files), changed, skipped
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Synapticon SOMANET workspace initializer')
+    arg_parser.add_argument('-p', '--path', help='Path to repository', dest='path')
+    arg_parser.add_argument('-com', default='', help='COM module BSP', dest='com')
+    arg_parser.add_argument('-core', default='c22a', help='CORE module BSP', dest='core')
+    arg_parser.add_argument('-drive', default='', help='IFM module BSP', dest='drive')
+    arg_parser.add_argument('-j', '--jobs', type=int, help='Number of worker threads', dest='jobs')
+    arg_parser.add_argument('-f', '--force', action='store_true', help='Check all files, ignore state of last run', dest='force')
+
+    args = arg_parser.parse_args()
+
+
+    path = args.path
+    com_bsp = args.com
+    core_bsp = args.core
+    drive_bsp = args.drive
 
-arg_parser = argparse.ArgumentParser(description='Synapticon SOMANET workspace initializer')
-arg_parser.add_argument('-p', '--path', help='Path to repository', dest='path')
-arg_parser.add_argument('-com', default='', help='COM module BSP', dest='com')
-arg_parser.add_argument('-core', default='c22a', help='CORE module BSP', dest='core')
-arg_parser.add_argument('-drive', default='', help='IFM module BSP', dest='drive')
-
-args = arg_parser.parse_args()
-
-
-path = args.path
-com_bsp = args.com
-core_bsp = args.core
-drive_bsp = args.drive
-
-err = False
-if not com_bsp in com_dict and com_bsp: 
-    print 'Wrong COM module'
-    print com_dict
-    err = True
-if not core_bsp in core_dict and core_bsp:
-    print 'Wrong CORE module'
-    print core_dict
-    err = True
-if not drive_bsp in drive_dict and drive_bsp:
-    print 'Wrong IFM module'
-    print drive_dict
-    err = True
-if not drive_bsp:
-    print 'No IFM module'
-    err = True
-
-if not core_bsp in target_dict:
-    print 'Wrong target'
-    print core_bsp
-    err = True
-
-if err:
-    arg_parser.print_help()
-    sys.exit(1)
-
-re_com = re.compile(r'\#include.+\<COM_.+\>')
-re_core = re.compile(r'\#include.+\<CORE_.+\>')
-re_drive = re.compile(r'\#include.+\<?DRIVE_.+\>?')
-re_target = re.compile(r'TARGET = ?(SOMANET-CoreC22|SOMANET-CoreC21|SOMANET-CoreC21-rev-b|SOMANET-CoreC2X|)\n')
-
-for root, dirs, files in os.walk(path):
-    for name in files:
-        if re.search(r'app_', root): 
-            if name == 'main.xc':
-                file_name = os.path.join(root, name)
-                print file_name
-                f = open(file_name, 'r')
-                
-                f_txt = f.read()
-                f.close()
-                if core_bsp:
-                    f_txt = re_core.sub('#include <'+core_dict[core_bsp]+'>', f_txt)
-                    print 'Core', core_bsp
-
-                if drive_bsp:
-                    f_txt = re_drive.sub('#include <'+drive_dict[drive_bsp]+'>', f_txt)
-                    print 'Drive', drive_bsp
-
-                if com_bsp:
-                    com_found = re_com.search(f_txt)
-                    if com_found:
-                        f_txt = re_com.sub('#include <'+com_dict[com_bsp]+'>', f_txt)
-                        print 'Replace Com', com_bsp
-                    else:
-                        #f = open(file_name, 'r')
-                        #f_txt = f.readlines()
-                        # Insert COM bsp above found CORE bsp
-                        for i in range(len(f_txt)):
-                            if re_core.search(f_txt[i]):
-                                f_txt.insert(i, '#include <'+com_dict[com_bsp]+'>\n')
-                                print 'Insert Com', com_bsp
-                                break
-                        f_txt = ''.join(f_txt)
-
-
-                f = open(file_name, 'w')
-                if not f:
-                    print 'Error: Could not open file to write'
-                    sys.exit(1)
-
-                f.write(f_txt)
-                f.close()
-
-            if name == 'Makefile':
-                f = open(os.path.join(root, name), 'r')
-                f_txt = f.read()
-                f.close()
-                target_found = re_target.search(f_txt)
-
-                if target_found:
-                    f_txt = re_target.sub('TARGET = %s\n' % target_dict[core_bsp], f_txt)
-                    print 'Insert Target', target_dict[core_bsp]
-                    f = open(os.path.join(root, name), 'w')
-                    f.write(f_txt)
-                    f.close()
+    err = False
+    if not com_bsp in com_dict and com_bsp:
+        print('Wrong COM module')
+        print(com_dict)
+        err = True
+    if not core_bsp in core_dict and not core_bsp in get_registry():
+        print('Wrong CORE module')
+        print(core_dict)
+        print('or any of', get_registry().aliases())
+        err = True
+    if not drive_bsp in drive_dict and drive_bsp:
+        print('Wrong IFM module')
+        print(drive_dict)
+        err = True
+    if not drive_bsp:
+        print('No IFM module')
+        err = True
 
+    if err:
+        arg_parser.print_help()
+        sys.exit(1)
 
+    try:
+        n_files, changed, skipped = init_workspace(path, com_bsp, core_bsp, drive_bsp, args.jobs, args.force)
+    except ExceptionTarget as e:
+        print(e)
+        sys.exit(1)
 
+    for file_name in sorted(changed):
+        print(file_name)
+        for change in changed[file_name]:
+            print('   ', change)
+    for file_name in sorted(skipped):
+        print('Skipped %s: %s' % (file_name, skipped[file_name]))
+    print('%d files checked, %d changed, %d skipped' % (n_files, len(changed), len(skipped)))
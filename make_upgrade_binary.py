@@ -3,50 +3,347 @@
 import argparse
 import subprocess as sp
 import datetime
+import hashlib
+import shutil
+import tempfile
 import re
 import os
-import git
+import sys
+import glob
+import json
+import time
+import functools
+from concurrent.futures import ProcessPoolExecutor
+
+from git_workspace import find_repos, collect
+from target_registry import get_registry
 
 XTIMECOMPOSER_VERSION="14.3"
 XFLASH_CMD="xflash --noinq --factory-version " + XTIMECOMPOSER_VERSION + " --upgrade 1 %s -o %s"
 
-TRASH = ['decompressor-', 'target-xn-', 'spanning-xn-']
+# Converted binaries are stored here, named by a hash of .xe content, xflash version and xflash command
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'make_upgrade_binary')
+
+
+@functools.lru_cache()
+def xflash_version():
+    """
+    Output of "xflash --version". Resolved once per process.
+    :rtype: str
+    """
+    try:
+        out = sp.run(['xflash', '--version'], stdout=sp.PIPE, stderr=sp.STDOUT, universal_newlines=True, timeout=30)
+    except (OSError, sp.SubprocessError) as e:
+        raise RuntimeError('Cannot run xflash: %s' % e)
+    if out.returncode != 0:
+        raise RuntimeError('xflash --version failed: %s' % out.stdout.strip())
+    return out.stdout.strip()
+
+
+def cache_key(xe_path):
+    """
+    Hash of the .xe content, installed xflash version and xflash flags.
+    :param xe_path: Path to .xe file
+    :type xe_path: str
+    :return: hex digest
+    :rtype: str
+    """
+    h = hashlib.sha256()
+    h.update(xflash_version().encode() + b'\0')
+    h.update(XFLASH_CMD.encode() + b'\0')
+    with open(xe_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def copy_cached(src, dst):
+    """
+    Copy a cached binary to "dst". No hard link, so later edits of "dst" can't change the cache.
+    """
+    tmp = '%s.%d.tmp' % (dst, os.getpid())
+    shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+def xflash(xe_path, binary_path):
+    """
+    Run xflash in a private temporary directory, so all trash files
+    (decompressor-*, target-xn-*, spanning-xn-*) are removed with it.
+    :param xe_path: Path to .xe file
+    :type xe_path: str
+    :param binary_path: Path of the upgrade binary
+    :type binary_path: str
+    :return: True, if xflash was successful
+    :rtype: bool
+    """
+    xe_path = os.path.abspath(xe_path)
+    with tempfile.TemporaryDirectory(prefix='make_upgrade_binary-') as tmp:
+        tmp_bin = os.path.join(tmp, 'upgrade.bin')
+        if sp.call((XFLASH_CMD % (xe_path, tmp_bin)).split(' '), cwd=tmp) != 0 or not os.path.isfile(tmp_bin):
+            return False
+        shutil.move(tmp_bin, binary_path)
+    return True
+
+
+def convert(xe_path, binary_name, use_cache=True):
+    """
+    Convert an .xe file into an upgrade binary. On a cache hit, the cached binary is copied to "binary_name".
+    :param xe_path: Path to .xe file
+    :type xe_path: str
+    :param binary_name: Path of the upgrade binary
+    :type binary_name: str
+    :param use_cache: Use and fill the cache
+    :type use_cache: bool
+    :return: True, if binary was taken from cache
+    :rtype: bool
+    """
+    if not use_cache:
+        if not xflash(xe_path, binary_name):
+            raise RuntimeError('xflash failed for "%s"' % xe_path)
+        return False
+
+    cached = os.path.join(CACHE_DIR, cache_key(xe_path) + '.bin')
+    if os.path.isfile(cached):
+        copy_cached(cached, binary_name)
+        return True
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_cached = '%s.%d.tmp' % (cached, os.getpid())
+    if not xflash(xe_path, tmp_cached):
+        raise RuntimeError('xflash failed for "%s"' % xe_path)
+    os.replace(tmp_cached, cached)
+    copy_cached(cached, binary_name)
+    return False
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def find_workspace(path):
+    """
+    Workspace of a build: the parent directory of the repository, which contains "path".
+    :return: Path to workspace or None, if "path" is not in a repository
+    :rtype: str
+    """
+    d = os.path.dirname(os.path.abspath(path))
+    while True:
+        if os.path.exists(os.path.join(d, '.git')):
+            return os.path.dirname(d)
+        parent = os.path.dirname(d)
+        if parent == d:
+            return None
+        d = parent
+
+
+def make_target(xe_path):
+    """
+    TARGET of the Makefile of the app, which built "xe_path" (app_*/bin/*.xe or app_*/*.xe).
+    :rtype: str
+    """
+    d = os.path.dirname(os.path.abspath(xe_path))
+    for makefile in (os.path.join(d, 'Makefile'), os.path.join(os.path.dirname(d), 'Makefile')):
+        if os.path.isfile(makefile):
+            with open(makefile) as f:
+                found = re.search(r'^TARGET\s*=\s*(\S+)', f.read(), re.M)
+            if found:
+                return found.group(1)
+    return None
+
+
+def resolve_target(name):
+    """
+    Look up a target alias or Makefile target in the target registry. Makefile targets are .xn file
+    names or the targets, which init_workspace writes for BSP boards (e.g. SOMANET-CoreC22).
+    :return: Registry target or None, if unknown
+    :rtype: dict
+    """
+    registry = get_registry()
+    if name in registry:
+        return registry.get(name)
+    # Not imported at module level: init_workspace loads the registry on import, also in every worker
+    from init_workspace import target_dict
+    alias = next((a for a, t in target_dict.items() if t == name), None)
+    if alias and alias in registry:
+        return registry.get(alias)
+    return None
+
+
+def target_info(xe_path, alias=None):
+    """
+    Target of a build. Given by alias or taken from the Makefile of the app. If the target is
+    in the target registry, its .xn file and hash are added.
+    :rtype: dict
+    """
+    name = alias or make_target(xe_path)
+    if not name:
+        return None
+    target = resolve_target(name)
+    if target is None:
+        return {'name': name}
+    return {'name': target['name'], 'xn': os.path.basename(target['file']), 'xn_sha1': target['hash']}
+
+
+def build_manifest(res, target, repos):
+    """
+    Provenance of an upgrade binary.
+    :param res: Result of _convert_job
+    :type res: dict
+    :param target: Result of target_info()
+    :type target: dict
+    :param repos: Result of git_workspace.collect()
+    :type repos: list
+    :rtype: dict
+    """
+    return {
+        'binary': os.path.basename(res['bin']),
+        'size': res['size'],
+        'sha256': res['sha256'],
+        'xe': os.path.basename(res['xe']),
+        'xe_sha256': res['xe_sha256'],
+        'xflash_version': xflash_version(),
+        'xflash': XFLASH_CMD % ('<xe>', '<bin>'),
+        'target': target,
+        'repos': {os.path.basename(r['path']): {k: r.get(k) for k in ('head', 'branch', 'dirty', 'describe')}
+                  for r in repos if 'error' not in r},
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+    }
+
+
+def manifest_path(binary_name):
+    return binary_name + '.json'
+
+
+def collect_xe_files(paths):
+    """
+    Expand directories to all .xe files below them.
+    :param paths: List of .xe files and/or directories
+    :type paths: list
+    :return: List of .xe files
+    :rtype: list
+    """
+    xe_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            xe_files += sorted(glob.glob(os.path.join(path, '**', '*.xe'), recursive=True))
+        else:
+            xe_files.append(path)
+    return xe_files
+
+
+def _convert_job(xe_path, binary_name, use_cache):
+    """
+    Worker for the process pool.
+    :return: Result with paths, duration in seconds, cache hit and error message
+    :rtype: dict
+    """
+    t0 = time.time()
+    res = {'xe': xe_path, 'bin': binary_name, 'cached': False, 'error': None}
+    try:
+        res['cached'] = convert(xe_path, binary_name, use_cache)
+        res['size'] = os.path.getsize(binary_name)
+        res['sha256'] = file_sha256(binary_name)
+        res['xe_sha256'] = file_sha256(xe_path)
+    except (RuntimeError, OSError) as e:
+        res['error'] = str(e)
+    res['duration'] = round(time.time() - t0, 3)
+    return res
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Build upgrade binary')
+    arg_parser.add_argument('path', type=str, nargs='+', help="Path to .xe file(s) or directories containing .xe files")
+    arg_parser.add_argument('-t', required=False, action='store_true', help='Binary name with timestamp')
+    arg_parser.add_argument('-v', type=str, help='Add additional informations to binary name (e.g. version, fix,....)')
+    arg_parser.add_argument('-g', action='store_true', help='Add git hash or describtion')
+    arg_parser.add_argument('-n', '--no-cache', dest='no_cache', action='store_true', help='Always run xflash, bypass the binary cache')
+    arg_parser.add_argument('-o', '--output', dest='output', default='', help='Output directory')
+    arg_parser.add_argument('-j', '--jobs', dest='jobs', type=int, help='Number of parallel xflash conversions')
+    arg_parser.add_argument('-s', '--summary', dest='summary', help='Write summary of outputs and durations to JSON file')
+    arg_parser.add_argument('-T', '--target', dest='target', help='Target alias for the manifest. Default: TARGET of the app Makefile')
+    arg_parser.add_argument('-w', '--workspace', dest='workspace', help='Workspace with all module repositories. Default: parent of the repository of the .xe file')
+    arg_parser.add_argument('-M', '--no-manifest', dest='no_manifest', action='store_true', help='Do not write a JSON manifest next to each binary')
+
+    args = arg_parser.parse_args()
+
+    # Same suffix for all binaries of a batch
+    suffix = ''
+    if args.v:
+        suffix += '-'+args.v
+
+    if args.t:
+        timestamp = datetime.datetime.today().strftime('%y%m%d-%H%M%S')
+        suffix += '-'+timestamp
+
+    if args.g:
+        import git
+        repo = git.Repo(search_parent_directories=True)
+        desc = repo.git.describe('--tag', '--dirty', '--broken', '--always')
+        suffix += '-'+desc
 
-arg_parser = argparse.ArgumentParser(description='Build upgrade binary')
-arg_parser.add_argument('path', type=str, help="Path to .xe file")
-arg_parser.add_argument('-t', required=False, action='store_true', help='Binary name with timestamp')
-arg_parser.add_argument('-v', type=str, help='Add additional informations to binary name (e.g. version, fix,....)')
-arg_parser.add_argument('-g', action='store_true', help='Add git hash or describtion')
+    if args.target and not args.no_manifest and resolve_target(args.target) is None:
+        print('Error: Unknown target "%s"' % args.target)
+        sys.exit(1)
 
-args = arg_parser.parse_args()
+    re_name = re.compile(r'(.*/)?(.+).xe$')
 
-re_name = re.compile(r'(.*/)(.+).xe$')
+    jobs = []
+    for xe_path in collect_xe_files(args.path):
+        name = re_name.search(xe_path)
+        if not name:
+            print('Error: "%s" is not an .xe file' % xe_path)
+            sys.exit(1)
+        binary_name = os.path.join(args.output, name.group(2) + suffix + '.bin')
+        if binary_name in [j[1] for j in jobs]:
+            print('Error: "%s" and "%s" result in the same binary name' % ([j[0] for j in jobs if j[1] == binary_name][0], xe_path))
+            sys.exit(1)
+        print('Name:', binary_name)
+        jobs.append((xe_path, binary_name, not args.no_cache))
 
-binary_name = re_name.search(args.path).group(2)
-if args.v:
-    binary_name += '-'+args.v
+    if not jobs:
+        print('Error: No .xe files found')
+        sys.exit(1)
 
-if args.t:
-    timestamp = datetime.datetime.today().strftime('%y%m%d-%H%M%S')
-    binary_name += '-'+timestamp
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+    t0 = time.time()
+    if len(jobs) == 1:
+        results = [_convert_job(*jobs[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            results = list(executor.map(_convert_job, *zip(*jobs)))
 
-if args.g:
-    repo = git.Repo(search_parent_directories=True)
-    desc = repo.git.describe('--tag', '--dirty', '--broken', '--always')
-    binary_name += '-'+desc
-    
+    if not args.no_manifest:
+        # Repositories are collected once per workspace, all binaries of a batch share the result
+        workspaces = {}
+        for res in results:
+            if res['error']:
+                continue
+            workspace = args.workspace or find_workspace(res['xe'])
+            if workspace not in workspaces:
+                workspaces[workspace] = collect(find_repos(workspace), dirty=True, describe=True) if workspace else []
+            target = target_info(res['xe'], args.target)
+            with open(manifest_path(res['bin']), 'w') as f:
+                json.dump(build_manifest(res, target, workspaces[workspace]), f, sort_keys=True, separators=(',', ':'))
 
-binary_name += '.bin'
-print('Name:', binary_name)
+    for res in results:
+        if res['error']:
+            print('Error:', res['error'])
+        elif len(results) > 1:
+            print('%s: %.2f s%s' % (res['bin'], res['duration'], ' (cached)' if res['cached'] else ''))
+        elif res['cached']:
+            print('Cached')
 
-sp.call((XFLASH_CMD % (args.path, binary_name)).split(' '))
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump({'duration': round(time.time() - t0, 3), 'binaries': results}, f, indent=4)
 
-# Clean working directory
-files = next(os.walk(os.getcwd()), [])[2]
-for file in files:
-    for t in TRASH:
-        if t in file:
-            os.remove(file)
-            break
+    if any(res['error'] for res in results):
+        sys.exit(1)
 
-print('done')
+    print('done')
@@ -1,12 +1,17 @@
 #!/usr/bin/python3
-from pyworktimer_modules.google_drive import GoogleCalc
+from pyworktimer_modules.journal import Journal
+from pyworktimer_modules.exceptions import ExceptionGoogle
+import subprocess as sp
 import datetime
 import argparse
-import os 
+import json
+import sys
+import os
 dir_path = os.path.dirname(os.path.realpath(__file__))
 
 FILE_ID = '1eA_842Yg7dVu1-KEg3eQ_z62UUUCP834cfz17NncuBE'
 AUTH_FILE = dir_path + '/pyworktimer_modules/' + 'pyworktimer-9abd2337e580.json'
+JOURNAL_DIR = os.path.expanduser('~/.pyworktimer')
 APP_VERSION = 0.1
 
 class PyWorkTimer():
@@ -14,31 +19,23 @@ class PyWorkTimer():
     START_TIME = 2
     END_TIME = 3
 
-    def __init__(self):
+    def __init__(self, journal_dir=JOURNAL_DIR):
 
         self.now = datetime.datetime.now().strftime('%H:%M')
         self.today = datetime.datetime.now().strftime('%d.%m.%Y')
         self.year = datetime.datetime.now().strftime('%Y')
-        self.gcalc = GoogleCalc(AUTH_FILE, FILE_ID)
-        self.gcalc.open_file()
-
-        sheets = self.gcalc._get_worksheet_names()
-        for sh in sheets:
-            if self.year in sh:
-                self.gcalc.open_sheet(sh)
-                break
+        self.journal_dir = journal_dir
+        self.journal = Journal(journal_dir)
+        self.meta_file = os.path.join(journal_dir, 'meta.json')
+        self.meta = None
 
     def _set_time(self, start_end, no_update=True):
-        cell = self.gcalc.find(self.today)
-
-        row = self.gcalc.get_row_values(cell.row)
-
-        if row[start_end] != '' and no_update:
-            print("Already written")
-            return 
-
-        self.gcalc.write(cell.row, start_end+1, self.now)
-        print("Done")
+        """
+        Record a punch in the local journal. It is written to the sheet by sync().
+        """
+        self.journal.append({'date': self.today, 'year': self.year, 'col': start_end,
+                             'time': self.now, 'update': not no_update})
+        print("Recorded", self.now)
 
     def set_start_time(self):
         self._set_time(self.START_TIME)
@@ -52,6 +49,149 @@ class PyWorkTimer():
     def update_end_time(self):
         self._set_time(self.END_TIME, False)
 
+    def _load_meta(self):
+        """
+        Cache of worksheet title per year ("sheets") and row/col of a date per worksheet ("rows").
+        """
+        if self.meta is None:
+            try:
+                with open(self.meta_file) as f:
+                    self.meta = json.load(f)
+            except (OSError, ValueError):
+                self.meta = {}
+            self.meta.setdefault('sheets', {})
+            self.meta.setdefault('rows', {})
+        return self.meta
+
+    def _save_meta(self):
+        tmp = self.meta_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, self.meta_file)
+
+    def _open_sheet(self, year):
+        """
+        Connect to Google and open the sheet of "year". Heavy imports happen only here.
+        The worksheet list is only requested, if the cached title of the year does not open.
+        """
+        from pyworktimer_modules.google_drive import GoogleCalc
+        import gspread
+
+        meta = self._load_meta()
+        gcalc = GoogleCalc(AUTH_FILE, FILE_ID)
+        gcalc.open_file()
+
+        title = meta['sheets'].get(year)
+        if title:
+            try:
+                gcalc.open_sheet(title)
+                return gcalc
+            except gspread.exceptions.WorksheetNotFound:
+                del meta['sheets'][year]
+
+        sheets = gcalc._get_worksheet_names()
+        for sh in sheets:
+            if year in sh:
+                gcalc.open_sheet(sh)
+                meta['sheets'][year] = sh
+                self._save_meta()
+                return gcalc
+
+    def _locate(self, gcalc, date):
+        """
+        Find the row of "date". A cached row is validated by checking that it still holds the date.
+        :return: Row index and row values, else None
+        :rtype: tuple
+        """
+        rows = self._load_meta()['rows'].setdefault(gcalc.sheet_name(), {})
+        if date in rows:
+            row, col = rows[date]
+            values = gcalc.get_row_values(row)
+            if col <= len(values) and values[col - 1] == date:
+                return row, values
+
+        cell = gcalc.find(date)
+        if not cell:
+            rows.pop(date, None)
+            return None
+        rows[date] = [cell.row, cell.col]
+        self._save_meta()
+        return cell.row, gcalc.get_row_values(cell.row)
+
+    @staticmethod
+    def _reconcile(current, punches):
+        """
+        Resolve the final value of a cell. A start/end punch is dropped, if the cell is already
+        written (like "Already written"), an update punch always overwrites it.
+        """
+        value = current
+        for p in punches:
+            if p['update'] or value == '':
+                value = p['time']
+        return value
+
+    def sync(self):
+        """
+        Write all queued punches to the sheet. With cached sheet title and date rows, a punch costs
+        one read of its row and one batched write. Punches, whose sheet or date is not found, stay
+        queued and are tried again by the next run. All other punches are committed.
+        :return: True, if journal is empty afterwards
+        :rtype: bool
+        """
+        with self.journal.sync_lock() as locked:
+            if not locked:
+                print("Sync already running")
+                return False
+
+            entries, offset = self.journal.pending()
+            if not entries:
+                return True
+
+            # year -> (date, col) -> indexes of punches in recorded order
+            years = {}
+            for i, e in enumerate(entries):
+                years.setdefault(e['year'], {}).setdefault((e['date'], e['col']), []).append(i)
+
+            # Indexes of punches, which are not synced
+            unsynced = []
+            for year, cells in years.items():
+                gcalc = self._open_sheet(year)
+                if not gcalc:
+                    print("No sheet for year", year)
+                    unsynced += [i for indexes in cells.values() for i in indexes]
+                    continue
+
+                with gcalc.batch():
+                    for (date, col), indexes in cells.items():
+                        found = self._locate(gcalc, date)
+                        if not found:
+                            print("Date not found:", date)
+                            unsynced += indexes
+                            continue
+                        row_idx, row = found
+                        current = row[col] if col < len(row) else ''
+                        value = self._reconcile(current, [entries[i] for i in indexes])
+                        if value == current:
+                            print("Already written", date)
+                            continue
+                        gcalc.write(row_idx, col + 1, value)
+                        print("Write", date, value)
+
+            self.journal.commit(offset, [entries[i] for i in sorted(unsynced)])
+            if unsynced:
+                print("%d times stay queued" % len(unsynced))
+                return False
+            print("Done")
+            return True
+
+    def sync_background(self):
+        """
+        Start sync in a detached process. Output goes to sync.log in the journal directory.
+        """
+        with open(os.path.join(self.journal_dir, 'sync.log'), 'a') as log:
+            sp.Popen([sys.executable, os.path.realpath(__file__), '--sync'], stdin=sp.DEVNULL,
+                     stdout=log, stderr=sp.STDOUT, start_new_session=True)
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='PyWorkTimer.\nv%d' % APP_VERSION)
     parser.add_argument('--start', '-s',
@@ -70,6 +210,15 @@ if __name__ == '__main__':
                         action='store_true',
                         help='Update end time')
 
+    parser.add_argument('--sync', '-y',
+                        action='store_true',
+                        help='Write queued times to the sheet and wait until done')
+
+    parser.add_argument('--no-sync', '-n',
+                        dest='no_sync',
+                        action='store_true',
+                        help='Only record time locally, do not start background sync')
+
     args = parser.parse_args()
     pytimer = PyWorkTimer()
 
@@ -82,4 +231,11 @@ if __name__ == '__main__':
     elif args.update_end:
         pytimer.update_end_time()
 
-
+    if args.sync:
+        try:
+            sys.exit(0 if pytimer.sync() else 1)
+        except (OSError, ExceptionGoogle) as e:
+            print("Offline, times stay queued:", e)
+            sys.exit(1)
+    elif not args.no_sync:
+        pytimer.sync_background()
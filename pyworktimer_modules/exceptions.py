@@ -5,6 +5,9 @@ class ExceptionDBHandler(Exception):
 class ExceptionGoogle(Exception):
     pass
 
+class ExceptionPermission(ExceptionGoogle):
+    pass
+
 class ExceptionDropbox(Exception):
     pass
 
@@ -2,19 +2,75 @@ import gspread
 import gspread.utils as gut
 import httplib2
 import logging
+import contextlib
+import functools
+import threading
+import datetime
+import collections
+import array
+import random
+import hashlib
 import json
+import time
+import os
 import re
 
 from oauth2client.service_account import ServiceAccountCredentials
 from pydrive.auth import GoogleAuth
 from pydrive.drive import GoogleDrive as gdrive
+from googleapiclient.http import MediaFileUpload
+from googleapiclient.errors import HttpError
+from concurrent.futures import ThreadPoolExecutor
+
+
+class _TTLCache(object):
+    """
+    Thread safe LRU cache, whose entries expire after "ttl" seconds.
+    """
+
+    def __init__(self, size=256, ttl=600):
+        self.__size = size
+        self.__ttl = ttl
+        self.__data = collections.OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key):
+        with self.__lock:
+            entry = self.__data.get(key)
+            if entry is None:
+                return None
+            value, t = entry
+            if time.time() - t > self.__ttl:
+                del self.__data[key]
+                return None
+            self.__data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.__lock:
+            self.__data[key] = (value, time.time())
+            self.__data.move_to_end(key)
+            while len(self.__data) > self.__size:
+                self.__data.popitem(last=False)
+
+    def clear(self):
+        with self.__lock:
+            self.__data.clear()
 
 
 class GoogleDrive(object):
     """
     Class for Google Drive. Used for uploading reports generated by pyTest.
+    Folders can be given as path (e.g. 'Reports/Drive400_E1/Stack_9504'), which is resolved from "My Drive".
+    Resolved IDs are cached.
     """
 
+    FOLDER_MIME = 'application/vnd.google-apps.folder'
+    # Files larger than this are uploaded in chunks, which are retried on their own
+    RESUMABLE_THRESHOLD = 5 * 1024 * 1024
+    CHUNK_SIZE = 4 * 1024 * 1024
+    CHUNK_RETRIES = 5
+
     def __init__(self, drive_settings):
         """
         Init class and logging into Google Drive
@@ -23,30 +79,226 @@ class GoogleDrive(object):
         """
         gauth = GoogleAuth(settings_file=drive_settings)
         gauth.LocalWebserverAuth()  # Creates local webserver and auto handles authentication
+        self.gauth = gauth
         self.drive = gdrive(gauth)
-        self.folder_id = None
+        self.__ids = _TTLCache()
+        self.__local = threading.local()
+
+    @staticmethod
+    def __quote(title):
+        return title.replace('\\', '\\\\').replace("'", "\\'")
 
     def __find_file(self, fldname):
         """
-        Find existing file in Google Drive folder
+        Find existing file with exactly this name anywhere in Google Drive
         :param fldname: file name
         :type fldname: str
-        :return: List containing all file names
+        :return: List containing all matching files
         :rtype: list
         """
         file_list = self.drive.ListFile({
-            'q': "title contains '{}' and trashed=false".format(fldname)}).GetList()
+            'q': "title = '{}' and trashed=false".format(self.__quote(fldname))}).GetList()
         return file_list
 
-    def list_files(self, name):
+    def _child(self, parent_id, title, mime_type=None):
+        """
+        Find file "title" in folder "parent_id". Results are cached.
+        :param mime_type: Only files of this type, e.g. FOLDER_MIME
+        :type mime_type: str
+        :return: ID of file, else None
+        :rtype: str
+        """
+        key = (parent_id, title, mime_type)
+        file_id = self.__ids.get(key)
+        if file_id:
+            return file_id
+        query = "title = '{}' and '{}' in parents and trashed=false".format(self.__quote(title), parent_id)
+        if mime_type:
+            query += " and mimeType = '{}'".format(mime_type)
+        file_list = self.drive.ListFile({'q': query}).GetList()
+        if not file_list:
+            return None
+        self.__ids.put(key, file_list[0]['id'])
+        return file_list[0]['id']
+
+    def resolve(self, path, create=False):
+        """
+        Resolve a folder path to its ID by walking from "My Drive" through the parents.
+        If the first folder is not in "My Drive" (e.g. shared with us), it is searched by its exact name.
+        :param path: Folder path like 'Reports/Drive400_E1/Stack_9504'
+        :type path: str
+        :param create: Create missing folders
+        :type create: bool
+        :return: ID of folder, else None
+        :rtype: str
+        """
+        parts = [p for p in path.split('/') if p]
+        parent_id = 'root'
+        for i, title in enumerate(parts):
+            folder_id = self._child(parent_id, title, self.FOLDER_MIME)
+            if not folder_id and i == 0:
+                found = [f for f in self.__find_file(title) if f.get('mimeType') == self.FOLDER_MIME]
+                if found:
+                    folder_id = found[0]['id']
+                    self.__ids.put((parent_id, title, self.FOLDER_MIME), folder_id)
+            if not folder_id:
+                if not create:
+                    return None
+                folder_id = self.create_folder(title, parent_id)
+            parent_id = folder_id
+        return parent_id
+
+    def _list_folder(self, folder_id):
+        """
+        List all files in a folder with one query.
+        :param folder_id: ID of folder
+        :type folder_id: str
+        :return: Dictionary title -> file metadata (id, fileSize, md5Checksum, mimeType, ...)
+        :rtype: dict
+        """
         file_list = self.drive.ListFile({
-            'q': "'{}' in parents  and trashed=false".format(name),
+            'q': "'{}' in parents  and trashed=false".format(folder_id),
         }).GetList()
+        return {f['title']: f for f in file_list}
+
+    def list_files(self, name=None, path=None):
+        """
+        List files of a folder.
+        :param name: ID of folder
+        :type name: str
+        :param path: Path of folder, used if no ID is given
+        :type path: str
+        :return: Dictionary lower case title -> ID
+        :rtype: dict
+        """
+        if not name:
+            name = self.resolve(path)
+            if not name:
+                raise ExceptionGoogle('Folder "%s" not found' % path)
         ret_list = {}
-        for f in file_list:
-            ret_list[f['title'].lower()] = f['id']
+        for title, f in self._list_folder(name).items():
+            ret_list[title.lower()] = f['id']
         return ret_list
 
+    def _http(self):
+        """
+        httplib2 is not thread safe, so each thread gets its own authorized Http object.
+        """
+        if not hasattr(self.__local, 'http'):
+            self.__local.http = self.gauth.Get_Http_Object()
+        return self.__local.http
+
+    @staticmethod
+    def _md5(path):
+        h = hashlib.md5()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    @classmethod
+    def _is_changed(cls, path, remote):
+        if remote is None:
+            return True
+        if str(os.path.getsize(path)) != str(remote.get('fileSize')):
+            return True
+        return cls._md5(path) != remote.get('md5Checksum')
+
+    def _upload_resumable(self, path, title, parent_id, file_id=None):
+        """
+        Upload a large file in chunks. A chunk, which failed with a rate limit or server error, is retried
+        without restarting the upload.
+        """
+        http = self._http()
+        media = MediaFileUpload(path, chunksize=self.CHUNK_SIZE, resumable=True)
+        files = self.gauth.service.files()
+        if file_id:
+            request = files.update(fileId=file_id, media_body=media)
+        else:
+            request = files.insert(body={'title': title, 'parents': [{'id': parent_id}]}, media_body=media)
+
+        response = None
+        retries = 0
+        while response is None:
+            try:
+                _, response = request.next_chunk(http=http)
+                retries = 0
+            except HttpError as e:
+                if (e.resp.status != 429 and e.resp.status < 500) or retries >= self.CHUNK_RETRIES:
+                    raise
+                retries += 1
+                time.sleep(2 ** retries)
+        return response
+
+    def _upload_one(self, path, title, parent_id, remote):
+        file_id = remote['id'] if remote else None
+        if os.path.getsize(path) > self.RESUMABLE_THRESHOLD:
+            self._upload_resumable(path, title, parent_id, file_id)
+            return
+        metadata = {'title': title, 'parents': [{'id': parent_id}]}
+        if file_id:
+            metadata['id'] = file_id
+        file = self.drive.CreateFile(metadata)
+        file.SetContentFile(path)
+        file.Upload(param={'http': self._http()})
+
+    def upload_tree(self, local_dir, folder=None, folder_id=None, workers=8):
+        """
+        Upload a local directory tree into a gDrive folder. Every remote folder is listed once and only
+        new or changed files (by name, size and md5) are uploaded, in parallel. Missing sub folders are created.
+        :param local_dir: Local directory
+        :type local_dir: str
+        :param folder: Path of existing folder on gDrive
+        :type folder: str
+        :param folder_id: Existing ID of folder on gDrive
+        :type folder_id: str
+        :param workers: Number of parallel uploads
+        :type workers: int
+        :return: Lists of uploaded and skipped local paths and dictionary path -> error of failed uploads
+        :rtype: dict
+        """
+        if not folder_id:
+            folder_id = self.resolve(folder)
+            if not folder_id:
+                raise ExceptionGoogle('Folder "%s" not found' % folder)
+
+        # List every remote folder once, then upload all new or changed files in parallel
+        jobs = []
+        pending = [(local_dir, folder_id)]
+        result = {'uploaded': [], 'skipped': [], 'failed': {}}
+        while pending:
+            directory, parent_id = pending.pop()
+            remote = self._list_folder(parent_id)
+            for name in sorted(os.listdir(directory)):
+                path = os.path.join(directory, name)
+                if os.path.isdir(path):
+                    sub = remote.get(name)
+                    if sub and sub.get('mimeType') == self.FOLDER_MIME:
+                        self.__ids.put((parent_id, name, self.FOLDER_MIME), sub['id'])
+                        pending.append((path, sub['id']))
+                    else:
+                        pending.append((path, self.create_folder(name, parent_id)))
+                elif self._is_changed(path, remote.get(name)):
+                    jobs.append((path, name, parent_id, remote.get(name)))
+                else:
+                    result['skipped'].append(path)
+
+        def _job(job):
+            try:
+                self._upload_one(*job)
+            except Exception as e:
+                return job[0], e
+            return job[0], None
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for path, err in executor.map(_job, jobs):
+                if err:
+                    logging.error('Upload of "%s" failed: %s' % (path, err))
+                    result['failed'][path] = str(err)
+                else:
+                    result['uploaded'].append(path)
+        return result
+
     def upload_file(self, name, path=None, folder=None, folder_id=None):
         """
         Upload a file to gDrive. If it already exists, its content will be updated. Otherwise a new file will be created.
@@ -54,42 +306,61 @@ class GoogleDrive(object):
         :type name: str
         :param path: Path to file content on local machine.
         :type path: str
-        :param folder: Existing folder on gDrive, where we want to store the file.
+        :param folder: Path of existing folder on gDrive, where we want to store the file.
         :type folder: str
         :param folder_id: Existing ID of folder on gDrive, where we want to store the file.
         :type folder_id: str
         """
-        if not self.folder_id and folder:
-            f = self.__find_file(folder)
-            print(f)
-            if f:
-                self.folder_id = f[0]['id']
-        elif folder_id:
-            self.folder_id = folder_id
+        if folder and not folder_id:
+            folder_id = self.resolve(folder)
+            if not folder_id:
+                raise ExceptionGoogle('Folder "%s" not found' % folder)
+
+        if folder_id:
+            file_id = self._child(folder_id, name)
+        else:
+            find_file = self.__find_file(name)
+            file_id = find_file[0]['id'] if find_file else None
 
-        find_file = self.__find_file(name)
         # If file exists, update content
-        if find_file:
-            id = find_file[0]['id']
-            file = self.drive.CreateFile({'title': name, 'id': id})
+        if file_id:
+            file = self.drive.CreateFile({'title': name, 'id': file_id})
         # Else create new file
         else:
             file = self.drive.CreateFile({'title': name})
 
-        if folder or folder_id:
-            file['parents'] = [{u'id': self.folder_id}]
+        if folder_id:
+            file['parents'] = [{u'id': folder_id}]
 
         _path = path + name
-        # print(_path)
         file.SetContentFile(_path)
-        # print(file)
         file.Upload()
+        if folder_id:
+            self.__ids.put((folder_id, name, None), file['id'])
+
+    def create_folder(self, title, parent_id=None, parent=None):
+        """
+        Get or create folder "title" in a parent folder.
+        :param title: Folder name
+        :type title: str
+        :param parent_id: ID of parent folder
+        :type parent_id: str
+        :param parent: Path of parent folder, used if no ID is given. Missing folders are created.
+        :type parent: str
+        :return: ID of folder
+        :rtype: str
+        """
+        if not parent_id:
+            parent_id = self.resolve(parent, create=True) if parent else 'root'
+
+        folder_id = self._child(parent_id, title, self.FOLDER_MIME)
+        if folder_id:
+            return folder_id
 
-    def create_folder(self, title, parent_id):
         # Create folder
         folder_metadata = {
             'title':    title,
-            'mimeType': 'application/vnd.google-apps.folder',
+            'mimeType': self.FOLDER_MIME,
             "parents":  [
                 {
                     "kind": "drive#parentReference",
@@ -99,32 +370,179 @@ class GoogleDrive(object):
         }
         folder = self.drive.CreateFile(folder_metadata)
         folder.Upload()
+        self.__ids.put((parent_id, title, self.FOLDER_MIME), folder['id'])
+        return folder['id']
+
+
+# Retries of a request on rate limit (429) and server errors
+API_RETRIES = 6
+# Max. delay between two retries in seconds. Delay is doubled for every retry starting at 1 s.
+API_BACKOFF_MAX = 32
+# Errors, after which a request is retried. A request, which must not be applied twice (append,
+# insert, delete), is only retried on rate limits. On a server error it may have been applied already.
+RETRY_CODES = (429, 500, 502, 503)
+RETRY_CODES_NOT_IDEMPOTENT = (429,)
 
+# Drive API to get the modification time of a spreadsheet
+DRIVE_FILES_URL = 'https://www.googleapis.com/drive/v3/files/'
 
-def check_api_exception(function_with_expected_exceptions):
+
+class _Session(object):
+    """
+    Authorized gspread client, which is shared by all GoogleCalc objects using the same keyfile.
+    The access token is refreshed before it expires. Opened spreadsheets and worksheets are kept,
+    so reconnecting does not cost any request besides the token refresh. The size of a kept
+    worksheet is the one of the time it was fetched, worksheet(refresh=True) fetches it again.
+    """
+
+    SCOPE = ['https://spreadsheets.google.com/feeds',
+             'https://www.googleapis.com/auth/drive']
+    # Refresh access token, if it expires within this time (seconds)
+    REFRESH_MARGIN = 300
+
+    def __init__(self, keyfile):
+        self.__keyfile = keyfile
+        self.__lock = threading.RLock()
+        self.__creds = None
+        self.__client = None
+        self.__files = {}
+        self.__sheets = {}
+
+    def __expires_soon(self):
+        expiry = getattr(self.__creds, 'token_expiry', None)
+        if not expiry:
+            return False
+        return (expiry - datetime.datetime.utcnow()).total_seconds() < self.REFRESH_MARGIN
+
+    def refresh(self):
+        """
+        Get a new access token for the existing client.
+        """
+        with self.__lock:
+            if self.__client is None:
+                return
+            self.__creds.refresh(httplib2.Http())
+            self.__client.login()
+
+    def client(self):
+        """
+        Returns the authorized client. The keyfile is read only once per process.
+        """
+        with self.__lock:
+            if self.__client is None:
+                self.__creds = ServiceAccountCredentials.from_json_keyfile_name(self.__keyfile, self.SCOPE)
+                self.__client = gspread.authorize(self.__creds)
+            elif self.__expires_soon():
+                self.refresh()
+            return self.__client
+
+    def open_by_key(self, key):
+        with self.__lock:
+            client = self.client()
+            if key not in self.__files:
+                self.__files[key] = client.open_by_key(key)
+            return self.__files[key]
+
+    def worksheet(self, key, title, refresh=False):
+        with self.__lock:
+            self.client()
+            if refresh or (key, title) not in self.__sheets:
+                self.__sheets[(key, title)] = self.open_by_key(key).worksheet(title)
+            return self.__sheets[(key, title)]
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(keyfile):
+    """
+    Returns the process-wide session for a keyfile.
+    :param keyfile: Login credentials
+    :type keyfile: str
+    :rtype: _Session
+    """
+    keyfile = os.path.abspath(keyfile)
+    with _sessions_lock:
+        if keyfile not in _sessions:
+            _sessions[keyfile] = _Session(keyfile)
+        return _sessions[keyfile]
+
+
+def _api_error(e):
+    """
+    Extract error dictionary (code, message, ...) of an APIError. The format differs between gspread versions.
+    """
+    response = getattr(e, 'response', None)
+    try:
+        return response.json()['error']
+    except (AttributeError, KeyError, TypeError, ValueError):
+        pass
+    try:
+        return json.loads(str(e))['error']
+    except (KeyError, TypeError, ValueError):
+        return {'code': getattr(response, 'status_code', 0), 'message': str(e)}
+
+
+# Decorated calls of the current thread. Only the outermost one handles errors.
+_api_calls = threading.local()
+
+
+def check_api_exception(function_with_expected_exceptions=None, idempotent=True):
     """
     Decorator to catch "credentials expired"-Exception in first place.
+    Rate limit and server errors are retried with exponential backoff and jitter.
     Catches also "invalid Permission"-Exceptions and reraise a new Exception, which is more clear.
+    Requests, which must not be applied twice, are decorated with @check_api_exception(idempotent=False)
+    and are only retried on rate limits. Decorated methods called by another decorated method do not
+    retry on their own, the outermost one retries all of them.
 
     :param function_with_expected_exceptions: decorated function
     :type function_with_expected_exceptions: function
+    :param idempotent: Request can be repeated on server errors
+    :type idempotent: bool
     :return: return value of decorated function
     :rtype: value
     """
+    if function_with_expected_exceptions is None:
+        return functools.partial(check_api_exception, idempotent=idempotent)
 
+    @functools.wraps(function_with_expected_exceptions)
     def wrapper(*args, **kwargs):
-        try:
+        if getattr(_api_calls, 'active', False):
+            if not idempotent:
+                _api_calls.idempotent = False
             return function_with_expected_exceptions(*args, **kwargs)
-        except gspread.exceptions.APIError as e:
-            self = args[0]
-            err = json.loads(str(e))['error']
-            if err['code'] == 403 or err['code'] == 401:
-                logging.warning('Try to reconnect: ' + str(e))
-                self.open()
+
+        self = args[0]
+        reconnected = False
+        retry = 0
+        while True:
+            _api_calls.active = True
+            _api_calls.idempotent = idempotent
+            try:
                 return function_with_expected_exceptions(*args, **kwargs)
-            elif err['code'] == 400 and 'protected cell' in err['message']:
-                raise ExceptionPermission('Invalid permissions for sheet "{}" of DB "{}"'.format(self.sheet_name(), self.name())) from e
-            raise e
+            except gspread.exceptions.APIError as e:
+                err = _api_error(e)
+                code = err.get('code')
+                message = str(err.get('message', ''))
+                retry_codes = RETRY_CODES if _api_calls.idempotent else RETRY_CODES_NOT_IDEMPOTENT
+                rate_limit = code in retry_codes or (code == 403 and 'rate limit' in message.lower())
+                if rate_limit and retry < API_RETRIES:
+                    delay = min(API_BACKOFF_MAX, 2 ** retry) * random.uniform(0.5, 1.0)
+                    logging.warning('Request failed with %s. Retry in %.1f s' % (code, delay))
+                    time.sleep(delay)
+                    retry += 1
+                elif code in (401, 403) and not rate_limit and not reconnected:
+                    logging.warning('Try to reconnect: ' + str(e))
+                    self.reconnect()
+                    reconnected = True
+                elif code == 400 and 'protected cell' in message:
+                    raise ExceptionPermission('Invalid permissions for sheet "{}" of DB "{}"'.format(self.sheet_name(), self.name())) from e
+                else:
+                    raise e
+            finally:
+                _api_calls.active = False
 
     return wrapper
 
@@ -154,6 +572,16 @@ class GoogleCalc(object):
         self.__sheet = None
         self.__file = None
         self.__lock_row = lock_row
+        self.__write_buffer = {}
+        self.__buffering = False
+        self.__snapshot_enabled = False
+        self.__snapshot_file = None
+        self.__snapshot_ttl = 0
+        self.__snapshot = None
+        # Revision of the snapshot and time of its last check against the server
+        self.__snapshot_revision = None
+        self.__snapshot_checked = 0
+        self.__index = None
 
     def open_file(self):
         """
@@ -162,14 +590,9 @@ class GoogleCalc(object):
         :rtype: bool
         """
         try:
-            scope = ['https://spreadsheets.google.com/feeds',
-                     'https://www.googleapis.com/auth/drive']
-            creds = ServiceAccountCredentials.from_json_keyfile_name(self.__keyfile, scope)
-            client = gspread.authorize(creds)
-
             # Find a workbook by name and open the first sheet
             # Make sure you use the right name here.
-            self.__file = client.open_by_key(self.__file_name)
+            self.__file = get_session(self.__keyfile).open_by_key(self.__file_name)
             # print(self.__file.list_permissions())
             return True
         except httplib2.ServerNotFoundError as e:
@@ -190,13 +613,26 @@ class GoogleCalc(object):
         if not self.__file:
             return False
 
-        if file:
+        if file and file != self._sheet_name:
             self._sheet_name = file
+            self.__snapshot = None
 
-        self.__sheet = self.__file.worksheet(self._sheet_name)
+        self.__sheet = get_session(self.__keyfile).worksheet(self.__file_name, self._sheet_name)
 
         return True
 
+    def _refresh_sheet(self):
+        """
+        Fetch the properties (row and column count) of the sheet again. Other clients may have added rows.
+        """
+        self.__sheet = get_session(self.__keyfile).worksheet(self.__file_name, self._sheet_name, refresh=True)
+
+    def reconnect(self):
+        """
+        Refresh the access token of the shared session. Opened file and sheet stay valid.
+        """
+        get_session(self.__keyfile).refresh()
+
     def open(self):
         """
         Opens a file and then a sheet.
@@ -207,10 +643,177 @@ class GoogleCalc(object):
             return self.open_sheet()
         return False
 
+    def enable_snapshot(self, cache_file=None, ttl=300):
+        """
+        Serve find, get_cell, get_row_values, get_col_values and get_columns from a local snapshot of the sheet.
+        The snapshot is fetched with one request on first use and kept up to date on writes.
+        Every "ttl" seconds the modification time of the file is fetched and the snapshot is fetched
+        again, if the file was changed. In snapshot mode find prefers exact matches over regex matches.
+        :param cache_file: Optional JSON file to keep the snapshot between runs
+        :type cache_file: str
+        :param ttl: Seconds a snapshot is used without asking the server for changes
+        :type ttl: int
+        """
+        self.__snapshot_enabled = True
+        self.__snapshot_file = cache_file
+        self.__snapshot_ttl = ttl
+
+    def invalidate_snapshot(self):
+        """
+        Drop the snapshot. It is fetched again on next use.
+        """
+        self.__snapshot = None
+        self.__index = None
+        if self.__snapshot_file and os.path.isfile(self.__snapshot_file):
+            os.remove(self.__snapshot_file)
+
+    def __revision(self):
+        """
+        Last modification time of the file. Fetched on every call, the lastUpdateTime of gspread is
+        the one of the time the file was opened.
+        :return: Modification time or None, if it can't be fetched
+        :rtype: str
+        """
+        try:
+            res = self.__file.client.request('get', DRIVE_FILES_URL + self.__file.id,
+                                             params={'fields': 'modifiedTime', 'supportsAllDrives': 'true'})
+            return res.json().get('modifiedTime')
+        except (AttributeError, ValueError):
+            return None
+
+    def __save_snapshot(self, revision=None):
+        if not self.__snapshot_file or self.__snapshot is None:
+            return
+        cached = {
+            'file': self.__file_name,
+            'sheet': self._sheet_name,
+            'time': time.time(),
+            'revision': revision,
+            'values': self.__snapshot,
+        }
+        tmp = self.__snapshot_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(cached, f)
+        os.replace(tmp, self.__snapshot_file)
+
+    def __load_snapshot(self, revision=None):
+        """
+        Load snapshot from cache file, if it is younger than TTL or the file on the server is unchanged.
+        Else fetch all values of the sheet.
+        :param revision: Modification time of the file, if already fetched
+        :type revision: str
+        """
+        if self.__snapshot_file and os.path.isfile(self.__snapshot_file):
+            try:
+                with open(self.__snapshot_file) as f:
+                    cached = json.load(f)
+            except ValueError:
+                cached = {}
+            if cached.get('file') == self.__file_name and cached.get('sheet') == self._sheet_name:
+                if revision is None and time.time() - cached['time'] < self.__snapshot_ttl:
+                    self.__snapshot_revision = cached['revision']
+                    self.__snapshot_checked = cached['time']
+                    return cached['values']
+                revision = revision or self.__revision()
+                if revision is not None and revision == cached['revision']:
+                    self.__snapshot = cached['values']
+                    self.__snapshot_revision = revision
+                    self.__snapshot_checked = time.time()
+                    self.__save_snapshot(revision)
+                    return self.__snapshot
+
+        revision = revision or self.__revision()
+        self.__snapshot = self.__sheet.get_all_values()
+        self.__snapshot_revision = revision
+        self.__snapshot_checked = time.time()
+        self.__save_snapshot(revision)
+        return self.__snapshot
+
+    def _snapshot(self):
+        """
+        Returns the snapshot (list of rows). Loads it, if necessary. Once the TTL is over, it is
+        fetched again, if the file was changed on the server.
+        """
+        revision = None
+        if self.__snapshot is not None and time.time() - self.__snapshot_checked >= self.__snapshot_ttl:
+            revision = self.__revision()
+            if revision is not None and revision == self.__snapshot_revision:
+                self.__snapshot_checked = time.time()
+            else:
+                self.__snapshot = None
+        if self.__snapshot is None:
+            self.__snapshot = self.__load_snapshot(revision)
+            self.__index = None
+        return self.__snapshot
+
+    def __snapshot_index(self):
+        """
+        Dictionary value -> (row, col) of the first occurrence in row-major order.
+        """
+        if self.__index is None:
+            index = {}
+            for r, row in enumerate(self._snapshot(), 1):
+                for c, value in enumerate(row, 1):
+                    index.setdefault(value, (r, c))
+            self.__index = index
+        return self.__index
+
+    def __snapshot_cell(self, row, col):
+        values = self._snapshot()
+        if row <= len(values) and col <= len(values[row - 1]):
+            return values[row - 1][col - 1]
+        return ''
+
+    def __snapshot_row(self, row):
+        values = self._snapshot()
+        if row > len(values):
+            return []
+        return self.__trim(values[row - 1])
+
+    def __snapshot_col(self, col):
+        return self.__trim([row[col - 1] if col <= len(row) else '' for row in self._snapshot()])
+
+    @staticmethod
+    def __trim(values):
+        values = list(values)
+        while values and values[-1] == '':
+            values.pop()
+        return values
+
+    def __snapshot_update(self, cells):
+        """
+        Apply written cells to the snapshot.
+        :param cells: list of ((row, col), value)
+        :type cells: list
+        """
+        if self.__snapshot is None:
+            return
+        for (row, col), value in cells:
+            while len(self.__snapshot) < row:
+                self.__snapshot.append([])
+            r = self.__snapshot[row - 1]
+            if len(r) < col:
+                r.extend([''] * (col - len(r)))
+            r[col - 1] = str(value)
+        self.__index = None
+        self.__save_snapshot()
+
+    def __find_local(self, value):
+        hit = self.__snapshot_index().get(value)
+        if hit:
+            return gspread.Cell(hit[0], hit[1], value)
+        re_query = re.compile(value, re.MULTILINE)
+        for r, row in enumerate(self._snapshot(), 1):
+            for c, v in enumerate(row, 1):
+                if re_query.search(v):
+                    return gspread.Cell(r, c, v)
+        return None
+
     @check_api_exception
     def _list_permissions(self):
         return self.__file.list_permissions()
 
+    @check_api_exception
     def get_sheets(self):
         """
         Returns all existing sheet names in a calc file.
@@ -232,11 +835,13 @@ class GoogleCalc(object):
     def sheet_name(self):
         return self._sheet_name
 
+    @check_api_exception
     def _write_without_check(self, row, col, string):
         self.__sheet.update_cell(row, col, string)
         res = self.__sheet.cell(row, col)
         if str(string) != str(res.value):
             raise ExceptionGoogle('Could not write value "%s" to (%s, %s) in "%s"! Read "%s" instead' % (string, row, col, self._sheet_name, res.value))
+        self.__snapshot_update([((row, col), string)])
 
     def __write(self, row, col, string):
         if row <= self.__lock_row:
@@ -245,10 +850,92 @@ class GoogleCalc(object):
         res = self.__sheet.cell(row, col)
         if str(string) != str(res.value):
             raise ExceptionGoogle('Could not write value "%s" to (%s, %s)! Read "%s"' % (string, row, col, res.value))
+        self.__snapshot_update([((row, col), string)])
+
+    def buffer_write(self, row, col, value, raw=False):
+        """
+        Queue a cell update. Queued updates are sent with one request per input option by flush().
+        A later update of the same cell replaces the queued one.
+        :param row: Row index
+        :type row: int
+        :param col: Column index
+        :type col: int
+        :param value: new cell content
+        :type value: str, int
+        :param raw: Store the value as it is (like write_col_multi). Default is parsing it like
+                    typed in by a user (like write), e.g. '08:00' becomes a time.
+        :type raw: bool
+        """
+        if row <= self.__lock_row:
+            raise ExceptionGoogle('Tried to write to locked row "%d"!' % row)
+        self.__write_buffer[(row, col)] = (value, 'RAW' if raw else 'USER_ENTERED')
 
     @check_api_exception
+    def flush(self, verify=True, sample=None):
+        """
+        Send all queued cell updates with one batch update per input option and verify them with one
+        batch read. Cells queued by write() are parsed like typed in (USER_ENTERED), cells of
+        write_col_multi() are stored RAW. The queue is cleared, when the values are verified,
+        so a retried or repeated flush() writes and verifies them again.
+        :param verify: Read back written cells and compare them
+        :type verify: bool
+        :param sample: Verify only a random sample of this many cells. None verifies all cells.
+        :type sample: int
+        """
+        if not self.__write_buffer:
+            return
+        cells = [(cell, value) for cell, (value, _) in self.__write_buffer.items()]
+        for option in ('USER_ENTERED', 'RAW'):
+            data = [{'range': gut.rowcol_to_a1(row, col), 'values': [[value]]}
+                    for (row, col), (value, o) in self.__write_buffer.items() if o == option]
+            if data:
+                self.__sheet.batch_update(data, value_input_option=option)
+        self.__snapshot_update(cells)
+
+        if verify:
+            checked = random.sample(cells, sample) if sample and sample < len(cells) else cells
+            res = self.__sheet.batch_get([gut.rowcol_to_a1(row, col) for (row, col), _ in checked])
+            for ((row, col), value), value_range in zip(checked, res):
+                read = value_range[0][0] if value_range and value_range[0] else ''
+                if str(value) != str(read):
+                    raise ExceptionGoogle('Could not write value "%s" to (%s, %s) in "%s"! Read "%s" instead' % (value, row, col, self._sheet_name, read))
+
+        self.__write_buffer.clear()
+
+    @contextlib.contextmanager
+    def batch(self, verify=True, sample=None):
+        """
+        Context manager, which queues all writes (write, write_col_multi) and flushes them at the end.
+        Nothing is written if an exception is raised inside the block.
+        A nested batch() is part of the outer one, everything is flushed at the end of the outer block.
+
+        with gcalc.batch():
+            gcalc.write(2, 3, '08:00')
+            gcalc.write(2, 4, '17:00')
+
+        :param verify: Read back written cells and compare them
+        :type verify: bool
+        :param sample: Verify only a random sample of this many cells
+        :type sample: int
+        """
+        if self.__buffering:
+            yield self
+            return
+
+        self.__buffering = True
+        try:
+            yield self
+        except BaseException:
+            self.__write_buffer.clear()
+            raise
+        finally:
+            self.__buffering = False
+        self.flush(verify, sample)
+
+    @check_api_exception(idempotent=False)
     def insert_row(self, row, values):
         self.__sheet.insert_row(values, row)
+        self.invalidate_snapshot()
 
     @check_api_exception
     def write(self, row, col, value):
@@ -263,6 +950,9 @@ class GoogleCalc(object):
         :return: Server response
         :rtype: str
         """
+        if self.__buffering:
+            self.buffer_write(row, col, value)
+            return
         self.__write(row, col, value)
 
     @check_api_exception
@@ -276,6 +966,8 @@ class GoogleCalc(object):
         :return: Cell content, else None
         :rtype: str
         """
+        if self.__snapshot_enabled:
+            return self.__snapshot_cell(row, col)
         res = self.__sheet.cell(row, col)
         if not res:
             return None
@@ -290,15 +982,20 @@ class GoogleCalc(object):
         :return: List with row content
         :rtype: list
         """
+        if self.__snapshot_enabled:
+            return self.__snapshot_row(int(row))
         return self.__sheet.row_values(str(row))
 
     @check_api_exception
     def get_row_count(self):
         """
-        Returns number of rows in sheet.
+        Returns number of rows in sheet. In snapshot mode, the number of rows of the snapshot.
         :return: number of rows
         :rtype: int
         """
+        if self.__snapshot_enabled:
+            return len(self._snapshot())
+        self._refresh_sheet()
         return self.__sheet.row_count
 
     @check_api_exception
@@ -310,6 +1007,8 @@ class GoogleCalc(object):
         :return: List with values
         :rtype: list
         """
+        if self.__snapshot_enabled:
+            return self.__snapshot_col(int(col))
         return self.__sheet.col_values(str(col))
 
     @check_api_exception
@@ -333,24 +1032,6 @@ class GoogleCalc(object):
         """
         return self.__sheet.get_all_values()
 
-    @check_api_exception
-    def __write_col_cells(self, cell_list, c1, c2):
-        """
-        Writes and reads cells to verify content.
-        :param cell_list: list of content
-        :type cell_list: list
-        :param c1: cell coordinate
-        :type c1: str
-        :param c2: cell coordinate
-        :type c2: str
-        """
-
-        self.__sheet.update_cells(cell_list)
-        res_cell_list = self.__sheet.range('%s:%s' % (c1, c2))
-        for new, old in zip(res_cell_list, cell_list):
-            if new.value != old.value:
-                raise ExceptionGoogle('Could not update cells from "%s" to "%s" in "%s"' % (c1, c2, self._sheet_name))
-
     @check_api_exception
     def _get_range(self, c1, c2):
         return self.__sheet.range('%s:%s' % (c1, c2))
@@ -367,18 +1048,14 @@ class GoogleCalc(object):
         """
         if row <= self.__lock_row:
             return
-        col_stop = col_start + len(values) - 1
-        c1 = gut.rowcol_to_a1(row, col_start)
-        c2 = gut.rowcol_to_a1(row, col_stop)
 
-        cell_list = self._get_range(c1, c2)
+        for col, val in enumerate(values, col_start):
+            self.buffer_write(row, col, val, raw=True)
 
-        for cell, val in zip(cell_list, values):
-            cell.value = val
+        if not self.__buffering:
+            self.flush()
 
-        self.__write_col_cells(cell_list, c1, c2)
-
-    @check_api_exception
+    @check_api_exception(idempotent=False)
     def _append_row(self, values):
         """
         Append values at the end of a sheet
@@ -387,9 +1064,11 @@ class GoogleCalc(object):
         :return: Server response
         :rtype: str
         """
-        return self.__sheet.append_row(values)
+        res = self.__sheet.append_row(values)
+        self.invalidate_snapshot()
+        return res
 
-    @check_api_exception
+    @check_api_exception(idempotent=False)
     def _delete_row(self, index):
         """
         Deletes row "index"
@@ -398,7 +1077,9 @@ class GoogleCalc(object):
         :return: Server response
         :rtype: str
         """
-        return self.__sheet.delete_row(index)
+        res = self.__sheet.delete_row(index)
+        self.invalidate_snapshot()
+        return res
 
     @check_api_exception
     def _get_worksheet_names(self):
@@ -447,6 +1128,8 @@ class GoogleCalc(object):
         :return: cell object with value and col/row else None
         :rtype: cell object
         """
+        if self.__snapshot_enabled:
+            return self.__find_local(value)
         try:
             re_query = re.compile(value, re.MULTILINE)
             res = self.__sheet.find(re_query)
@@ -454,42 +1137,105 @@ class GoogleCalc(object):
         except gspread.exceptions.CellNotFound:
             return None
 
-    @check_api_exception
-    def _get_col_values(self, c):
-        return self.__sheet.col_values(c)
+    @staticmethod
+    def _column_range(*args):
+        """
+        Convert 'A:G' or 1, 7 into first and last column index.
+        :param args: Either 'A:G' or 1, 7
+        :type args: str, int
+        :return: first and last column index
+        :rtype: tuple
+        """
+        if len(args) == 1 and type(args[0]) is str:
+            c1, c2 = args[0].split(':')
+            return gut.a1_to_rowcol(c1 + '1')[1], gut.a1_to_rowcol(c2 + '1')[1]
+        return args[0], args[1]
+
+    @staticmethod
+    def __pad(rows, width):
+        return [row + [''] * (width - len(row)) if len(row) < width else row for row in rows]
 
-    def get_columns(self, *args):
+    @check_api_exception
+    def _get_rows(self, col_start, col_stop, row_start=None, row_stop=None):
+        """
+        Fetch the rectangle of columns "col_start" to "col_stop" with one request.
+        Without row limits, all rows up to the last non-empty one are returned.
+        Rows are padded with '' to the number of columns.
         """
-        Return a list with columns from 'A:G' or 1-7
+        width = col_stop - col_start + 1
+        if self.__snapshot_enabled:
+            values = self._snapshot()[(row_start or 1) - 1:row_stop]
+            rows = [row[col_start - 1:col_stop] for row in values]
+            while rows and not any(rows[-1]):
+                rows.pop()
+            return self.__pad(rows, width)
+
+        c1 = gut.rowcol_to_a1(row_start or 1, col_start)
+        c2 = gut.rowcol_to_a1(row_stop or 1, col_stop)
+        if not row_start:
+            # 'A1:G1' -> 'A:G'
+            c1, c2 = c1.rstrip('0123456789'), c2.rstrip('0123456789')
+        return self.__pad(self.__sheet.get('%s:%s' % (c1, c2)), width)
+
+    def get_columns(self, *args, columnar=False, numeric=()):
+        """
+        Return a list with rows of the columns from 'A:G' or 1-7. All columns are fetched with one request.
+        Rows are padded with '' to the number of columns.
         :param args: Either 'A:G' or 1, 7
         :type args: str, int
+        :param columnar: Return one list per column instead of one list per row
+        :type columnar: bool
+        :param numeric: Columnar only: offsets of columns (0 = first requested column), which are
+                        returned as array('d'). Cells, which are no numbers (e.g. header, empty cells) are NaN.
+        :type numeric: tuple
         :return: list of values
         :rtype: list
         """
-        cols = None
-        # Determine number of columns and create list with all indexes
-        if len(args) == 1 and type(args[0]) is str:
-            cols = args[0].split(':')
-            cols = [c - ord('A') + 1 for c in range(ord(cols[0]), ord(cols[1]) + 1)]
-        elif len(args) == 2:
-            cols = [i for i in range(args[0], args[1] + 1)]
-
-        vertical_lists = []
-        for c in cols:
-            col = self._get_col_values(c)
-
-            for cell in col[::-1]:
-                if cell is None:
-                    col.pop()
-                else:
-                    break
-            vertical_lists.append(col)
-
-        horizontal_lists = []
-        for i in range(len(vertical_lists[0])):
-            horizontal_lists.append([vertical_lists[j][i] for j in range(len(vertical_lists))])
+        col_start, col_stop = self._column_range(*args)
+        rows = self._get_rows(col_start, col_stop)
+        if not columnar:
+            return rows
+
+        columns = [list(c) for c in zip(*rows)] or [[] for _ in range(col_stop - col_start + 1)]
+        for i in numeric:
+            columns[i] = array.array('d', map(self.__to_float, columns[i]))
+        return columns
+
+    @staticmethod
+    def __to_float(value):
+        try:
+            return float(value)
+        except ValueError:
+            return float('nan')
 
-        return horizontal_lists
+    def iter_rows(self, *args, page_size=1000, start_row=1):
+        """
+        Iterate over the rows of the columns from 'A:G' or 1-7.
+        Rows are fetched in pages of "page_size" rows with one request each.
+        :param args: Either 'A:G' or 1, 7
+        :type args: str, int
+        :param page_size: Number of rows per request
+        :type page_size: int
+        :param start_row: First row index
+        :type start_row: int
+        :return: Generator of rows
+        :rtype: generator
+        """
+        col_start, col_stop = self._column_range(*args)
+        width = col_stop - col_start + 1
+        row_count = self.get_row_count()
+        # Trailing empty rows of a page are not returned by the server. They are only
+        # yielded, if a later page contains data.
+        empty_rows = 0
+        for row in range(start_row, row_count + 1, page_size):
+            rows = self._get_rows(col_start, col_stop, row, min(row + page_size - 1, row_count))
+            if rows:
+                for _ in range(empty_rows):
+                    yield [''] * width
+                for r in rows:
+                    yield r
+                empty_rows = 0
+            empty_rows += min(page_size, row_count - row + 1) - len(rows)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,141 @@
+import contextlib
+import fcntl
+import json
+import logging
+import os
+
+
+class Journal(object):
+    """
+    Append-only local journal of punches. Entries are appended as JSON lines and synced later.
+    The byte offset of the first entry, which is not synced yet, is stored in a separate file.
+    Entries, which could not be synced, are moved to a retry file, so they don't hold back the
+    journal. Once all entries are synced, the journal is truncated.
+    """
+
+    def __init__(self, path):
+        """
+        Init class.
+        :param path: Directory of journal files. Created if missing.
+        :type path: str
+        """
+        os.makedirs(path, exist_ok=True)
+        self.__journal_file = os.path.join(path, 'journal.jsonl')
+        self.__offset_file = os.path.join(path, 'journal.offset')
+        self.__retry_file = os.path.join(path, 'journal.retry.jsonl')
+        self.__lock_file = os.path.join(path, 'journal.lock')
+
+    def append(self, entry):
+        """
+        Append an entry and make sure it is on disk.
+        :param entry: JSON serializable entry
+        :type entry: dict
+        """
+        line = json.dumps(entry, sort_keys=True).encode() + b'\n'
+        with open(self.__journal_file, 'ab+') as f:
+            # Short lock against the truncation by commit()
+            fcntl.flock(f, fcntl.LOCK_EX)
+            # Terminate a line torn by an interrupted append
+            if f.seek(0, os.SEEK_END):
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    line = b'\n' + line
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _offset(self):
+        try:
+            with open(self.__offset_file) as f:
+                return int(f.read() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    @staticmethod
+    def _read(f, entries):
+        """
+        Read complete lines of a file into "entries". An incomplete last line is ignored.
+        :return: Offset behind the last complete line
+        :rtype: int
+        """
+        offset = f.tell()
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                entries.append(json.loads(line.decode()))
+            except ValueError:
+                if line.strip():
+                    logging.warning('Skip invalid journal entry: %r' % line)
+            offset += len(line)
+        return offset
+
+    def pending(self):
+        """
+        Returns all entries, which are not synced yet: the ones of the retry file followed by the
+        new ones of the journal.
+        :return: List of entries and offset to pass to commit()
+        :rtype: tuple
+        """
+        entries = []
+        if os.path.isfile(self.__retry_file):
+            with open(self.__retry_file, 'rb') as f:
+                self._read(f, entries)
+
+        offset = self._offset()
+        if not os.path.isfile(self.__journal_file):
+            return entries, offset
+        with open(self.__journal_file, 'rb') as f:
+            f.seek(offset)
+            return entries, self._read(f, entries)
+
+    def _write_offset(self, offset):
+        tmp = self.__offset_file + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(str(offset))
+        os.replace(tmp, self.__offset_file)
+
+    def commit(self, offset, retry=()):
+        """
+        Mark all entries returned by pending() as synced, except "retry". Those are kept in the
+        retry file and returned again by the next pending().
+        :param offset: Offset returned by pending()
+        :type offset: int
+        :param retry: Entries, which could not be synced
+        :type retry: list
+        """
+        tmp = self.__retry_file + '.tmp'
+        with open(tmp, 'wb') as f:
+            for entry in retry:
+                f.write(json.dumps(entry, sort_keys=True).encode() + b'\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.__retry_file)
+        self._write_offset(offset)
+
+        # Truncate the journal, if nothing was appended since pending()
+        if not os.path.isfile(self.__journal_file):
+            return
+        with open(self.__journal_file, 'rb+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            if f.seek(0, os.SEEK_END) == offset and offset:
+                # A crash in between only syncs the entries again
+                self._write_offset(0)
+                f.truncate(0)
+
+    @contextlib.contextmanager
+    def sync_lock(self):
+        """
+        Context manager, which takes the sync lock without blocking.
+        Yields False, if another process is already syncing.
+        """
+        with open(self.__lock_file, 'w') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,184 @@
+import csv
+import io
+import json
+import logging
+import os
+import re
+
+
+class SheetExporter(object):
+    """
+    Export sheets of a GoogleCalc file into local files, so analysis jobs don't need to call
+    get_all_values/get_all_records again and again.
+    Rows are pulled in pages and written incrementally. An export is refreshed by appending only
+    the rows beyond the last exported row, which suits append-only result sheets.
+
+    Per sheet there are these files in the output directory:
+        <sheet>.csv             all rows
+        <sheet>.parquet/        one part file per page (only if pyarrow is installed)
+        <sheet>.state.json      number of exported rows, column count and CSV size
+
+    The state is saved after every page. An interrupted export is resumed there: the CSV is
+    truncated to the saved size and Parquet parts beyond the saved row are removed.
+    """
+
+    def __init__(self, gcalc, out_dir, page_size=1000):
+        """
+        Init class.
+        :param gcalc: Opened GoogleCalc file
+        :type gcalc: GoogleCalc
+        :param out_dir: Output directory
+        :type out_dir: str
+        :param page_size: Number of rows per request
+        :type page_size: int
+        """
+        self.gcalc = gcalc
+        self.out_dir = out_dir
+        self.page_size = page_size
+        os.makedirs(out_dir, exist_ok=True)
+
+    def _path(self, sheet_name, ext):
+        return os.path.join(self.out_dir, sheet_name.replace('/', '_') + ext)
+
+    def _load_state(self, sheet_name):
+        try:
+            with open(self._path(sheet_name, '.state.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'rows': 0, 'cols': 0}
+
+    def _save_state(self, sheet_name, state):
+        path = self._path(sheet_name, '.state.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(path + '.tmp', path)
+
+    @staticmethod
+    def _resume(csv_path, state):
+        """
+        Cut rows, which were written after the state was saved.
+        :return: False, if the CSV does not match the state
+        :rtype: bool
+        """
+        if state.get('bytes') is None or not os.path.isfile(csv_path):
+            return False
+        if os.path.getsize(csv_path) < state['bytes']:
+            return False
+        os.truncate(csv_path, state['bytes'])
+        return True
+
+    def export(self, sheet_name=None, parquet=False, full=False):
+        """
+        Export a sheet or append its new rows to an existing export.
+        The columns are the ones of the header (first row).
+        :param sheet_name: Sheet to export. Default is the opened sheet.
+        :type sheet_name: str
+        :param parquet: Additionally write Parquet part files. Requires pyarrow.
+        :type parquet: bool
+        :param full: Discard an existing export and start from the first row
+        :type full: bool
+        :return: Number of exported rows
+        :rtype: int
+        """
+        if sheet_name:
+            self.gcalc.open_sheet(sheet_name)
+        sheet_name = self.gcalc.sheet_name()
+
+        if parquet:
+            try:
+                import pyarrow.parquet
+            except ImportError:
+                logging.warning('pyarrow is not installed. Skip Parquet export')
+                parquet = False
+
+        cols = len(self.gcalc.get_row_values(1))
+        if not cols:
+            logging.info('Sheet "%s" has no header, nothing to export' % sheet_name)
+            return 0
+
+        state = self._load_state(sheet_name)
+        csv_path = self._path(sheet_name, '.csv')
+        if full or cols != state['cols'] or parquet != state.get('parquet', False) or \
+                not self._resume(csv_path, state):
+            # Layout changed or no export yet: start from scratch
+            state = {'rows': 0, 'cols': cols, 'bytes': 0, 'parquet': parquet}
+            if os.path.isfile(csv_path):
+                os.remove(csv_path)
+        # Parts of an interrupted export
+        self._remove_parquet(sheet_name, state['rows'])
+
+        first_row = state['rows']
+        page = []
+        # The file is binary, so its position is the byte offset to resume at
+        with open(csv_path, 'ab') as f:
+            for row in self.gcalc.iter_rows(1, cols, page_size=self.page_size, start_row=state['rows'] + 1):
+                page.append(row)
+                if len(page) == self.page_size:
+                    self._checkpoint(sheet_name, state, f, page)
+                    page = []
+            if page:
+                self._checkpoint(sheet_name, state, f, page)
+
+        new_rows = state['rows'] - first_row
+        self._save_state(sheet_name, state)
+        logging.info('Exported %d new rows of "%s"' % (new_rows, sheet_name))
+        return new_rows
+
+    def _checkpoint(self, sheet_name, state, f, page):
+        """
+        Append a page to the CSV, write its Parquet part and save the state, which covers the page.
+        """
+        buf = io.StringIO(newline='')
+        csv.writer(buf).writerows(page)
+        f.write(buf.getvalue().encode('utf-8'))
+        f.flush()
+        os.fsync(f.fileno())
+        if state['parquet']:
+            self._write_parquet(sheet_name, page, state['rows'])
+        state['rows'] += len(page)
+        state['bytes'] = f.tell()
+        self._save_state(sheet_name, state)
+
+    def _remove_parquet(self, sheet_name, first_row=0):
+        """
+        Remove all part files, which start at or after "first_row".
+        """
+        directory = self._path(sheet_name, '.parquet')
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                m = re.match(r'part-(\d+)\.parquet$', name)
+                if not m or int(m.group(1)) >= first_row:
+                    os.remove(os.path.join(directory, name))
+
+    def _write_parquet(self, sheet_name, rows, first_row):
+        """
+        Write rows as a Parquet part file with one string column per sheet column.
+        """
+        import pyarrow
+        import pyarrow.parquet
+        directory = self._path(sheet_name, '.parquet')
+        os.makedirs(directory, exist_ok=True)
+        columns = {'c%d' % (i + 1): [r[i] for r in rows] for i in range(len(rows[0]))}
+        pyarrow.parquet.write_table(pyarrow.table(columns),
+                                    os.path.join(directory, 'part-%08d.parquet' % first_row))
+
+    def read_values(self, sheet_name):
+        """
+        Local equivalent of GoogleCalc.get_all_values.
+        :return: List of rows
+        :rtype: list
+        """
+        with open(self._path(sheet_name, '.csv'), newline='', encoding='utf-8') as f:
+            return list(csv.reader(f))
+
+    def read_records(self, sheet_name, head=1):
+        """
+        Local equivalent of GoogleCalc.get_all_records.
+        :param head: Row with keys, starting from 1
+        :type head: int
+        :return: List of dictionaries
+        :rtype: list
+        """
+        values = self.read_values(sheet_name)
+        keys = values[head - 1]
+        return [dict(zip(keys, row)) for row in values[head:]]
@@ -0,0 +1,310 @@
+#!/usr/bin/python3
+
+"""
+    SOMANET station pipeline
+
+    Run a bring-up described in a YAML or JSON file. Stages on the same device run in the
+    order of the file, stages on different devices run concurrently. A stage can also wait
+    for stages of other devices with "after". Every device is set up once (target, UART
+    uploader) and shared by all of its stages.
+
+    devices:
+      core:
+        target: c22             # alias, see target_registry.py list
+        adapter: 2PXBQ3PZ       # xTAG adapter ID, see xflash_runner.py -l
+      drive:
+        serial: ttyUSB0
+    stages:
+      - {name: erase, device: core, action: xflash_erase}
+      - {name: write, device: core, action: xflash_write, xe: app_demo.xe}
+      - {name: sensor, device: core, action: jlink_flash, file: MT-W_SYNAPTICON_v3.1.7.hex}
+      - {name: app, device: drive, action: uart_flash, app: app_drive.bin, verify: auto}
+      - {name: boot, device: drive, action: uart_boot, ready: 'Drive ready', timeout: 20, after: [write]}
+
+    "after" is a list of stage names or a single stage name.
+
+    Actions:
+      xflash_erase, xflash_write (xe)           xflash on the adapter of the device
+      jlink_flash (file, jlink_device)          JLinkExe, like flash_REM_16MT.sh
+      uart_flash (app, verify), uart_write (files), uart_boot (ready, timeout), uart_cmd (cmd)
+      command (args)                            any other program
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import subprocess as sp
+from concurrent.futures import ThreadPoolExecutor
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+logger = logging.getLogger(__name__)
+
+JLINK = os.environ.get('JLINK', 'JLinkExe')
+JLINK_DEVICE = 'LPC1112'
+
+
+class ExceptionPipeline(Exception):
+    pass
+
+
+def load_spec(path):
+    """
+    Load a pipeline from YAML (.yml/.yaml) or JSON.
+    :param path: Path to spec
+    :type path: str
+    :rtype: dict
+    """
+    with open(path) as f:
+        if path.endswith(('.yml', '.yaml')):
+            import yaml
+            try:
+                spec = yaml.safe_load(f)
+            except yaml.YAMLError as e:
+                raise ExceptionPipeline('Cannot parse "%s": %s' % (path, e))
+        else:
+            spec = json.load(f)
+    check_spec(spec)
+    return spec
+
+
+def stage_after(stage):
+    """
+    Stages a stage waits for. A single name is a list with one name.
+    :rtype: list
+    """
+    after = stage.get('after') or []
+    return [after] if isinstance(after, str) else after
+
+
+def check_spec(spec):
+    """
+    Check devices, actions and dependencies of a pipeline. Raises ExceptionPipeline.
+    """
+    if not isinstance(spec, dict):
+        raise ExceptionPipeline('Pipeline must be a mapping with "devices" and "stages"')
+    devices = spec.get('devices') or {}
+    names = set()
+    for stage in spec.get('stages') or []:
+        name = stage.get('name')
+        if not name or name in names:
+            raise ExceptionPipeline('Stage name "%s" is missing or not unique' % name)
+        if stage.get('device') not in devices:
+            raise ExceptionPipeline('Stage "%s": unknown device "%s"' % (name, stage.get('device')))
+        if stage.get('action') not in Station.ACTIONS:
+            raise ExceptionPipeline('Stage "%s": unknown action "%s"' % (name, stage.get('action')))
+        if not isinstance(stage_after(stage), list):
+            raise ExceptionPipeline('Stage "%s": "after" must be a stage name or a list of stage names' % name)
+        for dep in stage_after(stage):
+            if dep not in names:
+                raise ExceptionPipeline('Stage "%s": "%s" is not an earlier stage' % (name, dep))
+        names.add(name)
+
+
+class Device(object):
+    """
+    Context of one board, shared by all of its stages.
+    """
+
+    def __init__(self, name, config, log_dir, transport=None):
+        """
+        :param transport: Factory of the serial port, see UARTFWUploader. Default is serial.Serial.
+        """
+        self.name = name
+        self.config = config
+        self.log_dir = log_dir
+        self.transport = transport
+        self.__target_file = None
+        self.__uart = None
+
+    @property
+    def target_file(self):
+        """
+        .xn file of the target. Resolved once per device.
+        """
+        if self.__target_file is None:
+            from target_registry import get_registry
+            self.__target_file = get_registry().get(self.config.get('target', 'c2x'))['file']
+        return self.__target_file
+
+    @property
+    def uart(self):
+        """
+        UART uploader of the device. Created once, the bootloader is put on hold on first use.
+        """
+        if self.__uart is None:
+            from fw_updater_uart import UARTFWUploader
+            if 'serial' not in self.config:
+                raise ExceptionPipeline('Device "%s" has no serial port' % self.name)
+            self.__uart = UARTFWUploader(self.config['serial'], transport=self.transport)
+            if self.config.get('hold', True):
+                self.__uart.send_cmd('hold')
+        return self.__uart
+
+    def log_file(self, stage):
+        return os.path.join(self.log_dir, '%s-%s.log' % (self.name, stage))
+
+
+class Station(object):
+
+    ACTIONS = ('xflash_erase', 'xflash_write', 'jlink_flash', 'uart_flash', 'uart_write', 'uart_boot',
+               'uart_cmd', 'command')
+
+    def __init__(self, spec, base_dir='.', log_dir='.', transport=None):
+        """
+        :param spec: Pipeline, see load_spec()
+        :type spec: dict
+        :param base_dir: Relative file names of stages are relative to this directory
+        :type base_dir: str
+        :param log_dir: Directory of stage logs
+        :type log_dir: str
+        :param transport: Factory with the signature of serial.Serial for the UART of all devices.
+                          Default is serial.Serial.
+        """
+        check_spec(spec)
+        self.spec = spec
+        self.base_dir = base_dir
+        self.log_dir = log_dir
+        self.devices = {name: Device(name, config or {}, log_dir, transport) for name, config in spec['devices'].items()}
+
+    def _path(self, name):
+        return os.path.join(self.base_dir, os.path.expanduser(name))
+
+    def _run_logged(self, args, log_file, stdin=None, timeout=None):
+        with open(log_file, 'w') as log:
+            log.write('$ %s\n' % ' '.join(args))
+            log.flush()
+            try:
+                ret = sp.run(args, input=stdin, stdout=log, stderr=sp.STDOUT, universal_newlines=True,
+                             timeout=timeout).returncode
+            except (OSError, sp.TimeoutExpired) as e:
+                raise ExceptionPipeline('%s failed: %s' % (args[0], e))
+        if ret != 0:
+            raise ExceptionPipeline('%s failed with exit code %d, see %s' % (args[0], ret, log_file))
+
+    def _xflash(self, device, stage, erase=False, xe=None):
+        from xflash_runner import xflash_steps, run_adapter
+        adapter = device.config.get('adapter')
+        if not adapter:
+            raise ExceptionPipeline('Device "%s" has no xTAG adapter' % device.name)
+        steps = xflash_steps(device.target_file, erase, xe and self._path(xe))
+        res = run_adapter(adapter, steps, self.log_dir, timeout=stage.get('timeout'),
+                          log_file=os.path.basename(device.log_file(stage['name'])))
+        if res['error']:
+            raise ExceptionPipeline('%s, see %s' % (res['error'], res['log']))
+        return {'log': res['log']}
+
+    def action_xflash_erase(self, device, stage):
+        return self._xflash(device, stage, erase=True)
+
+    def action_xflash_write(self, device, stage):
+        return self._xflash(device, stage, xe=stage['xe'])
+
+    def action_jlink_flash(self, device, stage):
+        script = 'connect\nloadfile %s\nexit\n' % self._path(stage['file'])
+        args = [JLINK, '-Device', stage.get('jlink_device', JLINK_DEVICE), '-if', 'SWD', '-speed', '4000']
+        log_file = device.log_file(stage['name'])
+        self._run_logged(args, log_file, script, stage.get('timeout'))
+        return {'log': log_file}
+
+    def action_uart_flash(self, device, stage):
+        if not device.uart.flash_fw(self._path(stage['app'])):
+            raise ExceptionPipeline('No reply of bootloader')
+        if stage.get('verify'):
+            return device.uart.verify(full=stage['verify'] == 'full')
+
+    def action_uart_write(self, device, stage):
+        device.uart.write_file([self._path(f) for f in stage['files']])
+
+    def action_uart_boot(self, device, stage):
+        line = device.uart.boot_console(stage.get('ready'), stage.get('timeout', 30))
+        if stage.get('ready') and line is None:
+            raise ExceptionPipeline('"%s" not seen' % stage['ready'])
+        return {'ready': line}
+
+    def action_uart_cmd(self, device, stage):
+        res = device.uart.send_cmd(stage['cmd'])
+        return {'reply': res.decode(errors='backslashreplace')}
+
+    def action_command(self, device, stage):
+        log_file = device.log_file(stage['name'])
+        self._run_logged([str(a) for a in stage['args']], log_file, timeout=stage.get('timeout'))
+        return {'log': log_file}
+
+    def _run_stage(self, stage, deps, t0):
+        res = {'name': stage['name'], 'device': stage['device'], 'action': stage['action'], 'status': 'ok'}
+        failed = [d['name'] for d in (f.result() for f in deps) if d['status'] != 'ok']
+        res['start'] = round(time.time() - t0, 3)
+        if failed:
+            res['status'] = 'skipped'
+            res['error'] = 'Failed dependencies: %s' % ', '.join(failed)
+            res['duration'] = 0
+            return res
+
+        logger.info('[%8.3f] %s: %s on %s' % (res['start'], stage['name'], stage['action'], stage['device']))
+        t_stage = time.time()
+        try:
+            out = getattr(self, 'action_' + stage['action'])(self.devices[stage['device']], stage)
+            if out:
+                res['result'] = out
+        except Exception as e:
+            # Any error of a stage must not stop the stages of other devices
+            res['status'] = 'failed'
+            res['error'] = str(e)
+        res['duration'] = round(time.time() - t_stage, 3)
+        logger.info('[%8.3f] %s: %s %.2f s%s' % (time.time() - t0, stage['name'], res['status'], res['duration'],
+                                                 ' (%s)' % res['error'] if 'error' in res else ''))
+        return res
+
+    def run(self):
+        """
+        Run all stages. A stage waits for the previous stage of its device and for its "after" stages.
+        Stages, which depend on a failed stage, are skipped.
+        :return: Report with total duration and result per stage
+        :rtype: dict
+        """
+        os.makedirs(self.log_dir, exist_ok=True)
+        stages = self.spec['stages']
+        t0 = time.time()
+        futures = {}
+        last_of_device = {}
+        # One thread per stage, waiting stages only block their own thread
+        with ThreadPoolExecutor(max_workers=max(len(stages), 1)) as executor:
+            for stage in stages:
+                deps = [futures[d] for d in stage_after(stage)]
+                if stage['device'] in last_of_device:
+                    deps.append(last_of_device[stage['device']])
+                future = executor.submit(self._run_stage, stage, deps, t0)
+                futures[stage['name']] = last_of_device[stage['device']] = future
+            results = [futures[s['name']].result() for s in stages]
+
+        return {'duration': round(time.time() - t0, 3), 'ok': all(r['status'] == 'ok' for r in results),
+                'stages': results}
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run a SOMANET station pipeline')
+    parser.add_argument('spec', help='Pipeline file (YAML or JSON)')
+    parser.add_argument('-o', '--log-dir', dest='log_dir', default='.', help='Directory of stage logs')
+    parser.add_argument('-r', '--report', dest='report', help='Write report with per stage timing to JSON file')
+
+    args = parser.parse_args()
+
+    try:
+        spec = load_spec(args.spec)
+    except (OSError, ValueError, ExceptionPipeline) as e:
+        logger.error('Error: %s' % e)
+        sys.exit(1)
+
+    report = Station(spec, os.path.dirname(os.path.abspath(args.spec)), args.log_dir).run()
+    logger.info('%s in %.2f s' % ('Done' if report['ok'] else 'FAILED', report['duration']))
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=4)
+
+    if not report['ok']:
+        sys.exit(1)
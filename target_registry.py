@@ -0,0 +1,263 @@
+#!/usr/bin/python3
+#####################################################################
+# Registry of all boards in targets/*.xn. The XML is parsed once    #
+# and cached by file hash. Targets are looked up by alias (c22,     #
+# c2x, ...), file name or board name.                               #
+#####################################################################
+
+import os
+import re
+import sys
+import json
+import hashlib
+import argparse
+import tempfile
+import xml.etree.ElementTree as ET
+
+TARGETS_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'targets')
+
+# Parsed targets, keyed by file name and hash of the .xn content
+CACHE_FILE = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'target_registry.json')
+
+# Bump, if the parsed format changes
+CACHE_VERSION = 1
+
+XN_NS = '{http://www.xmos.com}'
+
+
+class ExceptionTarget(Exception):
+    pass
+
+
+def short_alias(file_name):
+    """
+    Derive the short alias from the .xn file name, e.g. SOMANET-C22.xn -> c22,
+    SOMANET-CoreC2X.xn -> c2x, SOMANET-C21-DX-rev-b.xn -> c21b.
+    :param file_name: Name of .xn file
+    :type file_name: str
+    :rtype: str
+    """
+    alias = os.path.splitext(os.path.basename(file_name))[0].lower()
+    alias = re.sub(r'^somanet-(core)?', '', alias)
+    return alias.replace('-dx', '').replace('-rev-', '')
+
+
+def _find(elem, path):
+    return elem.find(XN_NS + path.replace('/', '/' + XN_NS))
+
+
+def _findall(elem, path):
+    return elem.findall(XN_NS + path.replace('/', '/' + XN_NS))
+
+
+def parse_xn(xn_path):
+    """
+    Parse an .xn file.
+    :param xn_path: Path to .xn file
+    :type xn_path: str
+    :return: Board name, declarations, packages with nodes and tiles, boot source, flash devices and JTAG chain
+    :rtype: dict
+    """
+    try:
+        root = ET.parse(xn_path).getroot()
+    except ET.ParseError as e:
+        raise ExceptionTarget('Cannot parse "%s": %s' % (xn_path, e))
+
+    target = {
+        'name': (_find(root, 'Name').text or '').strip(),
+        'declarations': [d.text.strip() for d in _findall(root, 'Declarations/Declaration')],
+        'packages': [],
+        'tiles': 0,
+        'boot_source': None,
+        'flash': [],
+        'jtag_chain': [int(d.get('NodeId')) for d in _findall(root, 'JTAGChain/JTAGDevice')],
+    }
+
+    # Port name -> location, to resolve the ports of flash devices
+    ports = {}
+    for package in _findall(root, 'Packages/Package'):
+        nodes = []
+        for node in _findall(package, 'Nodes/Node'):
+            source = _find(node, 'Boot/Source')
+            tiles = []
+            for tile in _findall(node, 'Tile'):
+                tile_ports = {p.get('Name'): p.get('Location') for p in _findall(tile, 'Port')}
+                ports.update(tile_ports)
+                tiles.append({'number': int(tile.get('Number')), 'reference': tile.get('Reference'),
+                              'ports': tile_ports})
+            nodes.append({
+                'id': int(node.get('Id')),
+                'type': node.get('Type'),
+                'oscillator': node.get('Oscillator'),
+                'system_frequency': node.get('SystemFrequency'),
+                'boot_source': source.get('Location') if source is not None else None,
+                'bootees': [int(b.get('NodeId')) for b in _findall(node, 'Boot/Bootee')],
+                'tiles': tiles,
+            })
+            target['tiles'] += len(tiles)
+            # The boot source of the board is the one of the node, which does not boot over a link
+            if target['boot_source'] is None and source is not None and source.get('Location') != 'LINK':
+                target['boot_source'] = source.get('Location')
+        # The "Id" attribute is spelled "id" in some files
+        package_id = package.get('Id', package.get('id'))
+        target['packages'].append({'id': int(package_id), 'type': package.get('Type'), 'nodes': nodes})
+
+    for device in _findall(root, 'ExternalDevices/Device'):
+        if not device.get('Class', '').endswith('Flash'):
+            continue
+        attributes = {a.get('Name'): a.get('Value') for a in _findall(device, 'Attribute')}
+        target['flash'].append({
+            'name': device.get('Name'),
+            'class': device.get('Class'),
+            'type': device.get('Type'),
+            'node': int(device.get('NodeId')),
+            'tile': int(device.get('Tile')),
+            'ports': {k: ports.get(v, v) for k, v in attributes.items() if k.startswith('PORT_')},
+        })
+
+    return target
+
+
+class TargetRegistry(object):
+    """
+    All targets of a directory of .xn files. Files are only parsed, if their hash is not in the cache.
+    """
+
+    def __init__(self, path=TARGETS_DIR, cache_file=CACHE_FILE):
+        """
+        Init class and load all targets.
+        :param path: Directory of .xn files
+        :type path: str
+        :param cache_file: JSON file with parsed targets. None disables the cache.
+        :type cache_file: str
+        """
+        self.path = path
+        self.cache_file = cache_file
+        self.__targets = {}
+        self.__aliases = {}
+        self.__load()
+
+    def __read_cache(self):
+        if not self.cache_file:
+            return {}
+        try:
+            with open(self.cache_file) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if cache.get('version') != CACHE_VERSION:
+            return {}
+        return cache.get('targets', {})
+
+    def __write_cache(self, cached):
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(self.cache_file), prefix='.target_registry-')
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'version': CACHE_VERSION, 'targets': cached}, f)
+            os.replace(tmp_name, self.cache_file)
+        except OSError:
+            # The cache is only an optimization
+            pass
+
+    def __load(self):
+        cache = self.__read_cache()
+        cached = {}
+        for file_name in sorted(os.listdir(self.path)):
+            if not file_name.endswith('.xn'):
+                continue
+            xn_path = os.path.join(self.path, file_name)
+            with open(xn_path, 'rb') as f:
+                digest = hashlib.sha1(f.read()).hexdigest()
+
+            key = '%s:%s' % (os.path.abspath(xn_path), digest)
+            target = cache.get(key)
+            if target is None:
+                target = parse_xn(xn_path)
+            cached[key] = target
+
+            target = dict(target, file=xn_path, hash=digest, alias=short_alias(file_name))
+            self.__targets[file_name] = target
+            for alias in (target['alias'], file_name, os.path.splitext(file_name)[0], target['name']):
+                # The first file wins, if an alias is ambiguous
+                self.__aliases.setdefault(alias.lower(), file_name)
+
+        # Keep entries of other target directories, drop outdated ones of this directory
+        own = os.path.abspath(self.path) + os.sep
+        new_cache = {k: v for k, v in cache.items() if not k.startswith(own)}
+        new_cache.update(cached)
+        if self.cache_file and new_cache != cache:
+            self.__write_cache(new_cache)
+
+    def get(self, alias):
+        """
+        Look up a target.
+        :param alias: Short alias (c22), file name with or without .xn or board name. Not case sensitive.
+        :type alias: str
+        :return: Parsed target with additional "file", "hash" and "alias"
+        :rtype: dict
+        """
+        try:
+            return self.__targets[self.__aliases[alias.lower()]]
+        except KeyError:
+            raise ExceptionTarget('Unknown target "%s". Known targets: %s' % (alias, ', '.join(self.aliases())))
+
+    def __contains__(self, alias):
+        return alias.lower() in self.__aliases
+
+    def aliases(self):
+        """
+        :return: Short aliases of all targets
+        :rtype: list
+        """
+        return [t['alias'] for t in self.__targets.values()]
+
+    def targets(self):
+        """
+        :return: All targets, sorted by file name
+        :rtype: list
+        """
+        return list(self.__targets.values())
+
+
+_registry = None
+
+
+def get_registry():
+    """
+    Registry of the targets directory of this repository. It is loaded only once per process.
+    :rtype: TargetRegistry
+    """
+    global _registry
+    if _registry is None:
+        _registry = TargetRegistry()
+    return _registry
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='SOMANET target registry')
+    arg_parser.add_argument('command', choices=('list', 'path', 'show'),
+                            help='list: all targets, path: .xn file of a target, show: parsed target as JSON')
+    arg_parser.add_argument('target', nargs='?', help='Alias, file or board name of the target')
+    arg_parser.add_argument('-d', '--dir', dest='dir', default=TARGETS_DIR, help='Directory of .xn files')
+
+    args = arg_parser.parse_args()
+    registry = TargetRegistry(args.dir)
+
+    if args.command == 'list':
+        for t in registry.targets():
+            print('%-26s %-36s %d tiles, boot %s' % (t['alias'], t['name'], t['tiles'], t['boot_source']))
+        sys.exit(0)
+
+    if not args.target:
+        arg_parser.error('No target supplied')
+    try:
+        target = registry.get(args.target)
+    except ExceptionTarget as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+    if args.command == 'path':
+        print(target['file'])
+    else:
+        print(json.dumps(target, indent=4))
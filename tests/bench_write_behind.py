@@ -0,0 +1,122 @@
+#!/usr/bin/python3
+
+"""
+    Benchmark of YModem.recv_file with and without write-behind sink
+
+    Sender and receiver run in one process, connected by queues. Storage is simulated as slow
+    by a delay per write() of the received file. Reported is the time from the last byte of a
+    packet to its ACK, which is what the sender waits for.
+
+    python3 tests/bench_write_behind.py [--size BYTES] [--delay SECONDS]
+"""
+
+import os
+import sys
+import time
+import queue
+import shutil
+import argparse
+import builtins
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ymodem.YModem import YModem
+
+FILE_NAME = 'bench.bin'
+
+
+class Pipe(object):
+
+    def __init__(self):
+        self.q = queue.Queue()
+
+    def write(self, data):
+        for b in bytes(data):
+            self.q.put(b)
+        return len(data)
+
+    def read(self, size):
+        out = bytearray()
+        while len(out) < size:
+            try:
+                out.append(self.q.get(timeout=2))
+            except queue.Empty:
+                break
+        return bytes(out) or None
+
+
+class SlowFile(object):
+    """
+    File, whose write() takes "delay" seconds longer.
+    """
+
+    def __init__(self, f, delay):
+        self._f = f
+        self._delay = delay
+
+    def write(self, data):
+        time.sleep(self._delay)
+        return self._f.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+
+def run(data, out_dir, delay, write_behind):
+    to_rcv, to_snd = Pipe(), Pipe()
+    sender = YModem(to_snd.read, to_rcv.write)
+
+    last_rx = [0.0]
+    latencies = []
+
+    def getc(size):
+        res = to_rcv.read(size)
+        last_rx[0] = time.perf_counter()
+        return res
+
+    def putc(c):
+        if c == b'\x06':
+            latencies.append(time.perf_counter() - last_rx[0])
+        return to_snd.write(c)
+
+    receiver = YModem(getc, putc)
+    real_open = builtins.open
+
+    def slow_open(path, *args, **kwargs):
+        f = real_open(path, *args, **kwargs)
+        return SlowFile(f, delay) if str(path).endswith(FILE_NAME) else f
+
+    builtins.open = slow_open
+    try:
+        t0 = time.perf_counter()
+        thread = threading.Thread(target=receiver.recv_file, args=(out_dir,), kwargs={'write_behind': write_behind})
+        thread.start()
+        sender.send(data, FILE_NAME)
+        thread.join()
+        duration = time.perf_counter() - t0
+    finally:
+        builtins.open = real_open
+
+    with open(os.path.join(out_dir, FILE_NAME), 'rb') as f:
+        ok = f.read() == data
+    return duration, sum(latencies) / len(latencies), max(latencies), ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of the YModem write-behind sink')
+    parser.add_argument('--size', type=int, default=64 * 1024, help='File size in bytes')
+    parser.add_argument('--delay', type=float, default=0.02, help='Delay of every write to storage in seconds')
+    args = parser.parse_args()
+
+    data = os.urandom(args.size)
+    out_dir = tempfile.mkdtemp()
+    try:
+        print('%d bytes, %.1f ms per write' % (args.size, args.delay * 1000))
+        print('%-14s %10s %14s %14s' % ('sink', 'total s', 'avg ACK ms', 'max ACK ms'))
+        for write_behind in (False, True):
+            duration, avg, worst, ok = run(data, out_dir, args.delay, write_behind)
+            print('%-14s %10.2f %14.2f %14.2f%s' % ('write-behind' if write_behind else 'direct', duration,
+                                                    avg * 1000, worst * 1000, '' if ok else '  CORRUPT'))
+    finally:
+        shutil.rmtree(out_dir)
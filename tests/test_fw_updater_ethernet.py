@@ -0,0 +1,172 @@
+import random
+import socket
+import struct
+import threading
+import unittest
+
+import fw_updater_ethernet as tftp
+
+
+class TFTPServer(object):
+    """
+    In-process TFTP server, which accepts one write request on 127.0.0.1.
+    """
+
+    def __init__(self, loss=0.0, seed=0, ack_every=False, reject_options=False, timeout=0.2, oack=None):
+        """
+        :param loss: Probability, that a DATA packet is dropped
+        :param ack_every: ACK every out of order packet (else only the first one after a loss)
+        :param reject_options: Answer a WRQ with options by an option error
+        :param oack: Answer a WRQ with options by this OACK payload and wait for the error of the client
+        """
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.ack_every = ack_every
+        self.reject_options = reject_options
+        self.oack = oack
+        self.client_error = None
+        self.timeout = timeout
+        self.data = None
+        self.options = None
+        self.error = None
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.settimeout(5)
+        self.port = self.sock.getsockname()[1]
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.thread.join(10)
+        self.sock.close()
+
+    def _serve(self):
+        try:
+            self._serve_wrq()
+        except Exception as e:
+            self.error = e
+
+    def _serve_wrq(self):
+        while True:
+            pkt, client = self.sock.recvfrom(65536)
+            fields = pkt[2:].split(b'\x00')
+            options = {k.decode(): int(v) for k, v in zip(fields[2::2], fields[3::2]) if k}
+            if options and self.reject_options:
+                self.sock.sendto(struct.pack('!HH', tftp.OP_ERROR, tftp.ERR_OPTION) + b'Bad option\x00', client)
+                continue
+            if options and self.oack is not None:
+                self.sock.sendto(struct.pack('!H', tftp.OP_OACK) + self.oack, client)
+                pkt, _ = self.sock.recvfrom(65536)
+                self.client_error = struct.unpack('!HH', pkt[:4])
+                self.oack = None
+                continue
+            break
+        self.options = options
+        blksize = options.get('blksize', tftp.DEFAULT_BLKSIZE)
+        windowsize = options.get('windowsize', 1)
+
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.bind(('127.0.0.1', 0))
+            sock.settimeout(self.timeout)
+            if options:
+                reply = struct.pack('!H', tftp.OP_OACK)
+                for key, value in options.items():
+                    reply += key.encode() + b'\x00' + str(value).encode() + b'\x00'
+            else:
+                reply = struct.pack('!HH', tftp.OP_ACK, 0)
+            sock.sendto(reply, client)
+
+            data = bytearray()
+            expected = 1
+            in_window = 0
+            nak = None
+            while True:
+                try:
+                    pkt, _ = sock.recvfrom(65536)
+                except socket.timeout:
+                    # Receiver timeout of RFC 7440: acknowledge the last block received
+                    sock.sendto(struct.pack('!HH', tftp.OP_ACK, (expected - 1) & 0xffff), client)
+                    in_window = 0
+                    continue
+                if self.loss and self.random.random() < self.loss:
+                    continue
+                block = struct.unpack('!H', pkt[2:4])[0]
+                if block != expected & 0xffff:
+                    if self.ack_every or nak != expected:
+                        sock.sendto(struct.pack('!HH', tftp.OP_ACK, (expected - 1) & 0xffff), client)
+                        nak = expected
+                    in_window = 0
+                    continue
+                data += pkt[4:]
+                expected += 1
+                in_window += 1
+                if len(pkt) - 4 < blksize:
+                    sock.sendto(struct.pack('!HH', tftp.OP_ACK, block), client)
+                    break
+                if in_window == windowsize:
+                    sock.sendto(struct.pack('!HH', tftp.OP_ACK, block), client)
+                    in_window = 0
+            self.data = bytes(data)
+
+
+class TestTFTPUploader(unittest.TestCase):
+
+    def _put(self, server, data, **kwargs):
+        uploader = tftp.TFTPUploader('127.0.0.1', port=server.port, timeout=0.1, **kwargs)
+        res = uploader.put(data, 'app.bin')
+        server.thread.join(10)
+        self.assertIsNone(server.error)
+        self.assertEqual(server.data, data)
+        return res
+
+    def test_windowed(self):
+        data = bytes(range(256)) * 100
+        with TFTPServer() as server:
+            res = self._put(server, data, blksize=1024, windowsize=8)
+        self.assertEqual((res['blksize'], res['windowsize']), (1024, 8))
+        self.assertEqual(server.options['tsize'], len(data))
+
+    def test_loss_ack_every(self):
+        # A receiver which ACKs every out of order packet must not cause a resend storm
+        data = bytes(range(256)) * 400
+        for seed in range(5):
+            with TFTPServer(loss=0.05, seed=seed, ack_every=True) as server:
+                self._put(server, data, blksize=512, windowsize=8)
+
+    def test_loss_ack_once(self):
+        data = bytes(range(256)) * 400
+        for seed in range(5):
+            with TFTPServer(loss=0.05, seed=seed) as server:
+                self._put(server, data, blksize=512, windowsize=8)
+
+    def test_options_rejected(self):
+        data = bytes(range(256)) * 10
+        with TFTPServer(reject_options=True) as server:
+            res = self._put(server, data)
+        self.assertEqual(server.options, {})
+        self.assertEqual((res['blksize'], res['windowsize']), (tftp.DEFAULT_BLKSIZE, 1))
+
+    def test_malformed_oack(self):
+        data = bytes(range(256)) * 10
+        for oack in (b'blksize\x00abc\x00', b'windowsize\x000\x00', b'blksize\x00\xff\x00'):
+            with TFTPServer(oack=oack) as server:
+                res = self._put(server, data, blksize=1024, windowsize=4)
+            self.assertEqual(server.client_error, (tftp.OP_ERROR, tftp.ERR_OPTION))
+            self.assertEqual((res['blksize'], res['windowsize']), (tftp.DEFAULT_BLKSIZE, 1))
+
+    def test_empty_file(self):
+        with TFTPServer() as server:
+            res = self._put(server, b'')
+        self.assertEqual(res['size'], 0)
+
+    def test_multiple_of_blksize(self):
+        # Needs an empty last block
+        with TFTPServer() as server:
+            self._put(server, b'x' * 2048, blksize=512, windowsize=4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import os
+import shutil
+import subprocess as sp
+import tempfile
+import unittest
+from unittest import mock
+
+import git_workspace
+
+
+def git(repo, *args):
+    return sp.run(['git', '-C', repo] + list(args), stdout=sp.PIPE, stderr=sp.PIPE, universal_newlines=True,
+                  check=True).stdout.strip()
+
+
+@unittest.skipIf(shutil.which('git') is None, 'git is not installed')
+class TestWorkspace(unittest.TestCase):
+    """
+    Clone from a local bare repository over a file:// URL.
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        env = {'GIT_AUTHOR_NAME': 'Test', 'GIT_AUTHOR_EMAIL': 'test@example.com',
+               'GIT_COMMITTER_NAME': 'Test', 'GIT_COMMITTER_EMAIL': 'test@example.com',
+               'GIT_CONFIG_GLOBAL': os.devnull, 'GIT_CONFIG_NOSYSTEM': '1'}
+        patcher = mock.patch.dict(os.environ, env)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # Upstream work tree, which pushes to the bare repository "remote/sc_test"
+        self.upstream = os.path.join(self.tmp, 'upstream')
+        os.mkdir(self.upstream)
+        git(self.upstream, 'init', '-q')
+        git(self.upstream, 'symbolic-ref', 'HEAD', 'refs/heads/main')
+        self.commit('first')
+        git(self.upstream, 'tag', 'v1.0')
+        self.remote = os.path.join(self.tmp, 'remote')
+        sp.run(['git', 'clone', '-q', '--bare', self.upstream, os.path.join(self.remote, 'sc_test')], check=True)
+        git(self.upstream, 'remote', 'add', 'origin', os.path.join(self.remote, 'sc_test'))
+
+        self.workspace = os.path.join(self.tmp, 'workspace')
+        self.url = 'file://%s/' % self.remote
+
+    def commit(self, text):
+        with open(os.path.join(self.upstream, 'README'), 'w') as f:
+            f.write(text)
+        git(self.upstream, 'add', 'README')
+        git(self.upstream, 'commit', '-q', '-m', text)
+        return git(self.upstream, 'rev-parse', 'HEAD')
+
+    def test_clone_fetch_status(self):
+        first = git(self.upstream, 'rev-parse', 'HEAD')
+        res, = git_workspace.clone_all(['sc_test'], self.workspace, self.url)
+        self.assertEqual((res['action'], res['error']), ('clone', None))
+        repo = os.path.join(self.workspace, 'sc_test')
+
+        status, = git_workspace.collect(git_workspace.find_repos(self.workspace), dirty=True, describe=True)
+        self.assertEqual(status, {'path': repo, 'head': first, 'branch': 'main', 'dirty': False,
+                                  'describe': 'v1.0'})
+
+        # A second run fetches new commits, the work tree stays
+        second = self.commit('second')
+        git(self.upstream, 'push', '-q', 'origin', 'main')
+        res, = git_workspace.clone_all(['sc_test'], self.workspace, self.url)
+        self.assertEqual((res['action'], res['error']), ('fetch', None))
+        self.assertEqual(git(repo, 'rev-parse', 'origin/main'), second)
+        self.assertEqual(git_workspace.read_head(repo), (first, 'main'))
+
+        # Modified tracked file, new branch with loose ref
+        git(repo, 'checkout', '-q', '-b', 'feature', 'origin/main')
+        with open(os.path.join(repo, 'README'), 'w') as f:
+            f.write('changed')
+        status, = git_workspace.collect([repo], dirty=True, describe=True)
+        self.assertEqual((status['head'], status['branch'], status['dirty']), (second, 'feature', True))
+        self.assertRegex(status['describe'], r'^v1\.0-1-g[0-9a-f]+-dirty$')
+
+        # Detached HEAD
+        git(repo, 'checkout', '-q', '-f', first)
+        self.assertEqual(git_workspace.read_head(repo), (first, None))
+
+    def test_clone_error(self):
+        res, = git_workspace.clone_all(['sc_missing'], self.workspace, self.url)
+        self.assertEqual(res['action'], 'clone')
+        self.assertTrue(res['error'])
+
+    def test_status_error(self):
+        os.makedirs(os.path.join(self.workspace, 'broken', '.git'))
+        status, = git_workspace.collect(git_workspace.find_repos(self.workspace))
+        self.assertIn('error', status)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,226 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import gspread.utils as gut
+    from pyworktimer_modules import google_drive
+    from pyworktimer_modules.google_drive import GoogleCalc
+    from pyworktimer_modules.exceptions import ExceptionGoogle
+except ImportError:
+    google_drive = None
+
+
+class FakeWorksheet(object):
+    """
+    Worksheet, which stores the values and the input option of every written cell.
+    """
+
+    def __init__(self, rows):
+        self.rows = [list(r) for r in rows]
+        self.options = {}
+        self.calls = []
+        # Values the server stores instead of the written ones, e.g. protected cells
+        self.override = {}
+
+    @property
+    def row_count(self):
+        return len(self.rows)
+
+    def _set(self, row, col, value):
+        while len(self.rows) < row:
+            self.rows.append([])
+        r = self.rows[row - 1]
+        r.extend([''] * (col - len(r)))
+        r[col - 1] = str(self.override.get((row, col), value))
+
+    def _get(self, row, col):
+        try:
+            return self.rows[row - 1][col - 1]
+        except IndexError:
+            return ''
+
+    def batch_update(self, data, value_input_option=None):
+        self.calls.append(('batch_update', value_input_option))
+        for d in data:
+            row, col = gut.a1_to_rowcol(d['range'])
+            self._set(row, col, d['values'][0][0])
+            self.options[(row, col)] = value_input_option
+
+    def batch_get(self, ranges):
+        self.calls.append(('batch_get', len(ranges)))
+        res = []
+        for a1 in ranges:
+            value = self._get(*gut.a1_to_rowcol(a1))
+            res.append([[value]] if value else [])
+        return res
+
+    def get_all_values(self):
+        self.calls.append(('get_all_values',))
+        return [list(r) for r in self.rows]
+
+
+class FakeResponse(object):
+
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class FakeClient(object):
+    """
+    Drive API of the modification time of the file.
+    """
+
+    def __init__(self):
+        self.modified = '2026-10-19T08:00:00.000Z'
+        self.requests = 0
+
+    def request(self, method, endpoint, params=None):
+        self.requests += 1
+        return FakeResponse({'modifiedTime': self.modified})
+
+
+class FakeFile(object):
+
+    def __init__(self, sheet):
+        self.sheet = sheet
+        self.title = 'DB'
+        self.id = 'id'
+        self.client = FakeClient()
+
+
+class FakeSession(object):
+
+    def __init__(self, sheet):
+        self.file = FakeFile(sheet)
+
+    def open_by_key(self, key):
+        return self.file
+
+    def worksheet(self, key, title, refresh=False):
+        if refresh:
+            self.file.sheet.calls.append(('refresh',))
+        return self.file.sheet
+
+    def refresh(self):
+        pass
+
+
+@unittest.skipIf(google_drive is None, 'gspread is not installed')
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.sheet = FakeWorksheet([['Date', '', 'Start', 'End'], ['1.10.2026', '', '', '']])
+        keyfile = os.path.abspath('fake-key.json')
+        google_drive._sessions[keyfile] = FakeSession(self.sheet)
+        self.addCleanup(google_drive._sessions.pop, keyfile)
+        self.gcalc = GoogleCalc('fake-key.json', 'id', 'sheet')
+        self.gcalc.open()
+
+    def test_batch(self):
+        with self.gcalc.batch():
+            self.gcalc.write(2, 3, '08:00')
+            with self.gcalc.batch():
+                self.gcalc.write(2, 4, '17:00')
+            self.assertEqual(self.sheet.calls, [])
+            self.gcalc.write_col_multi(3, 1, ['007', 'x'])
+
+        self.assertEqual(self.sheet.calls, [('batch_update', 'USER_ENTERED'), ('batch_update', 'RAW'),
+                                            ('batch_get', 4)])
+        self.assertEqual(self.sheet.options, {(2, 3): 'USER_ENTERED', (2, 4): 'USER_ENTERED',
+                                              (3, 1): 'RAW', (3, 2): 'RAW'})
+        self.assertEqual(self.sheet.rows[1:], [['1.10.2026', '', '08:00', '17:00'], ['007', 'x']])
+
+    def test_batch_exception(self):
+        with self.assertRaises(KeyError):
+            with self.gcalc.batch():
+                self.gcalc.write(2, 3, '08:00')
+                raise KeyError()
+        self.assertEqual(self.sheet.calls, [])
+        self.gcalc.flush()
+        self.assertEqual(self.sheet.calls, [])
+
+    def test_flush_verify(self):
+        self.sheet.override[(2, 4)] = 'protected'
+        self.gcalc.buffer_write(2, 3, '08:00')
+        self.gcalc.buffer_write(2, 4, '17:00')
+        with self.assertRaises(ExceptionGoogle):
+            self.gcalc.flush()
+
+        # Not verified, so a repeated flush writes again
+        del self.sheet.override[(2, 4)]
+        self.sheet.calls.clear()
+        self.gcalc.flush()
+        self.assertEqual(self.sheet.calls, [('batch_update', 'USER_ENTERED'), ('batch_get', 2)])
+        self.assertEqual(self.sheet.rows[1][2:], ['08:00', '17:00'])
+        self.sheet.calls.clear()
+        self.gcalc.flush()
+        self.assertEqual(self.sheet.calls, [])
+
+    def test_flush_sample(self):
+        for col in range(1, 11):
+            self.gcalc.buffer_write(3, col, col)
+        self.gcalc.flush(sample=3)
+        self.assertEqual(self.sheet.calls, [('batch_update', 'USER_ENTERED'), ('batch_get', 3)])
+
+
+@unittest.skipIf(google_drive is None, 'gspread is not installed')
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.sheet = FakeWorksheet([['Date', '', 'Start', 'End'], ['1.10.2026', '', '', '']])
+        self.session = FakeSession(self.sheet)
+        keyfile = os.path.abspath('fake-key.json')
+        google_drive._sessions[keyfile] = self.session
+        self.addCleanup(google_drive._sessions.pop, keyfile)
+
+    def gcalc(self, ttl, cache_file=None):
+        gcalc = GoogleCalc('fake-key.json', 'id', 'sheet')
+        gcalc.open()
+        gcalc.enable_snapshot(cache_file, ttl)
+        return gcalc
+
+    def change(self, value):
+        # Another client writes a cell
+        self.sheet.rows[1][2] = value
+        self.session.file.client.modified = '2026-10-19T09:00:00.000Z'
+
+    def test_ttl(self):
+        gcalc = self.gcalc(3600)
+        self.assertEqual(gcalc.get_cell(2, 1), '1.10.2026')
+        self.change('08:00')
+        self.assertEqual(gcalc.get_cell(2, 3), '')
+        self.assertEqual(gcalc.get_row_count(), 2)
+        self.assertEqual(self.sheet.calls, [('get_all_values',)])
+
+    def test_revision(self):
+        gcalc = self.gcalc(0)
+        self.assertEqual(gcalc.get_cell(2, 3), '')
+        self.assertEqual(gcalc.get_cell(2, 3), '')
+        self.assertEqual(self.sheet.calls, [('get_all_values',)])
+
+        # The modification time is fetched on every check, not taken from the opened file
+        self.change('08:00')
+        self.assertEqual(gcalc.get_cell(2, 3), '08:00')
+        self.assertEqual(gcalc.find('08:00').row, 2)
+        self.assertEqual(self.sheet.calls, [('get_all_values',)] * 2)
+
+    def test_cache_file(self):
+        cache_file = os.path.join(self.tmp, 'snapshot.json')
+        self.gcalc(0, cache_file).get_cell(1, 1)
+        self.assertEqual(self.gcalc(0, cache_file).get_cell(2, 1), '1.10.2026')
+        self.assertEqual(self.sheet.calls, [('get_all_values',)])
+
+        self.change('08:00')
+        self.assertEqual(self.gcalc(0, cache_file).get_cell(2, 3), '08:00')
+        self.assertEqual(self.sheet.calls, [('get_all_values',)] * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import init_workspace
+
+MAIN_XC = '''#include <COM_BOARD_REQUIRED>
+#include <CORE_BOARD_REQUIRED>
+#include <DRIVE_BOARD_REQUIRED>
+
+int main(void) { return 0; }
+'''
+
+MAKEFILE = '''TARGET =
+APP_NAME =
+'''
+
+
+class TestInitWorkspace(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        patcher = mock.patch.object(init_workspace, 'CACHE_FILE', os.path.join(self.tmp, 'cache', 'state.json'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.workspace = os.path.join(self.tmp, 'workspace')
+        self.files = {}
+        for name, content in (('main.xc', MAIN_XC), ('Makefile', MAKEFILE)):
+            for app in ('app_a', 'app_b'):
+                path = os.path.join(self.workspace, 'sc_repo', app, name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'w') as f:
+                    f.write(content)
+                self.files[path] = None
+
+    def run_init(self, core='c22', **kwargs):
+        return init_workspace.init_workspace(self.workspace, 'ecat', core, 'd1000c', **kwargs)
+
+    def mtimes(self):
+        return {f: os.stat(f).st_mtime_ns for f in self.files}
+
+    def test_second_run(self):
+        n_files, changed, skipped = self.run_init()
+        self.assertEqual((n_files, len(changed), skipped), (4, 4, {}))
+        with open(os.path.join(self.workspace, 'sc_repo', 'app_a', 'Makefile')) as f:
+            self.assertEqual(f.readline(), 'TARGET = SOMANET-CoreC22\n')
+        mtimes = self.mtimes()
+
+        # Unchanged files are neither read nor written
+        with mock.patch.object(init_workspace, 'rewrite_main_xc') as main_xc, \
+                mock.patch.object(init_workspace, 'rewrite_makefile') as makefile:
+            self.assertEqual(self.run_init(), (4, {}, {}))
+        main_xc.assert_not_called()
+        makefile.assert_not_called()
+        self.assertEqual(self.mtimes(), mtimes)
+
+        # The state is not stored in the workspace
+        self.assertEqual(os.listdir(self.workspace), ['sc_repo'])
+
+    def test_changed_selection(self):
+        self.run_init()
+        n_files, changed, skipped = self.run_init('c2x')
+        self.assertEqual(len(changed), 4)
+        with open(os.path.join(self.workspace, 'sc_repo', 'app_b', 'main.xc')) as f:
+            self.assertIn('#include <CoreC2X-rev-a.bsp>', f.read())
+
+    def test_unknown_core(self):
+        mtimes = self.mtimes()
+        for core in ('', 'nope'):
+            with self.assertRaises(init_workspace.ExceptionTarget):
+                self.run_init(core)
+        self.assertEqual(self.mtimes(), mtimes)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+import json
+import os
+import shutil
+import subprocess as sp
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import make_upgrade_binary
+
+# Stub of xflash: "--version" prints $XFLASH_VERSION, a conversion writes the .xe content to the
+# output file and appends a line to $XFLASH_LOG. An .xe file starting with "bad" fails.
+XFLASH = '''#!/bin/sh
+if [ "$1" = "--version" ]; then echo "XFLASH Version: $XFLASH_VERSION"; exit 0; fi
+while [ $# -gt 0 ]; do
+    case "$1" in
+        --upgrade) xe="$3"; shift 2 ;;
+        -o) out="$2"; shift ;;
+    esac
+    shift
+done
+echo "$xe" >> "$XFLASH_LOG"
+case "$(head -c 3 "$xe")" in bad) echo "Error: invalid file" >&2; exit 1 ;; esac
+touch decompressor-1
+cat "$xe" > "$out"
+'''
+
+
+class XflashTestCase(unittest.TestCase):
+    """
+    Runs with the xflash stub first on PATH and a private cache directory.
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        bin_dir = os.path.join(self.tmp, 'bin')
+        os.mkdir(bin_dir)
+        with open(os.path.join(bin_dir, 'xflash'), 'w') as f:
+            f.write(XFLASH)
+        os.chmod(os.path.join(bin_dir, 'xflash'), 0o755)
+
+        self.log = os.path.join(self.tmp, 'xflash.log')
+        env = {'PATH': bin_dir + os.pathsep + os.environ['PATH'], 'XFLASH_LOG': self.log,
+               'XFLASH_VERSION': '14.3.3', 'XDG_CACHE_HOME': os.path.join(self.tmp, 'cache')}
+        patcher = mock.patch.dict(os.environ, env)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(make_upgrade_binary, 'CACHE_DIR', os.path.join(self.tmp, 'cache'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        make_upgrade_binary.xflash_version.cache_clear()
+        self.addCleanup(make_upgrade_binary.xflash_version.cache_clear)
+
+    def xe(self, name, content):
+        path = os.path.join(self.tmp, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def conversions(self):
+        if not os.path.isfile(self.log):
+            return []
+        with open(self.log) as f:
+            return [os.path.basename(line.strip()) for line in f]
+
+
+class TestCache(XflashTestCase):
+
+    def test_hit_and_miss(self):
+        a = self.xe('app_a.xe', 'image 1')
+        b = self.xe('app_b.xe', 'image 1')
+        out = os.path.join(self.tmp, 'out.bin')
+
+        self.assertFalse(make_upgrade_binary.convert(a, out))
+        # Same content under another name is a hit
+        self.assertTrue(make_upgrade_binary.convert(b, out))
+        self.assertEqual(self.conversions(), ['app_a.xe'])
+        with open(out) as f:
+            self.assertEqual(f.read(), 'image 1')
+
+        # Another xflash version is a miss
+        os.environ['XFLASH_VERSION'] = '15.2.4'
+        make_upgrade_binary.xflash_version.cache_clear()
+        self.assertFalse(make_upgrade_binary.convert(b, out))
+        self.assertTrue(make_upgrade_binary.convert(a, out))
+        self.assertEqual(self.conversions(), ['app_a.xe', 'app_b.xe'])
+
+    def test_copy(self):
+        a = self.xe('app_a.xe', 'image 1')
+        out = os.path.join(self.tmp, 'out.bin')
+        make_upgrade_binary.convert(a, out)
+        # Editing the output must not change the cached binary
+        with open(out, 'w') as f:
+            f.write('edited')
+        self.assertTrue(make_upgrade_binary.convert(a, out))
+        with open(out) as f:
+            self.assertEqual(f.read(), 'image 1')
+
+    def test_no_cache(self):
+        a = self.xe('app_a.xe', 'image 1')
+        out = os.path.join(self.tmp, 'out.bin')
+        make_upgrade_binary.convert(a, out, use_cache=False)
+        make_upgrade_binary.convert(a, out, use_cache=False)
+        self.assertEqual(self.conversions(), ['app_a.xe', 'app_a.xe'])
+        self.assertFalse(os.path.isdir(make_upgrade_binary.CACHE_DIR))
+
+    def test_failure(self):
+        bad = self.xe('app_bad.xe', 'bad image')
+        out = os.path.join(self.tmp, 'out.bin')
+        with self.assertRaises(RuntimeError):
+            make_upgrade_binary.convert(bad, out)
+        self.assertFalse(os.path.exists(out))
+        self.assertEqual(os.listdir(make_upgrade_binary.CACHE_DIR), [])
+
+
+class TestBatch(XflashTestCase):
+
+    def test_job_error(self):
+        bad = self.xe('app_bad.xe', 'bad image')
+        res = make_upgrade_binary._convert_job(bad, os.path.join(self.tmp, 'app_bad.bin'), True)
+        self.assertIn('xflash failed', res['error'])
+        self.assertFalse(res['cached'])
+
+    def test_batch(self):
+        xe_dir = os.path.join(self.tmp, 'xe')
+        os.mkdir(xe_dir)
+        self.xe('xe/app_bad.xe', 'bad image')
+        self.xe('xe/app_good.xe', 'image 1')
+        out_dir = os.path.join(self.tmp, 'out')
+        summary = os.path.join(self.tmp, 'summary.json')
+
+        script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'make_upgrade_binary.py')
+        res = sp.run([sys.executable, script, xe_dir, '-o', out_dir, '-j', '2', '-s', summary],
+                     stdout=sp.PIPE, stderr=sp.STDOUT, universal_newlines=True, cwd=self.tmp, timeout=60)
+
+        # The failed job is reported and does not stop the other one
+        self.assertEqual(res.returncode, 1, res.stdout)
+        self.assertIn('Error: xflash failed for "%s"' % os.path.join(xe_dir, 'app_bad.xe'), res.stdout)
+        self.assertEqual(sorted(os.listdir(out_dir)), ['app_good.bin', 'app_good.bin.json'])
+        with open(os.path.join(out_dir, 'app_good.bin')) as f:
+            self.assertEqual(f.read(), 'image 1')
+        with open(summary) as f:
+            binaries = {os.path.basename(b['xe']): b for b in json.load(f)['binaries']}
+        self.assertIsNone(binaries['app_good.xe']['error'])
+        self.assertIn('xflash failed', binaries['app_bad.xe']['error'])
+        self.assertEqual(sorted(self.conversions()), ['app_bad.xe', 'app_good.xe'])
+
+
+if __name__ == '__main__':
+    unittest.main()
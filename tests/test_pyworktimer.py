@@ -0,0 +1,128 @@
+import contextlib
+import os
+import shutil
+import tempfile
+import unittest
+
+import pyworktimer
+
+
+class FakeCell(object):
+
+    def __init__(self, row, col, value):
+        self.row, self.col, self.value = row, col, value
+
+
+class FakeCalc(object):
+    """
+    Minimal GoogleCalc with a sheet of one date per row.
+    """
+
+    def __init__(self, title, dates):
+        self.title = title
+        self.rows = [['Date', '', 'Start', 'End']] + [[d, '', '', ''] for d in dates]
+
+    def sheet_name(self):
+        return self.title
+
+    def get_row_values(self, row):
+        return list(self.rows[row - 1]) if row <= len(self.rows) else []
+
+    def find(self, value):
+        for r, row in enumerate(self.rows, 1):
+            if value in row:
+                return FakeCell(r, row.index(value) + 1, value)
+        return None
+
+    def batch(self):
+        return contextlib.nullcontext(self)
+
+    def write(self, row, col, value):
+        self.rows[row - 1][col - 1] = value
+
+
+class TestSync(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.sheets = {'2026': FakeCalc('Zeit 2026', ['18.10.2026', '19.10.2026'])}
+        self.timer = pyworktimer.PyWorkTimer(self.dir)
+        self.timer._open_sheet = self.sheets.get
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _punch(self, date, time, col=pyworktimer.PyWorkTimer.START_TIME):
+        self.timer.today, self.timer.year, self.timer.now = date, date[-4:], time
+        self.timer._set_time(col)
+
+    def test_sync(self):
+        self._punch('19.10.2026', '08:00')
+        self._punch('19.10.2026', '17:00', pyworktimer.PyWorkTimer.END_TIME)
+        self.assertTrue(self.timer.sync())
+        self.assertEqual(self.sheets['2026'].rows[2], ['19.10.2026', '', '08:00', '17:00'])
+        self.assertEqual(self.timer.journal.pending()[0], [])
+
+    def test_missing_year_stays_pending(self):
+        self._punch('31.12.2025', '08:00')
+        self._punch('19.10.2026', '09:00')
+        self.assertFalse(self.timer.sync())
+        # The punch of 2026 is written and committed, the one without sheet is kept
+        self.assertEqual(self.sheets['2026'].rows[2][2], '09:00')
+        pending = self.timer.journal.pending()[0]
+        self.assertEqual([e['date'] for e in pending], ['31.12.2025'])
+
+        # Later punches are not synced again
+        self.sheets['2026'].rows[2][2] = ''
+        self._punch('18.10.2026', '07:00')
+        self.assertFalse(self.timer.sync())
+        self.assertEqual(self.sheets['2026'].rows[1][2], '07:00')
+        self.assertEqual(self.sheets['2026'].rows[2][2], '')
+
+        # Once the sheet exists, the punch is synced
+        self.sheets['2025'] = FakeCalc('Zeit 2025', ['31.12.2025'])
+        self.assertTrue(self.timer.sync())
+        self.assertEqual(self.sheets['2025'].rows[1][2], '08:00')
+        self.assertEqual(self.timer.journal.pending()[0], [])
+
+    def test_compact(self):
+        journal_file = os.path.join(self.dir, 'journal.jsonl')
+        self._punch('19.10.2026', '08:00')
+        self._punch('20.10.2026', '08:30')
+        self.assertFalse(self.timer.sync())
+        # Everything is committed, the missing date is in the retry file
+        self.assertEqual(os.path.getsize(journal_file), 0)
+        entries, offset = self.timer.journal.pending()
+        self.assertEqual(([e['date'] for e in entries], offset), (['20.10.2026'], 0))
+
+        self._punch('19.10.2026', '17:00', pyworktimer.PyWorkTimer.END_TIME)
+        self.assertFalse(self.timer.sync())
+        self.assertEqual(self.sheets['2026'].rows[2], ['19.10.2026', '', '08:00', '17:00'])
+        self.assertEqual(os.path.getsize(journal_file), 0)
+        self.assertEqual([e['date'] for e in self.timer.journal.pending()[0]], ['20.10.2026'])
+
+    def test_commit_keeps_new_entries(self):
+        journal = self.timer.journal
+        journal.append({'n': 1})
+        entries, offset = journal.pending()
+        # Appended while syncing
+        journal.append({'n': 2})
+        journal.commit(offset)
+        self.assertEqual(journal.pending()[0], [{'n': 2}])
+        journal.commit(journal.pending()[1])
+        self.assertEqual(journal.pending(), ([], 0))
+
+    def test_missing_date_stays_pending(self):
+        self._punch('19.10.2026', '08:00')
+        self._punch('20.10.2026', '08:30')
+        self.assertFalse(self.timer.sync())
+        self.assertEqual([e['date'] for e in self.timer.journal.pending()[0]], ['20.10.2026'])
+
+        self.sheets['2026'].rows.append(['20.10.2026', '', '', ''])
+        self.assertTrue(self.timer.sync())
+        self.assertEqual(self.sheets['2026'].rows[3][2], '08:30')
+        self.assertEqual(self.timer.journal.pending()[0], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
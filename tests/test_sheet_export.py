@@ -0,0 +1,64 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyworktimer_modules.sheet_export import SheetExporter
+
+
+class FakeCalc(object):
+    """
+    GoogleCalc with one sheet. iter_rows can be interrupted after a number of rows.
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.interrupt = None
+
+    def sheet_name(self):
+        return 'db'
+
+    def get_row_values(self, row):
+        return list(self.rows[row - 1])
+
+    def iter_rows(self, col_start, col_stop, page_size=1000, start_row=1):
+        for i, row in enumerate(self.rows[start_row - 1:]):
+            if i == self.interrupt:
+                raise KeyboardInterrupt()
+            yield row[col_start - 1:col_stop]
+
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        # Non-ASCII values, so characters and bytes differ
+        self.gcalc = FakeCalc([['SN', 'Prüfer']] + [['S%d' % i, 'Jürgen Ø %d' % i] for i in range(25)])
+        self.exporter = SheetExporter(self.gcalc, self.dir, page_size=10)
+
+    def test_resume(self):
+        self.gcalc.interrupt = 15
+        with self.assertRaises(KeyboardInterrupt):
+            self.exporter.export()
+        with open(os.path.join(self.dir, 'db.state.json')) as f:
+            state = json.load(f)
+        self.assertEqual(state['rows'], 10)
+        self.assertEqual(state['bytes'], os.path.getsize(os.path.join(self.dir, 'db.csv')))
+
+        self.gcalc.interrupt = None
+        self.assertEqual(self.exporter.export(), 16)
+        self.assertEqual(self.exporter.read_values('db'), self.gcalc.rows)
+
+        self.gcalc.rows.append(['new', 'Ä'])
+        self.assertEqual(self.exporter.export(), 1)
+        self.assertEqual(self.exporter.read_records('db')[-1], {'SN': 'new', 'Prüfer': 'Ä'})
+
+    def test_no_header(self):
+        self.gcalc.rows = [[]]
+        self.assertEqual(self.exporter.export(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,188 @@
+import io
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import zlib
+
+try:
+    import serial
+except ImportError:
+    serial = None
+
+from station_pipeline import Station, ExceptionPipeline, check_spec
+from ymodem.YModem import YModem
+
+
+class FakeBootloader(object):
+    """
+    Bootloader of a drive: commands over a byte stream, files are received with YMODEM.
+    """
+
+    def __init__(self):
+        self.to_host = queue.Queue()
+        self.from_host = queue.Queue()
+        self.files = {}
+        self.commands = []
+        self.modem = YModem(self.getc, self.putc)
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def getc(self, size):
+        data = bytearray()
+        while len(data) < size:
+            try:
+                data.append(self.from_host.get(timeout=3))
+            except queue.Empty:
+                break
+        return bytes(data) or None
+
+    def putc(self, data):
+        for b in bytes(data):
+            self.to_host.put(b)
+
+    def say(self, text):
+        self.putc(text.encode())
+
+    def run(self):
+        line = b''
+        while True:
+            c = self.from_host.get()
+            if c != 10:
+                line += bytes([c])
+                continue
+            cmd = line.decode().strip().split()
+            line = b''
+            self.commands.append(' '.join(cmd))
+            if not cmd:
+                self.say('> \r\n')
+            elif cmd[0] == 'hold':
+                self.say('Hold\r\n')
+            elif cmd[0] == 'getlist':
+                self.say(''.join('%s, size: %d\r\n' % (k, len(v)) for k, v in self.files.items()))
+            elif cmd[0] == 'crc':
+                self.say('crc %s\r\nCRC: 0x%08x\r\n' % (cmd[1], zlib.crc32(self.files[cmd[1]])))
+            elif cmd[0] == 'flash':
+                self.say('Ready for ymodem\r\n')
+                time.sleep(0.2)
+                buf = io.BytesIO()
+                self.modem.recv(buf)
+                self.files[self.modem.rt.get_task_name()] = buf.getvalue()
+                self.modem.reset()
+                self.say('Done\r\n')
+            elif cmd[0] == 'boot':
+                self.say('Booting\r\nInit\r\nDrive ready\r\n')
+            else:
+                self.say('Unknown command\r\n')
+
+
+class FakeSerial(object):
+    """
+    Port with the interface of serial.Serial, which is connected to a FakeBootloader.
+    """
+
+    def __init__(self, device, timeout=None):
+        self.device = device
+        self.timeout = timeout
+
+    @property
+    def in_waiting(self):
+        time.sleep(0.001)
+        return self.device.to_host.qsize()
+
+    def read(self, size=1):
+        data = bytearray()
+        end = time.time() + (self.timeout or 1)
+        while len(data) < size:
+            try:
+                data.append(self.device.to_host.get(timeout=max(0, end - time.time())))
+            except queue.Empty:
+                break
+        return bytes(data)
+
+    def write(self, data):
+        for b in bytes(data):
+            self.device.from_host.put(b)
+        return len(data)
+
+    def reset_input_buffer(self):
+        while not self.device.to_host.empty():
+            self.device.to_host.get_nowait()
+
+    def reset_output_buffer(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class TestCheckSpec(unittest.TestCase):
+
+    def spec(self, after):
+        return {'devices': {'core': {}},
+                'stages': [{'name': 'erase', 'device': 'core', 'action': 'xflash_erase'},
+                           {'name': 'write', 'device': 'core', 'action': 'xflash_write', 'after': after}]}
+
+    def test_after_name(self):
+        check_spec(self.spec('erase'))
+        check_spec(self.spec(['erase']))
+
+    def test_after_unknown(self):
+        with self.assertRaises(ExceptionPipeline):
+            check_spec(self.spec('era'))
+        with self.assertRaises(ExceptionPipeline):
+            check_spec(self.spec(3))
+
+
+@unittest.skipIf(serial is None, 'pyserial is not installed')
+class TestUARTStages(unittest.TestCase):
+
+    def setUp(self):
+        import fw_updater_uart
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        cache = fw_updater_uart.CHECKSUM_CACHE
+        fw_updater_uart.CHECKSUM_CACHE = os.path.join(self.tmp, 'checksums.json')
+        self.addCleanup(setattr, fw_updater_uart, 'CHECKSUM_CACHE', cache)
+
+        self.app = os.urandom(3000)
+        with open(os.path.join(self.tmp, 'app_drive.bin'), 'wb') as f:
+            f.write(self.app)
+        self.bootloader = FakeBootloader()
+        self.ports = []
+
+    def transport(self, port, baudrate, timeout=None):
+        self.ports.append(port)
+        return FakeSerial(self.bootloader, timeout)
+
+    def test_flash_and_boot(self):
+        spec = {'devices': {'drive': {'serial': 'ttyUSB0'}},
+                'stages': [{'name': 'app', 'device': 'drive', 'action': 'uart_flash', 'app': 'app_drive.bin',
+                            'verify': 'auto'},
+                           {'name': 'boot', 'device': 'drive', 'action': 'uart_boot', 'ready': 'Drive ready',
+                            'timeout': 5, 'after': 'app'}]}
+        report = Station(spec, self.tmp, self.tmp, transport=self.transport).run()
+
+        self.assertTrue(report['ok'], report)
+        self.assertEqual(self.bootloader.files['app_drive.bin'], self.app)
+        app, boot = report['stages']
+        self.assertEqual(app['result'], {'method': 'crc', 'crc32': zlib.crc32(self.app)})
+        self.assertEqual(boot['result'], {'ready': 'Drive ready'})
+        self.assertEqual(self.bootloader.commands[0], 'hold')
+        self.assertEqual(set(self.ports), {'/dev/ttyUSB0'})
+
+    def test_no_reply(self):
+        self.bootloader.say = lambda text: None
+        spec = {'devices': {'drive': {'serial': 'ttyUSB0', 'hold': False}},
+                'stages': [{'name': 'cmd', 'device': 'drive', 'action': 'uart_cmd', 'cmd': 'getlist'},
+                           {'name': 'boot', 'device': 'drive', 'action': 'uart_boot', 'after': ['cmd']}]}
+        report = Station(spec, self.tmp, self.tmp, transport=self.transport).run()
+
+        self.assertFalse(report['ok'])
+        self.assertEqual([s['status'] for s in report['stages']], ['failed', 'skipped'])
+
+
+if __name__ == '__main__':
+    unittest.main()
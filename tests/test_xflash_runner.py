@@ -0,0 +1,110 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import xflash_runner
+from xflash_runner import ExceptionXflash
+
+# Output of "xflash --list-devices" of xTIMEcomposer 14, columns separated by tabs
+LIST_DEVICES = '''Available XMOS Devices
+----------------------
+
+  ID\\tName\\t\\t\\tAdapter ID\\tDevices
+  --\\t----\\t\\t\\t----------\\t-------
+  0\\tXMOS XTAG-3\\t\\t2PXBQ3PZ\\tP[0]
+  1\\tXMOS XTAG-3\\t\\t8RDC2WJY\\tP[0]
+  2\\tXMOS XTAG-2\\t\\tLX1Q5A7N\\tNone
+'''
+
+# Stub of xflash. Every call of a step waits until all adapters of $XFLASH_ADAPTERS have started
+# one, so the steps only finish if they run concurrently. Adapter BAD fails every step.
+XFLASH = '''#!/bin/sh
+if [ "$1" = "--list-devices" ]; then printf '%s'; exit 0; fi
+adapter="$2"
+echo "$adapter $3" >> "$XFLASH_DIR/calls"
+echo "Step $3 on $adapter"
+touch "$XFLASH_DIR/started-$adapter"
+for i in $(seq 50); do
+    [ "$(ls "$XFLASH_DIR" | grep -c started-)" -ge "$XFLASH_ADAPTERS" ] && break
+    sleep 0.1
+done
+[ "$adapter" = "BAD" ] && exit 2
+exit 0
+''' % LIST_DEVICES
+
+
+class TestXflashRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.xflash = os.path.join(self.tmp, 'xflash')
+        with open(self.xflash, 'w') as f:
+            f.write(XFLASH)
+        os.chmod(self.xflash, 0o755)
+        self.state = os.path.join(self.tmp, 'state')
+        os.mkdir(self.state)
+        os.environ['XFLASH_DIR'] = self.state
+        self.addCleanup(os.environ.pop, 'XFLASH_DIR')
+        self.log_dir = os.path.join(self.tmp, 'logs')
+        self.steps = xflash_runner.xflash_steps('SOMANET-C22.xn', erase=True, xe_path='app.xe')
+
+    def adapters(self, n):
+        os.environ['XFLASH_ADAPTERS'] = str(n)
+        self.addCleanup(os.environ.pop, 'XFLASH_ADAPTERS')
+
+    def calls(self):
+        with open(os.path.join(self.state, 'calls')) as f:
+            return sorted(f.read().splitlines())
+
+    def test_list_adapters(self):
+        self.assertEqual(xflash_runner.list_adapters(self.xflash), [
+            {'id': 0, 'name': 'XMOS XTAG-3', 'adapter_id': '2PXBQ3PZ', 'devices': 'P[0]'},
+            {'id': 1, 'name': 'XMOS XTAG-3', 'adapter_id': '8RDC2WJY', 'devices': 'P[0]'},
+            {'id': 2, 'name': 'XMOS XTAG-2', 'adapter_id': 'LX1Q5A7N', 'devices': None},
+        ])
+
+    def test_list_adapters_error(self):
+        with self.assertRaises(ExceptionXflash):
+            xflash_runner.list_adapters(os.path.join(self.tmp, 'missing'))
+
+    def test_station(self):
+        # Adapters without a connected device are not used
+        self.adapters(2)
+        t0 = time.time()
+        results = xflash_runner.run_station(self.steps, log_dir=self.log_dir, xflash=self.xflash, timeout=10)
+
+        self.assertLess(time.time() - t0, 5)
+        self.assertEqual([r['adapter_id'] for r in results], ['2PXBQ3PZ', '8RDC2WJY'])
+        for res in results:
+            self.assertIsNone(res['error'])
+            self.assertEqual(list(res['steps']), ['erase', 'write'])
+            with open(res['log']) as f:
+                log = f.read()
+            self.assertIn('Step --erase-all on %s' % res['adapter_id'], log)
+            self.assertIn('$ %s --adapter-id %s --write-all app.xe --target-file SOMANET-C22.xn'
+                          % (self.xflash, res['adapter_id']), log)
+        self.assertEqual(self.calls(), ['2PXBQ3PZ --erase-all', '2PXBQ3PZ --write-all',
+                                        '8RDC2WJY --erase-all', '8RDC2WJY --write-all'])
+
+    def test_failed_step(self):
+        self.adapters(2)
+        good, bad = xflash_runner.run_station(self.steps, ['GOOD', 'BAD'], self.log_dir, self.xflash, timeout=10)
+
+        self.assertIsNone(good['error'])
+        self.assertEqual(bad['error'], 'erase failed (exit code 2)')
+        self.assertEqual(list(bad['steps']), ['erase'])
+        self.assertEqual(self.calls(), ['BAD --erase-all', 'GOOD --erase-all', 'GOOD --write-all'])
+
+    def test_timeout(self):
+        # The only adapter waits for a second one, which never starts
+        self.adapters(2)
+        res = xflash_runner.run_adapter('2PXBQ3PZ', self.steps, self.tmp, self.xflash, timeout=0.5)
+        self.assertEqual(res['error'], 'erase failed (see log)')
+        self.assertEqual(list(res['steps']), ['erase'])
+
+
+if __name__ == '__main__':
+    unittest.main()
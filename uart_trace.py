@@ -0,0 +1,330 @@
+#!/usr/bin/python3
+
+"""
+    Binary trace of serial traffic
+
+    TracingSerial wraps a serial port and records every read, write, open, close and buffer reset
+    with a timestamp. Records are packed into a preallocated buffer and written to disk by a
+    background thread. ReplayTransport opens ReplaySerial ports, which play a trace back, so a
+    session of UARTFWUploader/YModem can be reproduced offline.
+
+    File format: MAGIC, header (version, start time in ns since epoch), then records of
+    <event: u8> <time since previous record in us: u32> <length: u16> <data>
+"""
+
+import sys
+import json
+import time
+import queue
+import struct
+import threading
+
+MAGIC = b'UTRC'
+VERSION = 1
+HEADER = struct.Struct('<HQ')
+RECORD = struct.Struct('<BIH')
+MAX_DATA = 0xffff
+MAX_DELTA = 0xffffffff
+
+# Events
+TX = 0
+RX = 1
+OPEN = 2
+CLOSE = 3
+RESET = 4
+EVENT_NAMES = {TX: 'TX', RX: 'RX', OPEN: 'OPEN', CLOSE: 'CLOSE', RESET: 'RESET'}
+
+
+class ExceptionTrace(Exception):
+    pass
+
+
+class ExceptionReplay(ExceptionTrace):
+    pass
+
+
+class TraceWriter(object):
+    """
+    Writes records into one of two preallocated buffers. A full buffer is handed to a background
+    thread, which writes it to the file, while recording continues in the other one.
+    """
+
+    def __init__(self, path, buffer_size=1 << 20):
+        """
+        :param path: Trace file
+        :type path: str
+        :param buffer_size: Size of each of both buffers in bytes
+        :type buffer_size: int
+        """
+        self._file = open(path, 'wb')
+        self._start = time.time_ns()
+        self._file.write(MAGIC + HEADER.pack(VERSION, self._start))
+        self._last = time.perf_counter_ns()
+        self._buffer_size = max(buffer_size, RECORD.size + MAX_DATA)
+        self._free = queue.Queue()
+        self._free.put(bytearray(self._buffer_size))
+        self._buf = bytearray(self._buffer_size)
+        self._pos = 0
+        self._full = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='UARTTrace', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._full.get()
+            if item is None:
+                break
+            buf, size = item
+            self._file.write(memoryview(buf)[:size])
+            self._free.put(buf)
+
+    def _swap(self):
+        self._full.put((self._buf, self._pos))
+        # Blocks only, if the writer is a whole buffer behind
+        self._buf = self._free.get()
+        self._pos = 0
+
+    def record(self, event, data=b''):
+        """
+        Record an event.
+        :param event: TX, RX, OPEN, CLOSE or RESET
+        :type event: int
+        :param data: Payload. Longer data is split into several records.
+        :type data: bytes
+        """
+        with self._lock:
+            now = time.perf_counter_ns()
+            delta = min((now - self._last) // 1000, MAX_DELTA)
+            self._last = now
+            view = memoryview(data)
+            while True:
+                chunk = view[:MAX_DATA]
+                view = view[MAX_DATA:]
+                if self._pos + RECORD.size + len(chunk) > self._buffer_size:
+                    self._swap()
+                RECORD.pack_into(self._buf, self._pos, event, delta, len(chunk))
+                self._pos += RECORD.size
+                self._buf[self._pos:self._pos + len(chunk)] = chunk
+                self._pos += len(chunk)
+                delta = 0
+                if not len(view):
+                    break
+
+    def close(self):
+        """
+        Write remaining records and close the file.
+        """
+        with self._lock:
+            if self._file.closed:
+                return
+            self._swap()
+            self._full.put(None)
+            self._thread.join()
+            self._file.close()
+
+
+def read_trace(path):
+    """
+    Read a trace file.
+    :param path: Trace file
+    :type path: str
+    :return: Generator of (seconds since start, event, data)
+    :rtype: generator
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ExceptionTrace('"%s" is not a trace file' % path)
+        version, _ = HEADER.unpack(f.read(HEADER.size))
+        if version != VERSION:
+            raise ExceptionTrace('Unsupported trace version %d' % version)
+        t = 0
+        while True:
+            head = f.read(RECORD.size)
+            if len(head) < RECORD.size:
+                break
+            event, delta, size = RECORD.unpack(head)
+            t += delta
+            yield t / 1e6, event, f.read(size)
+
+
+class TracingSerial(object):
+    """
+    Serial port wrapper, which records all traffic. All other attributes are passed through.
+    """
+
+    def __init__(self, port, trace):
+        """
+        :param port: Opened serial port
+        :type port: serial.Serial
+        :param trace: Trace to record into
+        :type trace: TraceWriter
+        """
+        self._port = port
+        self._trace = trace
+        trace.record(OPEN, json.dumps({'port': port.port, 'baudrate': port.baudrate,
+                                       'timeout': port.timeout}).encode())
+
+    def read(self, size=1):
+        data = self._port.read(size)
+        self._trace.record(RX, data)
+        return data
+
+    def write(self, data):
+        self._trace.record(TX, data)
+        return self._port.write(data)
+
+    def reset_input_buffer(self):
+        self._trace.record(RESET, b'i')
+        return self._port.reset_input_buffer()
+
+    def reset_output_buffer(self):
+        self._trace.record(RESET, b'o')
+        return self._port.reset_output_buffer()
+
+    def close(self):
+        self._trace.record(CLOSE)
+        return self._port.close()
+
+    def __getattr__(self, name):
+        return getattr(self._port, name)
+
+
+class TracingTransport(object):
+    """
+    Factory with the signature of serial.Serial, which returns TracingSerial ports.
+    All ports opened by one transport record into the same trace.
+    """
+
+    def __init__(self, path, serial_class=None, buffer_size=1 << 20):
+        if serial_class is None:
+            import serial
+            serial_class = serial.Serial
+        self._serial_class = serial_class
+        self.trace = TraceWriter(path, buffer_size)
+
+    def __call__(self, *args, **kwargs):
+        return TracingSerial(self._serial_class(*args, **kwargs), self.trace)
+
+    def close(self):
+        self.trace.close()
+
+
+class ReplayTransport(object):
+    """
+    Factory with the signature of serial.Serial, which returns ReplaySerial ports.
+    Every opened port continues at the position of the trace, where the previous one was closed.
+    """
+
+    def __init__(self, path, strict=True, realtime=False):
+        """
+        :param path: Trace file
+        :type path: str
+        :param strict: Raise ExceptionReplay, if written data differs from the trace
+        :type strict: bool
+        :param realtime: Sleep the recorded time before each received chunk
+        :type realtime: bool
+        """
+        self.records = [(t, event, data) for t, event, data in read_trace(path)]
+        self.pos = 0
+        self.strict = strict
+        self.realtime = realtime
+
+    def __call__(self, *args, **kwargs):
+        self._skip(OPEN)
+        return ReplaySerial(self, kwargs.get('timeout'))
+
+    def _next(self):
+        return self.records[self.pos] if self.pos < len(self.records) else (None, None, b'')
+
+    def _skip(self, event):
+        if self._next()[1] == event:
+            self.pos += 1
+
+
+class ReplaySerial(object):
+
+    def __init__(self, transport, timeout=None):
+        self._transport = transport
+        self.timeout = timeout
+        self._pending = b''
+        self._last_t = None
+
+    def _fill(self):
+        """
+        Load the data of the next RX records, if no TX is expected before them.
+        """
+        tr = self._transport
+        while not self._pending:
+            t, event, data = tr._next()
+            if event != RX:
+                return
+            if tr.realtime and self._last_t is not None:
+                time.sleep(max(0, t - self._last_t))
+            self._last_t = t
+            tr.pos += 1
+            self._pending = data
+            if not data:
+                # Recorded timeout
+                return
+
+    @property
+    def in_waiting(self):
+        self._fill()
+        return len(self._pending)
+
+    def read(self, size=1):
+        self._fill()
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+    def write(self, data):
+        tr = self._transport
+        # Unread data of the trace was dropped by the original session as well
+        self._pending = b''
+        while tr._next()[1] in (RX, RESET):
+            tr.pos += 1
+        t, event, expected = tr._next()
+        if event != TX:
+            raise ExceptionReplay('Write of %r, but trace has no more writes' % bytes(data))
+        tr.pos += 1
+        if tr.strict and bytes(data) != expected:
+            raise ExceptionReplay('Write of %r at %.6f s, but trace has %r' % (bytes(data), t, expected))
+        return len(data)
+
+    def reset_input_buffer(self):
+        self._pending = b''
+        self._transport._skip(RESET)
+
+    def reset_output_buffer(self):
+        self._transport._skip(RESET)
+
+    def close(self):
+        self._pending = b''
+        tr = self._transport
+        while tr._next()[1] in (RX, RESET):
+            tr.pos += 1
+        tr._skip(CLOSE)
+
+
+def _printable(data):
+    return ''.join(chr(c) if 32 <= c < 127 else '.' for c in data)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Print a serial trace recorded with fw_updater_uart.py --trace')
+    parser.add_argument('trace', help='Trace file')
+    parser.add_argument('-x', '--hex', dest='hex', action='store_true', help='Print data as hex')
+
+    args = parser.parse_args()
+    try:
+        for t, event, data in read_trace(args.trace):
+            text = data.hex() if args.hex else _printable(data)
+            print('%12.6f %-5s %5d %s' % (t, EVENT_NAMES.get(event, event), len(data), text))
+    except ExceptionTrace as e:
+        print('Error:', e, file=sys.stderr)
+        sys.exit(1)
+    except BrokenPipeError:
+        pass
@@ -11,32 +11,27 @@ if [ $# -eq 0 ]
 fi
 
 
+SCRIPT=$(readlink -f "$0")
+SCRIPTPATH=$(dirname "$SCRIPT")
+
 PATH_FILE=$1
 if [ $# -eq 2 ]
 then
     TARGET=$2
-
-    if [ $TARGET == "c22" ]
-    then
-        TARGET_FILE="SOMANET-C22.xn"
-    elif [ $TARGET == "c2x" ]
-    then
-        TARGET_FILE="SOMANET-CoreC2X.xn"
-    else    
-        echo "Wrong target"
-        echo "Use 'c22' or 'c2x'"
-        exit 1
-    fi
 else
-    TARGET_FILE="SOMANET-CoreC2X.xn"
+    TARGET="c2x"
 fi
 
-XTIMECOMPOSER=14.3
+# Resolve alias (c22, c2x, ...) to .xn file, see "target_registry.py list"
+TARGET_FILE=$(python3 "$SCRIPTPATH/target_registry.py" path "$TARGET")
+if [ $? -ne 0 ]
+then
+    echo "Wrong target"
+    exit 1
+fi
 
-TARGET_PATH="targets"
-SCRIPT=$(readlink -f "$0")
-SCRIPTPATH=$(dirname "$SCRIPT")
+XTIMECOMPOSER=14.3
 
 
-xflash --write-all $PATH_FILE --target-file $SCRIPTPATH/$TARGET_PATH/$TARGET_FILE
+xflash --write-all $PATH_FILE --target-file "$TARGET_FILE"
 
@@ -0,0 +1,192 @@
+#!/usr/bin/python3
+
+"""
+    SOMANET xflash station runner
+
+    Flash one board per xTAG adapter concurrently. Adapters are enumerated with
+    "xflash --list-devices", every adapter with a connected device gets a job, which
+    runs its steps (erase and/or write) one after another with "xflash --adapter-id".
+    Output of every adapter goes into its own log file.
+"""
+
+import os
+import re
+import sys
+import time
+import logging
+import subprocess as sp
+from concurrent.futures import ThreadPoolExecutor
+
+from target_registry import get_registry, ExceptionTarget
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+logger = logging.getLogger(__name__)
+
+XFLASH = os.environ.get('XFLASH', 'xflash')
+
+# Line of "xflash --list-devices":  0   XMOS XTAG-3   2PXBQ3PZ   P[0]
+re_adapter = re.compile(r'^\s*(\d+)\s+(.+?)(?:\t|\s{2,})\s*(\S+)\s+(.+?)\s*$')
+
+
+class ExceptionXflash(Exception):
+    pass
+
+
+def list_adapters(xflash=XFLASH):
+    """
+    Enumerate xTAG adapters.
+    :param xflash: xflash executable
+    :type xflash: str
+    :return: Adapters with "id", "name", "adapter_id" and "devices" (None if no board is connected)
+    :rtype: list
+    """
+    try:
+        out = sp.run([xflash, '--list-devices'], stdout=sp.PIPE, stderr=sp.STDOUT,
+                     universal_newlines=True, timeout=30)
+    except (OSError, sp.TimeoutExpired) as e:
+        raise ExceptionXflash('Cannot list devices: %s' % e)
+    if out.returncode != 0:
+        raise ExceptionXflash('Cannot list devices: %s' % out.stdout.strip())
+
+    adapters = []
+    for line in out.stdout.splitlines():
+        m = re_adapter.match(line)
+        if m:
+            devices = m.group(4)
+            adapters.append({'id': int(m.group(1)), 'name': m.group(2), 'adapter_id': m.group(3),
+                             'devices': None if devices == 'None' else devices})
+    return adapters
+
+
+def xflash_steps(target_file, erase=False, xe_path=None):
+    """
+    Build the xflash arguments of a pipeline. Every step is one xflash call.
+    :param target_file: Path to .xn file
+    :type target_file: str
+    :param erase: Erase the flash first
+    :type erase: bool
+    :param xe_path: Write this .xe file
+    :type xe_path: str
+    :return: List of (step name, arguments)
+    :rtype: list
+    """
+    steps = []
+    if erase:
+        steps.append(('erase', ['--erase-all', '--target-file', target_file]))
+    if xe_path:
+        steps.append(('write', ['--write-all', xe_path, '--target-file', target_file]))
+    return steps
+
+
+def run_adapter(adapter_id, steps, log_dir, xflash=XFLASH, timeout=None, log_file=None):
+    """
+    Run all steps on one adapter. The pipeline stops at the first failed step.
+    :param adapter_id: Serial number of the adapter
+    :type adapter_id: str
+    :param steps: Steps returned by xflash_steps()
+    :type steps: list
+    :param log_dir: Directory of log files
+    :type log_dir: str
+    :param timeout: Timeout of a single step in seconds
+    :type timeout: float
+    :param log_file: Name of the log file. Default is xflash-<adapter_id>.log.
+    :type log_file: str
+    :return: Result with duration per step, log file and error message
+    :rtype: dict
+    """
+    res = {'adapter_id': adapter_id, 'steps': {}, 'error': None,
+           'log': os.path.join(log_dir, log_file or 'xflash-%s.log' % adapter_id)}
+    t0 = time.time()
+    with open(res['log'], 'w') as log:
+        for name, args in steps:
+            cmd = [xflash, '--adapter-id', adapter_id] + args
+            log.write('$ %s\n' % ' '.join(cmd))
+            log.flush()
+            t_step = time.time()
+            try:
+                ret = sp.call(cmd, stdout=log, stderr=sp.STDOUT, stdin=sp.DEVNULL, timeout=timeout)
+            except (OSError, sp.TimeoutExpired) as e:
+                ret = None
+                log.write('%s\n' % e)
+            res['steps'][name] = round(time.time() - t_step, 3)
+            if ret != 0:
+                res['error'] = '%s failed (%s)' % (name, 'exit code %d' % ret if ret is not None else 'see log')
+                break
+    res['duration'] = round(time.time() - t0, 3)
+    return res
+
+
+def run_station(steps, adapters=None, log_dir='.', xflash=XFLASH, timeout=None):
+    """
+    Run the same pipeline on all adapters concurrently.
+    :param steps: Steps returned by xflash_steps()
+    :type steps: list
+    :param adapters: Serial numbers of adapters. Default is every adapter with a connected device.
+    :type adapters: list
+    :return: Result per adapter, see run_adapter()
+    :rtype: list
+    """
+    if not adapters:
+        adapters = [a['adapter_id'] for a in list_adapters(xflash) if a['devices']]
+    if not adapters:
+        raise ExceptionXflash('No adapter with connected device found')
+
+    os.makedirs(log_dir, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=len(adapters)) as executor:
+        return list(executor.map(lambda a: run_adapter(a, steps, log_dir, xflash, timeout), adapters))
+
+
+def _print_result(res):
+    steps = ', '.join('%s %.2f s' % s for s in res['steps'].items())
+    if res['error']:
+        logger.error('%s: FAILED! %s [%s] see %s' % (res['adapter_id'], res['error'], steps, res['log']))
+    else:
+        logger.info('%s: %.2f s [%s]' % (res['adapter_id'], res['duration'], steps))
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description='Flash boards on all xTAG adapters concurrently')
+    parser.add_argument('-t', '--target', dest='target', default='c2x', help='Target alias, see "target_registry.py list"')
+    parser.add_argument('-e', '--erase', dest='erase', action='store_true', help='Erase flash (before writing)')
+    parser.add_argument('-w', '--write', dest='xe', help='Write this .xe file')
+    parser.add_argument('-a', '--adapter', dest='adapters', nargs='+', metavar='ADAPTER_ID',
+                        help='Use only these adapters. Default: all adapters with a connected device')
+    parser.add_argument('-l', '--list', dest='list', action='store_true', help='List adapters and exit')
+    parser.add_argument('-o', '--log-dir', dest='log_dir', default='.', help='Directory of per adapter log files')
+    parser.add_argument('--timeout', dest='timeout', type=float, help='Timeout of a single xflash call in seconds')
+    parser.add_argument('-s', '--summary', dest='summary', help='Write results to JSON file')
+
+    args = parser.parse_args()
+
+    try:
+        if args.list:
+            for a in list_adapters():
+                logger.info('%d  %-16s %-12s %s' % (a['id'], a['name'], a['adapter_id'], a['devices']))
+            sys.exit(0)
+
+        if not args.erase and not args.xe:
+            parser.error('Nothing to do, use -e and/or -w')
+        if args.xe and not os.path.isfile(args.xe):
+            parser.error('"%s" does not exist' % args.xe)
+
+        target_file = get_registry().get(args.target)['file']
+        steps = xflash_steps(target_file, args.erase, args.xe and os.path.abspath(args.xe))
+        t0 = time.time()
+        results = run_station(steps, args.adapters, args.log_dir, timeout=args.timeout)
+    except (ExceptionXflash, ExceptionTarget) as e:
+        logger.error('Error: %s' % e)
+        sys.exit(1)
+
+    for res in results:
+        _print_result(res)
+    logger.info('%d of %d boards done in %.2f s' % (sum(1 for r in results if not r['error']), len(results), time.time() - t0))
+
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump({'duration': round(time.time() - t0, 3), 'adapters': results}, f, indent=4)
+
+    if any(res['error'] for res in results):
+        sys.exit(1)
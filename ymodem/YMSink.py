@@ -0,0 +1,85 @@
+import os
+import queue
+import threading
+
+
+class WriteBehindFile(object):
+    """
+    File sink, which writes in a background thread. write() only queues the data, so the receiver
+    can ACK a packet without waiting for the storage. The file is preallocated with the announced
+    size and synced once on close().
+    """
+
+    def __init__(self, path, size=None, queue_size=64):
+        """
+        :param path: Path of the file
+        :type path: str
+        :param size: Expected size in bytes, used to preallocate the file
+        :type size: int
+        :param queue_size: Max number of queued chunks. write() blocks, if the writer is this far behind.
+        :type queue_size: int
+        """
+        self._file = open(path, 'wb+')
+        if size:
+            try:
+                os.posix_fallocate(self._file.fileno(), 0, size)
+            except (AttributeError, OSError):
+                # Not supported by platform or file system
+                pass
+        self._queue = queue.Queue(queue_size)
+        self._error = None
+        self._written = 0
+        self._thread = threading.Thread(target=self._run, name='YModemWriter', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                break
+            if self._error:
+                # Drain the queue, so write() never blocks after an error
+                continue
+            try:
+                self._file.write(data)
+                self._written += len(data)
+            except OSError as e:
+                self._error = e
+
+    def write(self, data):
+        """
+        Queue data. Errors of the writer thread are raised by the next write() or close().
+        """
+        if self._error:
+            raise self._error
+        self._queue.put(bytes(data))
+        return len(data)
+
+    def close(self):
+        """
+        Wait for the writer, cut preallocated space and sync the file to disk.
+        """
+        if self._file.closed:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        try:
+            if not self._error:
+                self._file.truncate(self._written)
+                self._file.flush()
+                os.fsync(self._file.fileno())
+        finally:
+            self._file.close()
+        if self._error:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.close()
+        except OSError:
+            # Do not hide the exception of the with block
+            if exc_type is None:
+                raise
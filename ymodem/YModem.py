@@ -11,6 +11,7 @@ import logging
 logging.basicConfig(level=logging.INFO, format='%(message)s')  # , format = '%(asctime)s - %(levelname)s - %(message)s')
 
 from .YMTask import SendTask, ReceiveTask
+from .YMSink import WriteBehindFile
 
 # ymodem data header byte
 SOH = b'\x01'
@@ -77,8 +78,60 @@ class YModem:
                     self.log.warn("Expected " + hex(ord(ch)) + ", but got " + hex(ord(c)))
         return 0
 
-    def send(self, data_stream, data_name, data_size, retry=20, callback=None):
+    @staticmethod
+    def _make_reader(data, data_size=None):
+        """
+        Returns a read(size) function and the data size.
+        data can be a stream with read(), bytes-like (bytes, bytearray, memoryview) or an iterable of chunks.
+        Chunks are re-blocked, so every read returns "size" bytes until the end of the data.
+        If the size of a stream or iterable is unknown, the data is read into memory.
+        """
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            view = memoryview(data).cast('B')
+            pos = [0]
+
+            def read(size):
+                chunk = view[pos[0]:pos[0] + size]
+                pos[0] += len(chunk)
+                return chunk.tobytes()
+            return read, len(view)
+
+        if hasattr(data, 'read'):
+            if data_size is None:
+                return YModem._make_reader(data.read())
+            return data.read, data_size
+
+        if data_size is None:
+            return YModem._make_reader(b''.join(data))
+
+        chunks = iter(data)
+        buf = bytearray()
+
+        def read(size):
+            while len(buf) < size:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                buf.extend(chunk)
+            block = bytes(buf[:size])
+            del buf[:size]
+            return block
+        return read, data_size
+
+    def send(self, data_stream, data_name, data_size=None, retry=20, callback=None):
+        """
+        Send data.
+        :param data_stream: Stream with read(), bytes-like object or iterable of byte chunks
+        :param data_name: Name of the file on the receiver side
+        :type data_name: str
+        :param data_size: Size in bytes. Optional for bytes-like objects. Without it, streams and
+                          iterables are read into memory first.
+        :type data_size: int
+        :return: Number of sent bytes, negative on error
+        :rtype: int
+        """
         packet_size = 1024
+        read, data_size = self._make_reader(data_stream, data_size)
 
         # [<<< CRC]
         self.wait_for_next(CRC)
@@ -118,7 +171,7 @@ class YModem:
         error_count = 0
         sequence = 1
         while True:
-            data = data_stream.read(packet_size)
+            data = read(packet_size)
 
             if not data:
                 self.log.debug('EOF')
@@ -222,7 +275,88 @@ class YModem:
                 else:
                     self.log.warn("Expected 0x04(EOT), but got " + hex(ord(c)))
 
-    def recv_file(self, root_path, callback=None):
+    def recv_file(self, root_path, callback=None, write_behind=False, queue_size=64):
+        """
+        Receive a file into "root_path". The file name is the one announced by the sender.
+        :param write_behind: Write in a background thread, so packets are ACKed without waiting for the disk.
+                             The file is preallocated with the announced size and synced once at the end.
+        :type write_behind: bool
+        :param queue_size: Max number of packets the write-behind thread may lag behind
+        :type queue_size: int
+        :return: Number of received bytes
+        :rtype: int
+        """
+        files = []
+
+        def open_file(file_name, file_size):
+            path = os.path.join(root_path, file_name)
+            if write_behind:
+                files.append(WriteBehindFile(path, file_size, queue_size))
+            else:
+                files.append(open(path, 'wb+'))
+            return files[-1].write
+
+        try:
+            received = self._recv(open_file, callback)
+        except BaseException:
+            self._close_files(files, failed=True)
+            raise
+        self._close_files(files)
+        return received
+
+    def _close_files(self, files, failed=False):
+        """
+        Close all received files. If the transfer failed, errors of close() are only logged,
+        so they do not hide the error of the transfer.
+        """
+        error = None
+        for f in files:
+            try:
+                f.close()
+            except OSError as e:
+                self.log.error('Closing received file failed: %s' % e)
+                error = error or e
+        if error and not failed:
+            raise error
+
+    @staticmethod
+    def _make_writer(sink):
+        """
+        Returns a write(data) function for a sink.
+        sink can be a writable stream (e.g. BytesIO), a bytearray or memoryview, which is filled from
+        the start, or a callable, which gets every chunk.
+        """
+        if hasattr(sink, 'write'):
+            return sink.write
+        if callable(sink):
+            return sink
+        if isinstance(sink, (bytearray, memoryview)):
+            pos = [0]
+
+            def write(data):
+                end = pos[0] + len(data)
+                if end > len(sink) and isinstance(sink, memoryview):
+                    raise ValueError('Buffer too small for received data')
+                sink[pos[0]:end] = data
+                pos[0] = end
+            return write
+        raise TypeError('Unsupported sink %r' % type(sink))
+
+    def recv(self, sink, callback=None):
+        """
+        Receive data into memory or a custom sink instead of a file.
+        :param sink: Writable stream, bytearray/memoryview (preallocate with the expected size)
+                     or callable, which gets every chunk.
+        :return: Number of received bytes. Name and size announced by the sender are in self.rt.
+        :rtype: int
+        """
+        write = self._make_writer(sink)
+        return self._recv(lambda file_name, file_size: write, callback)
+
+    def _recv(self, open_sink, callback=None):
+        """
+        Receive data. open_sink(file_name, file_size) is called after packet 0 and returns the write function.
+        """
         while True:
             self.putc(CRC)
             self.log.debug("<<< CRC")
@@ -293,7 +427,7 @@ class YModem:
                             self.log.debug("TASK: " + file_name + " " + data_size + " Bytes")
                             self.rt.set_task_name(file_name)
                             self.rt.set_task_size(int(data_size))
-                            file_stream = open(os.path.join(root_path, file_name), 'wb+')
+                            write = open_sink(file_name, int(data_size))
                             FIRST_PACKET_RECEIVED = True
                             sequence = (sequence + 1) % 0x100
 
@@ -308,11 +442,14 @@ class YModem:
                             # last data packet
                             self.log.debug(f"Task packet: {self.rt.get_task_packets()}, {self.rt.get_valid_received_packets()}")
                             self.log.debug(f"Valid recv bytes: {self.rt.get_valid_received_bytes()}")
-                            if self.rt.get_valid_received_packets() == self.rt.get_task_packets():
-                                valid_data = valid_data[:self.rt.get_last_valid_packet_size()]
+                            # The last packet is found by the announced size, so 128 and 1024 byte
+                            # packets can be mixed and sizes may be a multiple of the packet size
+                            remaining = self.rt.get_task_size() - self.rt.get_valid_received_bytes()
+                            if len(valid_data) >= remaining:
+                                valid_data = valid_data[:remaining]
                                 WAIT_FOR_EOT = True
                             self.rt.add_valid_received_bytes(len(valid_data))
-                            file_stream.write(valid_data)
+                            write(valid_data)
                             self.putc(ACK)
                             self.log.debug("<<< ACK")
 
@@ -325,7 +462,6 @@ class YModem:
                             self.putc(ACK)
                             self.log.debug("<<< ACK")
                             break
-        file_stream.close()
         self.log.debug("Task Done!")
         self.log.debug("File: " + self.rt.get_task_name())
         self.log.debug("Size: " + str(self.rt.get_task_size()) + " Bytes")